@@ -1,7 +1,14 @@
-from preprocess import transpose, encode_song
+from preprocess import transpose, transpose_encoded_song, shift_symbols
 import music21 as m21
-from typing import Tuple, Dict, List
-import os
+import numpy as np
+from typing import Tuple, Dict, List, NamedTuple
+from metrics import timed, SEED_QUANTIZATION_CHANGES
+from storage import artifact_storage, uploaded_melody_name
+
+STEPS_PER_QUARTER_LENGTH = 4  # The 16th note grid seeds are snapped to.
+API_STEPS_PER_UNIT = 2  # The frontend's starts & durations are in 8th notes.
+QUANTIZATION_TOLERANCE = 1e-6  # Times this close to a grid line aren't counted as changed.
+MIDI_PITCH_RANGE = (0, 127)
 
 
 class GenerationError(Exception):
@@ -20,85 +27,224 @@ class InvalidNoteDurationError(Exception):
         super().__init__(self.message)
 
 
-def process_api_sequence(sequence: List[Dict[str, int]], song_id: str, verbose: bool = False) -> Tuple[str, int]:
+class InvalidNotePitchError(Exception):
+    """Exception raised for notes without a valid MIDI pitch."""
+
+    def __init__(self, message="The provided song contains an invalid Note pitch."):
+        self.message = message
+        super().__init__(self.message)
+
+
+class QuantizedSeed(NamedTuple):
+    """A seed snapped to the 16th note grid, with a record of what had to be changed to get there."""
+    symbols: List[str]  # In time series notation.
+    starts: np.ndarray  # Each kept note's start, pitch & duration, in time steps.
+    pitches: np.ndarray
+    durations: np.ndarray
+    changes: Dict[str, int]
+
+    @property
+    def length(self) -> int:
+        """The seed's length in time steps, exactly the length of its encoding."""
+        return len(self.symbols)
+
+
+def quantize_notes(starts, pitches, durations, steps_per_unit: float = STEPS_PER_QUARTER_LENGTH) -> QuantizedSeed:
+    """
+    Snaps a monophonic melody's notes to the 16th note grid in one vectorised pass, then encodes it.
+    Starts & ends are rounded to the nearest time step, so a note's timing error never builds up over the melody.
+    Every note lasts at least one time step, and is cut short where the next note starts. Of several notes starting on
+    the same time step, only the first is kept. Gaps between notes become rests.
+
+    :param starts: Each note's start time.
+    :param pitches: Each note's MIDI pitch.
+    :param durations: Each note's duration.
+    :param steps_per_unit: Time steps per unit of the starts & durations, e.g. 4 for quarter lengths.
+
+    :return: The quantized seed. Its changes count the notes given, the notes whose start moved, whose duration
+             changed, and which were dropped, and the largest start movement in hundredths of a time step.
+    :raises: InvalidNoteDurationError, if there are no notes, a start or duration isn't a finite number, or a duration
+             is negative.
+    :raises: InvalidNotePitchError, if a pitch isn't a whole number within the MIDI range.
+    """
+    try:
+        exact_starts = np.asarray(starts, dtype=np.float64) * steps_per_unit
+        exact_durations = np.asarray(durations, dtype=np.float64) * steps_per_unit
+    except (TypeError, ValueError):
+        raise InvalidNoteDurationError("The provided song contains a note start or duration which isn't a number.")
+    try:
+        exact_pitches = np.asarray(pitches, dtype=np.float64)
+    except (TypeError, ValueError):
+        raise InvalidNotePitchError("The provided song contains a note pitch which isn't a number.")
+    if len(exact_starts) == 0:
+        raise InvalidNoteDurationError("The provided song doesn't contain any notes.")
+    # NaN & infinity would otherwise be rounded to arbitrary integer time steps.
+    if not (np.isfinite(exact_starts).all() and np.isfinite(exact_durations).all()):
+        raise InvalidNoteDurationError("The provided song contains a note start or duration which isn't a number.")
+    if (exact_durations < 0).any():
+        raise InvalidNoteDurationError("The provided song contains a note with a negative duration.")
+    if not np.isfinite(exact_pitches).all():
+        raise InvalidNotePitchError("The provided song contains a note pitch which isn't a number.")
+    if not ((exact_pitches == np.round(exact_pitches)).all() and (exact_pitches >= MIDI_PITCH_RANGE[0]).all()
+            and (exact_pitches <= MIDI_PITCH_RANGE[1]).all()):
+        raise InvalidNotePitchError(f"The provided song contains a note pitch which isn't a whole number from "
+                                    f"{MIDI_PITCH_RANGE[0]} to {MIDI_PITCH_RANGE[1]}.")
+    pitches = exact_pitches.astype(np.int64)
+
+    order = np.argsort(exact_starts, kind="stable")
+    exact_starts, exact_durations, pitches = exact_starts[order], exact_durations[order], pitches[order]
+    grid_starts = np.maximum(np.rint(exact_starts), 0).astype(np.int64)
+    grid_ends = np.rint(exact_starts + exact_durations).astype(np.int64)
+
+    # Only the first of several notes snapped onto the same time step is kept.
+    kept = np.ones(len(grid_starts), dtype=bool)
+    kept[1:] = grid_starts[1:] != grid_starts[:-1]
+    kept_starts = grid_starts[kept]
+    next_starts = np.append(kept_starts[1:], np.iinfo(np.int64).max)
+    kept_durations = np.minimum(np.maximum(grid_ends[kept], kept_starts + 1), next_starts) - kept_starts
+
+    start_shifts = np.abs(grid_starts - exact_starts)
+    changes = {"notes": len(grid_starts),
+               "moved_starts": int((start_shifts > QUANTIZATION_TOLERANCE).sum()),
+               "changed_durations": int((np.abs(kept_durations - exact_durations[kept])
+                                         > QUANTIZATION_TOLERANCE).sum()),
+               "dropped_notes": int((~kept).sum()),
+               "max_start_shift_hundredths": int(np.rint(start_shifts.max() * 100))}
+
+    # Encode, every time step is a prolongation unless a note or rest starts on it.
+    length = int(kept_starts[-1] + kept_durations[-1])
+    coverage = np.zeros(length + 1, dtype=np.int64)
+    np.add.at(coverage, kept_starts, 1)
+    np.add.at(coverage, kept_starts + kept_durations, -1)
+    is_note = np.cumsum(coverage)[:length] > 0
+    rest_starts = np.flatnonzero(~is_note & np.append(True, is_note[:-1]))
+    symbols = np.full(length, "_", dtype=object)
+    symbols[rest_starts] = "r"
+    symbols[kept_starts] = pitches[kept].astype(str)
+
+    return QuantizedSeed(symbols=symbols.tolist(), starts=kept_starts, pitches=pitches[kept],
+                         durations=kept_durations, changes=changes)
+
+
+def quantize_score(song: m21.stream.base.Score) -> QuantizedSeed:
+    """
+    Quantizes a music21 score's notes, taking the highest pitch of any chord.
+    :param song: The song to quantize.
+    :return: The quantized seed.
+    """
+    notes = list(song.flatten().notes)
+    return quantize_notes(starts=[float(note.offset) for note in notes],
+                          pitches=[max(pitch.midi for pitch in note.pitches) for note in notes],
+                          durations=[float(note.duration.quarterLength) for note in notes])
+
+
+def report_quantization(seed: QuantizedSeed, verbose: bool = False) -> None:
+    """
+    Records a quantized seed's changes in the metrics, printing them if any notes were changed.
+    :param seed: The quantized seed.
+    :param verbose: Enable additional print statements for debug purposes. Default is False.
+    """
+    for change in ("moved_starts", "changed_durations", "dropped_notes"):
+        if seed.changes[change]:
+            SEED_QUANTIZATION_CHANGES.inc(seed.changes[change], change=change)
+    if verbose and any(seed.changes[change] for change in ("moved_starts", "changed_durations", "dropped_notes")):
+        print(f"Quantized seed to the 16th note grid: of {seed.changes['notes']} notes, "
+              f"{seed.changes['moved_starts']} moved, {seed.changes['changed_durations']} changed length and "
+              f"{seed.changes['dropped_notes']} were dropped.")
+
+
+def process_api_sequence(sequence: List[Dict[str, float]], song_id: str,
+                         verbose: bool = False) -> Tuple[str, int, QuantizedSeed]:
     """
     preprocesses a single api-supplied sequence into a MIDI file.
+    The sequence is quantized to the 16th note grid first, so the saved MIDI file, the seed and the offset all agree.
 
-    :param sequence: The sequence to save as a MIDI file.
+    :param sequence: The sequence to save as a MIDI file, events of {"start", "pitch", "duration"} in 8th notes.
     :param song_id: The ID of the song.
     :param verbose: Enable additional print statements for debug purposes. Default is False.
-    :return: Tuple, The path of the saved MIDI file and the length to offset the generation by.
+    :return: Tuple, The path of the saved MIDI file, the length to offset the generation by in time steps (16th
+             notes), and the quantized seed, which can be generated from without parsing the MIDI file.
+    :raises: InvalidNoteDurationError, if the sequence doesn't contain any notes, or contains invalid timings.
+    :raises: InvalidNotePitchError, if the sequence contains an invalid pitch.
     """
 
-    # Turn the sequence into a 2d array
-    sequence = [list(event.values()) for event in sequence]
-    # Create a new stream
-    stream = m21.stream.Stream()
-
+    # Missing values become None, which quantize_notes rejects as not being a number.
+    seed = quantize_notes(starts=[event.get("start") for event in sequence],
+                          pitches=[event.get("pitch") for event in sequence],
+                          durations=[event.get("duration") for event in sequence],
+                          steps_per_unit=API_STEPS_PER_UNIT)
+    report_quantization(seed, verbose)
 
-    last_event_end = 0  # Used for keeping track of rest durations
-    total_duration = 0  # Used for keeping track of total inputted melody duration. Allows for extension length to work.
-
-    # Work out rests and note durations
-    for event_index, event in enumerate(sequence):
-        event_start = event[0]
-        event_pitch = event[1]
-        event_duration = event[2]
-        event_duration_in_quarter_lengths = event_duration / 2
-        total_duration += event_duration_in_quarter_lengths  # Add length to total duration
-        # Handle rests
-        if last_event_end < event_start:
-            rest_duration_in_quarter_lengths = (event_start - last_event_end)/2
-            rest = m21.note.Rest(quarterLength=rest_duration_in_quarter_lengths)
-            # Length is halved here to convert to quarter lengths
-            stream.append(rest)
-            total_duration += rest_duration_in_quarter_lengths  # Add rest length to total duration
-        # Handle notes
-        note = m21.note.Note(event_pitch, quarterLength=event_duration_in_quarter_lengths)
-        stream.append(note)
-
-        last_event_end = event_start + event_duration
+    # Create a new stream of the quantized notes, with rests in any gaps.
+    stream = m21.stream.Stream()
+    last_event_end = 0
+    for start, pitch, duration in zip(seed.starts, seed.pitches, seed.durations):
+        if last_event_end < start:
+            stream.append(m21.note.Rest(quarterLength=(start - last_event_end) / STEPS_PER_QUARTER_LENGTH))
+        stream.append(m21.note.Note(int(pitch), quarterLength=duration / STEPS_PER_QUARTER_LENGTH))
+        last_event_end = start + duration
 
     # Save the stream as a MIDI file
-    midi_file_path = os.path.join("uploaded-files", f"unextended_melody_{song_id}.mid")
+    midi_file_path = artifact_storage.uploaded.path_for(uploaded_melody_name(song_id), create=True)
     stream.write("midi", midi_file_path)
 
     if verbose:
         print(f"Saved MIDI file to {midi_file_path}")
 
-    return midi_file_path, total_duration
+    return midi_file_path, seed.length, seed
+
+
+def preprocess_seed(seed: QuantizedSeed, verbose: bool = False) -> Tuple[str, m21.interval.Interval]:
+    """
+    Preprocesses a quantized seed, transposing it into C major/A minor with integer semitone shifts.
+    :param seed: The quantized seed, e.g. from process_api_sequence.
+    :param verbose: bool, optional, Enable additional print statements for debug purposes. Default is False.
+    :return: tuple, (encoded_api_song, reverse_transposition), see preprocess_midi.
+    """
+    with timed("transpose"):
+        encoded_api_song, reverse_semitones = transpose_encoded_song(" ".join(seed.symbols), verbose)
 
+    return encoded_api_song, m21.interval.Interval(reverse_semitones)
 
-def preprocess_midi(midi_path, verbose=False) -> Tuple[str, m21.interval.Interval]:
+
+def preprocess_midi(midi_path, verbose=False, use_music21_key=False) -> Tuple[str, m21.interval.Interval]:
     """
     Preprocesses a single supplied MIDI Song into a file, typically supplied from the Flask API.
+    By default, the key is estimated from the encoded song and transposed with integer semitone shifts,
+    which is much faster than music21's key analysis & score transposition for short seeds.
+    Notes are quantized to the 16th note grid rather than rejected, see quantize_notes.
 
     :param midi_path: str, The directory of the file to preprocess.
     :param verbose: bool, optional, Enable additional print statements for debug purposes. Default is False.
+    :param use_music21_key: bool, optional, Use music21 to find the key & transpose the score instead. Default is False.
 
     :return: tuple, (encoded_api_song, reverse_transposition),
              The fully preprocessed API song and the transposition required to return the song to its original key.
     """
 
     # Parse Supplied MIDI song.
-    api_supplied_song = m21.converter.parse(midi_path)
+    with timed("parse_midi"):
+        api_supplied_song = m21.converter.parse(midi_path)
 
-    """
-        Turns out the frontend is able to provide note durations that are not in the ACCEPTABLE_DURATIONS list.
-        This may cause issues. Some issues still arise, which will be dealt with.
-    
-    # Filter out songs with non-acceptable durations (only using 1/16, 1/8, 1/4, 1/2, 1 notes)
-    if not has_acceptable_durations(api_supplied_song, ACCEPTABLE_DURATIONS, verbose):
-        raise InvalidNoteDurationError("The provided song contains an invalid Note length.")
-    """
+    if use_music21_key:
+        # Transpose Songs into CMaj/Amin for standardisation
+        with timed("transpose"):
+            api_supplied_song, reverse_transposition = transpose(api_supplied_song, verbose)
+
+        # Encode songs with music time series representation
+        with timed("encode_song"):
+            seed = quantize_score(api_supplied_song)
+        report_quantization(seed, verbose)
 
-    # Transpose Songs into CMaj/Amin for standardisation
-    api_supplied_song, reverse_transposition = transpose(api_supplied_song, verbose)
+        return " ".join(seed.symbols), reverse_transposition
 
     # Encode songs with music time series representation
-    encoded_api_song = encode_song(song=api_supplied_song, time_step=0.25, verbose=verbose)
+    with timed("encode_song"):
+        seed = quantize_score(api_supplied_song)
+    report_quantization(seed, verbose)
 
-    return encoded_api_song, reverse_transposition
+    # Transpose encoded Songs into CMaj/Amin for standardisation
+    return preprocess_seed(seed, verbose)
 
 
 def undo_transpose(song, interval, verbose=False) -> m21.stream.base.Score:
@@ -120,14 +266,27 @@ def undo_transpose(song, interval, verbose=False) -> m21.stream.base.Score:
     return untransposed_song
 
 
+def undo_transpose_symbols(symbols: List[str], interval: m21.interval.Interval) -> List[str]:
+    """
+    Un-Transposes time series symbols from their generated key into the song's original key, as provided.
+    A lightweight alternative to undo_transpose for partial melodies which haven't been converted into a stream yet.
+
+    :param symbols: list of str, The time series symbols to un-transpose ("64", "_", "r", ...).
+    :param interval: music21.interval.Interval, The interval to un-transpose the symbols by.
+
+    :return: list of str, The un-transposed symbols.
+    """
+
+    return shift_symbols(symbols, int(interval.semitones))
+
+
 def has_melody_generated(song_id: str) -> bool:
     """
     Checks if the melody has been generated and saved.
     :param song_id: str The ID of the melody.
     :return bool: True if the melody has been generated, False otherwise.
     """
-    path = os.path.join("generated-melodies", f"extended_melody_{song_id}.mid")
-    return os.path.exists(path)
+    return artifact_storage.has_result(song_id)
 
 
 def add_failed_generation(song_id: str) -> None:
@@ -136,22 +295,14 @@ def add_failed_generation(song_id: str) -> None:
     :param song_id: str The ID of the song.
     :return: None
     """
-    with open("failed_generations.txt", "a") as file:
-        file.write(f"{song_id}\n")
-    file.close()
+    artifact_storage.add_failed_generation(song_id)
     return None
 
 
 def check_failed_generation(song_id: str) -> bool:
     """
-    Checks if the generation has failed by reading the top 5 lines.
+    Checks if the generation has failed, out of every recent failure which hasn't expired.
     :param song_id: str The ID of the song.
     :return: bool True if the generation has failed, False otherwise.
     """
-
-    # Get the top 5 lines of the file
-    with open("failed_generations.txt", "r") as file:
-        lines = [full_id[:-1:] for full_id in file.readlines()[-5::]]
-    file.close()
-    # Check if the song_id is in these lines
-    return song_id in lines
+    return artifact_storage.check_failed_generation(song_id)
@@ -1,70 +1,195 @@
 import base64
+import io
+import os
 import threading
-from typing import NoReturn
-from flask import Flask, request, send_file, jsonify, make_response
+from collections import OrderedDict
+from typing import NoReturn, Tuple, List, Dict, Optional, Union
+from flask import Flask, request, send_file, jsonify, make_response, Response, stream_with_context
 from flask_cors import CORS
-from generator import Generator, streamify_melody
-from training import MODEL_FILEPATH
+import music21 as m21
+from generator import streamify_melody
+from registry import ModelRegistry, LoadedModel, BundleError, read_bundle, set_active_version
 from preprocess import SEQUENCE_LENGTH
-from api_tools import preprocess_midi, undo_transpose, GenerationError, has_melody_generated, process_api_sequence, \
-    add_failed_generation, check_failed_generation
+from api_tools import preprocess_seed, undo_transpose, GenerationError, has_melody_generated, process_api_sequence, \
+    add_failed_generation, check_failed_generation, undo_transpose_symbols, QuantizedSeed, InvalidNoteDurationError, \
+    InvalidNotePitchError
 import time
 import json
+from metrics import timed, render_metrics, JOBS_QUEUED, JOBS_ACTIVE, JOBS_TOTAL
+from storage import artifact_storage, generated_melody_name
 
 UPLOAD_FOLDER_PATH = "uploaded-files"
-
-generator = Generator(MODEL_FILEPATH)
+STREAM_CHUNK_STEPS = 16  # Number of LSTM events sent per streamed chunk, a bar of 16th notes.
+MAX_JOB_METADATA = 1000  # Number of recent jobs whose metadata is kept in memory.
+ADMIN_TOKEN = os.environ.get("LSTMUSIC_ADMIN_TOKEN")  # Admin routes are disabled unless this is set.
+
+model_registry = ModelRegistry(verbose=True)
+model_registry.load_initial()
+model_registry.watch()
+artifact_storage.start_cleanup()
+job_metadata: "OrderedDict[str, Dict]" = OrderedDict()
 app = Flask(__name__)
 CORS(app)
 
 
-def generate_to_server(base_file_path: str, file_number: str, temperature: float, extension_length: int,
-                       tempo: int) -> NoReturn:
+def record_job(song_id: str, loaded_model: LoadedModel, cache_key: str, temperature: float, extension_length: int,
+               tempo: int, seed: QuantizedSeed) -> None:
+    """
+    Records a job's parameters and the model version generating it, keeping only the most recent jobs.
+    :param song_id: The unique identifier of the melody.
+    :param loaded_model: The model the job is generated with.
+    :param cache_key: The job's result cache key, see request_cache_key.
+    :param temperature: The temperature used while generating the melody.
+    :param extension_length: The length of the melody to generate in LSTM event units.
+    :param tempo: The tempo of the melody.
+    :param seed: The quantized seed, whose changes are reported so the client can tell its melody was altered.
+    """
+    job_metadata[song_id] = {'model_version': loaded_model.version,
+                             'cache_key': cache_key,
+                             'temperature': temperature,
+                             'extension_length': extension_length,
+                             'tempo': tempo,
+                             'seed_length': seed.length,
+                             'quantization': seed.changes}
+    while len(job_metadata) > MAX_JOB_METADATA:
+        job_metadata.popitem(last=False)
+
+
+def request_cache_key(loaded_model: LoadedModel, seed: QuantizedSeed, temperature: float, extension_length: int,
+                      tempo: int) -> str:
+    """
+    Creates a generation request's result cache key from everything which determines its melody,
+    so identical requests to the same model version share a key whatever their song id.
+    :param loaded_model: The model the job is generated with.
+    :param seed: The quantized seed, two seeds which quantize to the same notes share a key.
+    :param temperature: The temperature used while generating the melody.
+    :param extension_length: The length of the melody to generate in LSTM event units.
+    :param tempo: The tempo of the melody.
+    :return: The cache key.
+    """
+    return loaded_model.cache_key(seed.symbols, temperature, extension_length, tempo)
+
+
+def is_deterministic(temperature: float) -> bool:
+    """
+    Only a temperature of 0 always picks the most likely symbol, any other temperature samples a new melody every
+    time, so resubmitting the same seed must generate again rather than reuse the stored result.
+    :param temperature: The temperature used while generating the melody.
+    :return: Whether identical requests always generate the same melody, so its result can be reused.
+    """
+    return temperature == 0
+
+
+def generate_to_server(seed: QuantizedSeed, file_number: str, temperature: float, extension_length: int,
+                       tempo: int, loaded_model: LoadedModel, cache_key: Optional[str] = None) -> NoReturn:
     """
     Extends a given base melody and saves it to the server with a unique identifier.
     defined as a separate function for use in a separate thread to allow for main thread to respond to client.
     :param temperature: The temperature to use while generating the melody.
     :param extension_length: The length of the melody to generate in LSTM event units.
-    :param base_file_path: the path of the MIDI melody to extend.
+    :param seed: the quantized melody to extend, from process_api_sequence.
     :param file_number: the unique identifier of the melody, used for output.
     :param tempo: The tempo of the melody.
+    :param loaded_model: The model to generate with, fixed when the job is accepted so a model swap doesn't affect it.
+    :param cache_key: The job's result cache key, the saved melody is reused by identical requests.
+                      Default is None, the melody was sampled randomly so isn't reused.
     :return: None
     :raises: IOError, GenerationError, Exception
     """
 
-    if base_file_path is None or file_number is None:
-        print("Error in after_request: file_path or file_number is None.")
+    if seed is None or file_number is None:
+        print("Error in after_request: seed or file_number is None.")
 
     print("Generating Melody, please wait...")
+    JOBS_QUEUED.dec()
+    JOBS_ACTIVE.inc()
     try:
-        supplied_seed, reverse_transposition = preprocess_midi(base_file_path)
-        generated_melody = generator.generate_melody(seed=supplied_seed,
-                                                     number_of_steps=extension_length,
-                                                     max_sequence_length=SEQUENCE_LENGTH,
-                                                     temperature=temperature)
-    except Exception as e:
-        # Prevent melody from being saved if generation fails.
-        add_failed_generation(file_number)
-        raise GenerationError(f"Failed to generate melody: {e}")
+        try:
+            supplied_seed, reverse_transposition = preprocess_seed(seed)
+            with timed("generate_melody"):
+                generated_melody = loaded_model.generator.generate_melody(seed=supplied_seed,
+                                                                          number_of_steps=extension_length,
+                                                                          max_sequence_length=SEQUENCE_LENGTH,
+                                                                          temperature=temperature)
+        except Exception as e:
+            # Prevent melody from being saved if generation fails.
+            add_failed_generation(file_number)
+            JOBS_TOTAL.inc(outcome="failed")
+            raise GenerationError(f"Failed to generate melody: {e}")
+
+        try:
+            with timed("streamify_melody"):
+                generated_melody_stream = streamify_melody(generated_melody, tempo=tempo)
+            with timed("undo_transpose"):
+                untransposed_melody = undo_transpose(generated_melody_stream, reverse_transposition)
+            with timed("write_midi"):
+                midi_data = m21.midi.translate.streamToMidiFile(untransposed_melody).writestr()
+                artifact_storage.save_result(file_number, midi_data)
+            if cache_key is not None:
+                artifact_storage.cache_result(cache_key, file_number)
+
+        except IOError as e:
+            print(f"Failed MIDI conversion & saving.")
+            JOBS_TOTAL.inc(outcome="failed")
+            raise e
+
+        except Exception as e:
+            print(f"Failed to save melody to server.")
+            JOBS_TOTAL.inc(outcome="failed")
+            raise e
+    finally:
+        JOBS_ACTIVE.dec()
+
+    JOBS_TOTAL.inc(outcome="complete")
+    print("Generation and post-processing complete, song has been saved..")
+    return None
 
 
+def parse_generation_request() -> Tuple[List[Dict[str, int]], float, int, int]:
+    """
+    Parses the body of a generation request sent by the frontend.
+    The body is raw text in the format "sequence;;;temperature;;;extension length in bars;;;tempo".
+    :return: Tuple, (sequence, temperature, extension_length_in_bars, tempo)
+    :raises: IOError
+    """
 
+    # Get data from request.
     try:
-        output_path = f"generated-melodies/extended_melody_{file_number}.mid"
-        generated_melody_stream = streamify_melody(generated_melody, tempo=tempo)
-        untransposed_melody = undo_transpose(generated_melody_stream, reverse_transposition)
-        untransposed_melody.write("midi", output_path)
-
+        response_data = str(request.data)
     except IOError as e:
-        print(f"Failed MIDI conversion & saving.")
+        print(f"IOError: Failed to find data from fetch request.")
         raise e
 
-    except Exception as e:
-        print(f"Failed to save melody to server.")
-        raise e
+    response_items = response_data.split(';;;')
+    temperature = float(response_items[1])
 
-    print("Generation and post-processing complete, song has been saved..")
-    return None
+    tempo = response_items[3][:-1:]
+    if tempo == '':
+        tempo = 120
+    else:
+        tempo = int(tempo)
+
+    # Decode Song.
+    raw_sequence = response_items[0][2::]
+    sequence = json.loads(raw_sequence)
+
+    extension_length_in_bars = int(response_items[2])
+
+    return sequence, temperature, extension_length_in_bars, tempo
+
+
+def invalid_sequence_response(song_id: str, error: Union[InvalidNoteDurationError, InvalidNotePitchError]) -> Response:
+    """
+    Records a request whose sequence couldn't be quantized as a failed generation, and creates its response.
+    :param song_id: The unique identifier of the melody.
+    :param error: The error raised while quantizing the sequence.
+    :return: A 400 response explaining why the sequence was rejected, with the melody's ID.
+    """
+    add_failed_generation(song_id)
+    JOBS_TOTAL.inc(outcome="invalid")
+    resp = jsonify({'status': 400, 'message': f"{error.message};{song_id}"})
+    resp.status_code = 400
+    return resp
 
 
 # --- Site routes ---
@@ -89,43 +214,41 @@ def generate_melody_new():
     song_id = str(int(time.time()))
 
 
-    # Get data from request.
+    # Get data from request & save the sequence as a MIDI file to the server.
+    sequence, temperature, extension_length_in_bars, tempo = parse_generation_request()
     try:
-        response_data = str(request.data)
-    except IOError as e:
-        print(f"IOError: Failed to find data from fetch request.")
-        raise e
-
-    response_items = response_data.split(';;;')
-    temperature = float(response_items[1])
-
-    tempo = response_items[3][:-1:]
-    if tempo == '':
-        tempo = 120
-    else:
-        tempo = int(tempo)
-
-    # Decode Song and save it as a MIDI file to server.
-    raw_sequence = response_items[0][2::]
-
-    sequence = json.loads(raw_sequence)
-
-    # TODO: Save the sequence as a MIDI file to the server.
-    unextended_midi_file_path, extension_offset = process_api_sequence(sequence, song_id=song_id, verbose=True)
+        with timed("process_api_sequence"):
+            unextended_midi_file_path, extension_offset, seed = process_api_sequence(sequence, song_id=song_id,
+                                                                                     verbose=True)
+    except (InvalidNoteDurationError, InvalidNotePitchError) as e:
+        return invalid_sequence_response(song_id, e)
 
     # Calculate Extension Length for LSTM, Measured in 'series events' which represent a 16th of a note.
-    extension_length_in_bars = int(response_items[2])
     extension_length_for_lstm = extension_length_in_bars * 16  # Convert to 16th notes
     offset_extension_length_for_lstm = int(extension_length_for_lstm + extension_offset)  # Add offset to extension length
 
-    # Start Melody Generation
-
-    generation_thread = threading.Thread(target=generate_to_server, args=(unextended_midi_file_path,
-                                                                          song_id,
-                                                                          temperature,
-                                                                          offset_extension_length_for_lstm,
-                                                                          tempo))
-    generation_thread.start()
+    loaded_model = model_registry.current()
+    cache_key = request_cache_key(loaded_model, seed, temperature, offset_extension_length_for_lstm, tempo)
+    record_job(song_id, loaded_model, cache_key, temperature, offset_extension_length_for_lstm, tempo, seed)
+
+    # Sampled melodies are always generated afresh, the key is only recorded in the job's metadata.
+    result_cache_key = cache_key if is_deterministic(temperature) else None
+    cached_midi_data = artifact_storage.find_cached_result(cache_key) if result_cache_key is not None else None
+    if cached_midi_data is not None:
+        # An identical request has already been generated by this model version, reuse its melody.
+        artifact_storage.save_result(song_id, cached_midi_data)
+        JOBS_TOTAL.inc(outcome="cached")
+    else:
+        # Start Melody Generation
+        generation_thread = threading.Thread(target=generate_to_server, args=(seed,
+                                                                              song_id,
+                                                                              temperature,
+                                                                              offset_extension_length_for_lstm,
+                                                                              tempo,
+                                                                              loaded_model,
+                                                                              result_cache_key))
+        JOBS_QUEUED.inc()
+        generation_thread.start()
 
 
     # Create & return response message
@@ -136,6 +259,100 @@ def generate_melody_new():
     return resp
 
 
+@app.route('/stream_melody', methods=['POST'])
+def stream_melody():
+    """
+        Handles streamed melody generation requests.
+        Takes the same request body as /generate_melody_new, but instead of generating in a separate thread,
+        responds with newline delimited JSON chunks of generated symbols as soon as each bar has been sampled.
+        Allows the frontend to start playback while later bars are still being generated.
+
+        Each chunk is of the form {"chunk": int, "symbols": [str, ...]}, in the song's original key.
+        The final line is {"done": true, "song_id": str, "tempo": int, "model_version": str, "quantization": dict},
+        quantization counting the seed's notes which were moved, shortened/lengthened or dropped to fit the 16th grid.
+        If generation fails part way through, the final line is {"error": str, "song_id": str} instead, and the job
+        is reported as failed by /check_status.
+
+        Optional query parameters:
+        long_context=true carries the model's recurrent state across the whole melody instead of re-reading the last
+        SEQUENCE_LENGTH symbols every step, so long extensions keep hearing the seed and each step is cheaper.
+        summary_bars=n, with long_context, periodically rebuilds the state from the n most repeated earlier bars.
+        :return: A streamed response with the mimetype application/x-ndjson, or a 400 for an invalid sequence or
+                 parameters.
+    """
+
+    song_id = str(int(time.time()))
+    long_context = request.args.get('long_context', 'false').lower() in ('1', 'true')
+    summary_bars = request.args.get('summary_bars', 0, type=int)
+    # Parameters are checked before the seed is processed, so a bad request doesn't write any artifacts.
+    if summary_bars < 0 or (summary_bars and not long_context):
+        return make_response(jsonify({'status': 400, 'message': "summary_bars needs long_context, "
+                                                                "and can't be negative."}), 400)
+    loaded_model = model_registry.current()
+    if summary_bars and loaded_model.generator.encoding == "events":
+        return make_response(jsonify({'status': 400, 'message': "summary_bars needs a time series model."}), 400)
+
+    sequence, temperature, extension_length_in_bars, tempo = parse_generation_request()
+    try:
+        with timed("process_api_sequence"):
+            unextended_midi_file_path, extension_offset, seed = process_api_sequence(sequence, song_id=song_id,
+                                                                                     verbose=True)
+    except (InvalidNoteDurationError, InvalidNotePitchError) as e:
+        return invalid_sequence_response(song_id, e)
+    extension_length_for_lstm = int(extension_length_in_bars * 16 + extension_offset)
+
+    try:
+        supplied_seed, reverse_transposition = preprocess_seed(seed)
+    except Exception as e:
+        add_failed_generation(song_id)
+        raise GenerationError(f"Failed to preprocess melody: {e}")
+
+    # Streams are always sampled afresh, as the result cache holds finished MIDI files rather than symbols.
+    cache_key = request_cache_key(loaded_model, seed, temperature, extension_length_for_lstm, tempo)
+    record_job(song_id, loaded_model, cache_key, temperature, extension_length_for_lstm, tempo, seed)
+
+    if long_context:
+        symbols = loaded_model.generator.stream_long_melody(seed=supplied_seed,
+                                                            number_of_steps=extension_length_for_lstm,
+                                                            temperature=temperature, summary_bars=summary_bars,
+                                                            max_sequence_length=SEQUENCE_LENGTH)
+    else:
+        symbols = loaded_model.generator.stream_melody(seed=supplied_seed, number_of_steps=extension_length_for_lstm,
+                                                       max_sequence_length=SEQUENCE_LENGTH, temperature=temperature)
+
+    def generate_chunks():
+        chunk = []
+        chunk_number = 0
+        JOBS_ACTIVE.inc()
+        try:
+            for symbol in symbols:
+                chunk.append(symbol)
+                if len(chunk) == STREAM_CHUNK_STEPS:
+                    yield json.dumps({'chunk': chunk_number,
+                                      'symbols': undo_transpose_symbols(chunk, reverse_transposition)}) + "\n"
+                    chunk = []
+                    chunk_number += 1
+
+            # Flush any remaining symbols which don't fill a whole bar.
+            if chunk:
+                yield json.dumps({'chunk': chunk_number,
+                                  'symbols': undo_transpose_symbols(chunk, reverse_transposition)}) + "\n"
+
+            yield json.dumps({'done': True, 'song_id': song_id, 'tempo': tempo,
+                              'model_version': loaded_model.version, 'quantization': seed.changes}) + "\n"
+            JOBS_TOTAL.inc(outcome="complete")
+        except Exception as e:
+            # The response has already started, so the failure is reported in the stream rather than a status code.
+            print(f"Failed to stream melody: {e}")
+            add_failed_generation(song_id)
+            JOBS_TOTAL.inc(outcome="failed")
+            yield json.dumps({'error': f"Failed to generate melody: {e}", 'song_id': song_id}) + "\n"
+        finally:
+            JOBS_ACTIVE.dec()
+
+    return Response(stream_with_context(generate_chunks()), mimetype="application/x-ndjson")
+
+
 @app.route('/check_status/<song_id>', methods=['POST', 'GET'])
 def check_status(song_id):
 
@@ -156,10 +373,83 @@ def check_status(song_id):
         return response
 
 
+@app.route('/job_info/<song_id>', methods=['GET'])
+def job_info(song_id):
+    """
+        Returns a recent job's parameters and the model version which generated it.
+        :return: The job's metadata as JSON, or a 404 if the job isn't known.
+    """
+    metadata = job_metadata.get(song_id)
+    if metadata is None:
+        return make_response('unknown job', 404)
+    return jsonify(metadata)
+
+
+def is_admin_request() -> bool:
+    return ADMIN_TOKEN is not None and request.headers.get("X-Admin-Token") == ADMIN_TOKEN
+
+
+@app.route('/admin/model', methods=['GET'])
+def model_status():
+    """
+        Reports the model version being served, any version being loaded and the last load error.
+        :return: The registry status as JSON.
+    """
+    if not is_admin_request():
+        return make_response('forbidden', 403)
+    return jsonify(model_registry.status())
+
+
+@app.route('/admin/model', methods=['POST'])
+def load_model():
+    """
+        Loads a registered model version in the background, switching to it once it has warmed up.
+        Jobs already running finish on the previous version.
+        Takes a JSON body of the form {"version": str, "activate": bool}, activating also switches
+        every server watching the registry and persists the choice across restarts.
+        :return: A 202 response once loading has started.
+    """
+    if not is_admin_request():
+        return make_response('forbidden', 403)
+    body = request.get_json(silent=True) or {}
+    version = body.get('version')
+    if version is None:
+        return make_response('missing version', 400)
+    try:
+        if body.get('activate', False):
+            set_active_version(version)
+        else:
+            # Fail fast on unknown versions, rather than only reporting them through the status route.
+            read_bundle(version, verify=False)
+    except BundleError as e:
+        return make_response(str(e), 404)
+
+    model_registry.load_in_background(version)
+    resp = jsonify({'status': 202, 'message': f"Loading model version {version}."})
+    resp.status_code = 202
+    return resp
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """
+        Exposes per-stage latencies, per-step LSTM latencies, job counts and cache hit rates
+        in the Prometheus text format.
+        :return: The rendered metrics as plain text.
+    """
+    response = make_response(render_metrics(), 200)
+    response.mimetype = "text/plain"
+    return response
+
+
 @app.route('/download_file/<song_id>')
 def download_file(song_id):
-    filename = f"generated-melodies/extended_melody_{song_id}.mid"
-    return send_file(filename, as_attachment=True)
+    # Recently generated melodies are served from memory.
+    midi_data = artifact_storage.load_result(song_id)
+    if midi_data is None:
+        return make_response('not found', 404)
+    return send_file(io.BytesIO(midi_data), mimetype="audio/midi", as_attachment=True,
+                     download_name=generated_melody_name(song_id))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,631 @@
+"""
+Reproducible, offline benchmark suite for preprocessing, training input creation, generation, melody quality and the
+API.
+
+Uses a synthetic KERN/MIDI corpus and a small, randomly initialised model so that it runs on a CPU without any
+dataset downloads. Results are written to a JSON file which can be compared against the results of another commit.
+
+Usage:
+    python benchmark.py --output benchmark-results/new.json
+    python benchmark.py --compare benchmark-results/old.json benchmark-results/new.json
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Callable, Any
+
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'  # Disables Tensorflow's Debugging Information
+import keras
+import music21 as m21
+import numpy as np
+from preprocess import (load_songs,
+                        preprocess,
+                        flatten_dataset_to_single_file,
+                        create_song_mappings,
+                        generate_training_sequences,
+                        encode_song,
+                        estimate_key,
+                        measure_key_agreement,
+                        training_steps_saved,
+                        SEQUENCE_LENGTH,
+                        KERN_DATASET_PATH,
+                        NOTE_MAPPINGS_PATH,
+                        ACCEPTABLE_DURATIONS
+                        )
+from training import build_model, LOSS_FN, LEARNING_RATE
+
+BENCHMARK_RESULTS_DIR = "benchmark-results"
+RANDOM_SEED = 6679
+
+# Synthetic melodies stay within an octave and a half of middle C, in C Major.
+SYNTHETIC_PITCHES = [60, 62, 64, 65, 67, 69, 71, 72, 74, 76, 77, 79]
+KERN_DURATIONS = {0.25: "16", 0.5: "8", 0.75: "8.", 1: "4", 1.5: "4.", 2: "2", 3: "2.", 4: "1"}
+KERN_PITCH_NAMES = ["c", "c#", "d", "d#", "e", "f", "f#", "g", "g#", "a", "a#", "b"]
+
+
+# --- Synthetic Data ---
+
+def _random_bar(rng: random.Random) -> List[tuple]:
+    """
+    Creates a single 4/4 bar of random (midi pitch, quarter length) events using acceptable durations.
+    :param rng: The random number generator to use.
+    :return: The bar's events, a pitch of None represents a rest.
+    """
+    events = []
+    remaining = 4
+    while remaining > 0:
+        duration = rng.choice([d for d in ACCEPTABLE_DURATIONS if d <= remaining])
+        pitch = None if rng.random() < 0.1 else rng.choice(SYNTHETIC_PITCHES)
+        events.append((pitch, duration))
+        remaining -= duration
+    return events
+
+
+def _kern_token(pitch: int, duration: float) -> str:
+    """
+    Converts a single event into a **kern token, e.g. (60, 1) -> "4c".
+    :param pitch: The midi pitch, or None for a rest.
+    :param duration: The quarter length of the event.
+    :return: The kern token.
+    """
+    if pitch is None:
+        return f"{KERN_DURATIONS[duration]}r"
+    name = KERN_PITCH_NAMES[pitch % 12]
+    octave = pitch // 12 - 1
+    # kern uses lower case letters from middle C upwards, repeating the letter for each extra octave.
+    if octave >= 4:
+        name = name[0] * (octave - 3) + name[1:]
+    else:
+        name = name[0].upper() * (4 - octave) + name[1:]
+    return f"{KERN_DURATIONS[duration]}{name}"
+
+
+def create_synthetic_corpus(output_path: str, number_of_songs: int, bars_per_song: int = 8,
+                            file_type: str = "krn", seed: int = RANDOM_SEED) -> List[str]:
+    """
+    Writes a synthetic corpus of single part melodies in C Major into a directory.
+
+    :param output_path: The directory to write the corpus to.
+    :param number_of_songs: The number of songs to write.
+    :param bars_per_song: The number of 4/4 bars in each song.
+    :param file_type: "krn" or "mid".
+    :param seed: The random seed, keeps the corpus identical between runs.
+    :return: The paths of the written files.
+    """
+    rng = random.Random(seed)
+    os.makedirs(output_path, exist_ok=True)
+    paths = []
+    for song_number in range(number_of_songs):
+        bars = [_random_bar(rng) for _ in range(bars_per_song)]
+        path = os.path.join(output_path, f"song_{song_number}.{file_type}")
+        if file_type == "krn":
+            lines = ["**kern", "*clefG2", "*k[]", "*C:", "*M4/4"]
+            for bar_number, bar in enumerate(bars):
+                lines.append(f"={bar_number + 1}")
+                lines.extend(_kern_token(pitch, duration) for pitch, duration in bar)
+            lines.extend(["==", "*-"])
+            with open(path, "w") as fp:
+                fp.write("\n".join(lines) + "\n")
+        elif file_type == "mid":
+            stream = m21.stream.Stream()
+            stream.append(m21.key.Key("C"))
+            for bar in bars:
+                for pitch, duration in bar:
+                    if pitch is None:
+                        stream.append(m21.note.Rest(quarterLength=duration))
+                    else:
+                        stream.append(m21.note.Note(pitch, quarterLength=duration))
+            stream.write("midi", path)
+        else:
+            raise ValueError(f"Unsupported synthetic file type: {file_type}")
+        paths.append(path)
+    return paths
+
+
+def create_synthetic_encoded_dataset(output_path: str, number_of_songs: int, song_length: int = 128,
+                                     seed: int = RANDOM_SEED) -> None:
+    """
+    Writes already encoded songs directly in time series notation, skipping music21 entirely.
+    Used to benchmark the stages after preprocessing at sizes where parsing would dominate.
+
+    :param output_path: The directory to write the encoded songs to.
+    :param number_of_songs: The number of encoded songs to write.
+    :param song_length: The number of time steps in each song.
+    :param seed: The random seed.
+    """
+    rng = random.Random(seed)
+    os.makedirs(output_path, exist_ok=True)
+    symbols = [str(pitch) for pitch in SYNTHETIC_PITCHES] + ["r"]
+    for song_number in range(number_of_songs):
+        song = [rng.choice(symbols) if rng.random() < 0.4 else "_" for _ in range(song_length)]
+        song[0] = rng.choice(symbols)
+        with open(os.path.join(output_path, str(song_number)), "w") as fp:
+            fp.write(" ".join(song))
+
+
+def build_synthetic_model(model_path: str, vocabulary_size: int, num_units: List[int] = None) -> None:
+    """
+    Builds and saves a small, randomly initialised model with the same architecture as the real one.
+    :param model_path: Where to save the model.
+    :param vocabulary_size: The vocabulary size of the model.
+    :param num_units: The model's hidden layer sizes. Default is [64].
+    """
+    model = build_model(output_units=vocabulary_size, loss_fn=LOSS_FN, num_units=num_units or [64],
+                        learning_rate=LEARNING_RATE)
+    model.save(model_path)
+
+
+# --- Measurement helpers ---
+
+def _time_call(function: Callable[[], Any], repeats: int = 1) -> Dict[str, float]:
+    """
+    Times a function over a number of repeats.
+    :param function: The function to time.
+    :param repeats: The number of times to call it.
+    :return: The median, min and max wall time in seconds.
+    """
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return {"median_s": statistics.median(timings), "min_s": min(timings), "max_s": max(timings)}
+
+
+def _percentiles(timings: List[float]) -> Dict[str, float]:
+    timings = np.array(timings)
+    return {"mean_s": float(timings.mean()),
+            "p50_s": float(np.percentile(timings, 50)),
+            "p95_s": float(np.percentile(timings, 95)),
+            "p99_s": float(np.percentile(timings, 99))}
+
+
+# --- Benchmarks ---
+
+def benchmark_preprocessing(work_dir: str, number_of_songs: int) -> Dict[str, Any]:
+    """
+    Measures load_songs and preprocess throughput over synthetic KERN and MIDI corpora.
+    """
+    results = {}
+    for file_type in ["krn", "mid"]:
+        corpus_path = os.path.join(work_dir, f"corpus_{file_type}")
+        create_synthetic_corpus(corpus_path, number_of_songs, file_type=file_type)
+
+        load_timing = _time_call(lambda: load_songs(corpus_path, verbose=False))
+
+        encoded_path = os.path.join(work_dir, f"encoded_{file_type}")
+        os.makedirs(encoded_path, exist_ok=True)
+
+        def run_preprocess():
+            for file in os.listdir(encoded_path):
+                os.remove(os.path.join(encoded_path, file))
+            preprocess(dataset_path=corpus_path, output_path=encoded_path)
+
+        preprocess_timing = _time_call(run_preprocess)
+        results[file_type] = {
+            "songs": number_of_songs,
+            "load_songs": load_timing,
+            "load_songs_per_s": number_of_songs / load_timing["median_s"],
+            "preprocess": preprocess_timing,
+            "preprocess_songs_per_s": number_of_songs / preprocess_timing["median_s"],
+        }
+    return results
+
+
+def benchmark_key_estimation(work_dir: str, number_of_songs: int, dataset_path: str = None) -> Dict[str, Any]:
+    """
+    Measures estimate_key's speed against music21's key analysis, and how often the two agree.
+    Uses the real corpus if a dataset path is given, otherwise synthetic songs transposed into random keys.
+    """
+    if dataset_path is not None:
+        songs = load_songs(dataset_path, verbose=False)[:number_of_songs]
+    else:
+        rng = random.Random(RANDOM_SEED)
+        corpus_path = os.path.join(work_dir, "corpus_keys")
+        create_synthetic_corpus(corpus_path, number_of_songs, file_type="krn")
+        songs = [song.transpose(rng.randint(-6, 5)) for song in load_songs(corpus_path, verbose=False)]
+
+    encoded_songs = [encode_song(song) for song in songs]
+    music21_timing = _time_call(lambda: [song.analyze("key") for song in songs])
+    estimate_timing = _time_call(lambda: [estimate_key(encoded_song) for encoded_song in encoded_songs], repeats=5)
+
+    return {"songs": len(songs),
+            "corpus": dataset_path or "synthetic",
+            "music21_analyze_per_song_s": music21_timing["median_s"] / len(songs),
+            "estimate_key_per_song_s": estimate_timing["median_s"] / len(songs),
+            **measure_key_agreement(songs)}
+
+
+def benchmark_flattening(work_dir: str, sizes: List[int]) -> Dict[str, Any]:
+    """
+    Measures how flatten_dataset_to_single_file scales with the number of encoded songs.
+    """
+    results = {}
+    for size in sizes:
+        encoded_path = os.path.join(work_dir, f"flatten_{size}")
+        create_synthetic_encoded_dataset(encoded_path, size)
+        output_path = os.path.join(work_dir, f"flattened_{size}")  # Never written, as save is False.
+        timing = _time_call(lambda: flatten_dataset_to_single_file(encoded_dataset_path=encoded_path,
+                                                                   output_path=output_path,
+                                                                   sequence_length=SEQUENCE_LENGTH), repeats=3)
+        results[str(size)] = timing
+    return results
+
+
+def benchmark_training_sequences(work_dir: str, number_of_songs: int) -> Dict[str, Any]:
+    """
+    Measures the time and peak memory of generate_training_sequences.
+    """
+    encoded_path = os.path.join(work_dir, "training_sequences")
+    create_synthetic_encoded_dataset(encoded_path, number_of_songs)
+    flattened = flatten_dataset_to_single_file(encoded_dataset_path=encoded_path,
+                                               output_path=os.path.join(work_dir, "training_flattened"),
+                                               sequence_length=SEQUENCE_LENGTH)
+    mappings = create_song_mappings(flattened, os.path.join(work_dir, "training_mappings.json"))
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    inputs, targets, vocabulary_size = generate_training_sequences(sequence_length=SEQUENCE_LENGTH,
+                                                                   songs_dataset_string=flattened,
+                                                                   mappings_dictionary=mappings)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    _, sampled_targets, _ = generate_training_sequences(sequence_length=SEQUENCE_LENGTH,
+                                                        songs_dataset_string=flattened,
+                                                        mappings_dictionary=mappings,
+                                                        max_padding_fraction=0.75)
+    sampled_elapsed = time.perf_counter() - start
+
+    return {"songs": number_of_songs,
+            "symbols": len(flattened.split()),
+            "sequences": int(len(targets)),
+            "time_s": elapsed,
+            "peak_memory_mb": peak / 2 ** 20,
+            "inputs_mb": inputs.nbytes / 2 ** 20,
+            "song_aware_sampler": {"sequences": int(len(sampled_targets)),
+                                   "time_s": sampled_elapsed,
+                                   **training_steps_saved(all_windows=len(targets),
+                                                          sampled_windows=len(sampled_targets), batch_size=64)}}
+
+
+def benchmark_event_encoding(work_dir: str, number_of_songs: int) -> Dict[str, Any]:
+    """
+    Compares the number of symbols, so LSTM steps, per bar of the time series & event encodings, and how long
+    converting a flattened dataset to events takes.
+    """
+    from preprocess import time_series_to_events
+
+    encoded_path = os.path.join(work_dir, "event_encoding")
+    create_synthetic_encoded_dataset(encoded_path, number_of_songs)
+    flattened = flatten_dataset_to_single_file(encoded_dataset_path=encoded_path,
+                                               output_path=os.path.join(work_dir, "event_flattened"),
+                                               sequence_length=SEQUENCE_LENGTH)
+    symbols = flattened.split()
+    timing = _time_call(lambda: time_series_to_events(symbols), repeats=3)
+
+    # Delimiters are the same in both encodings, so they're left out of the per bar counts.
+    time_steps = sum(symbol != "/" for symbol in symbols)
+    events = sum(symbol != "/" for symbol in time_series_to_events(symbols))
+    bars = time_steps / 16
+    return {"time_series_symbols_per_bar": time_steps / bars,
+            "event_symbols_per_bar": events / bars,
+            "step_reduction": time_steps / events,
+            "conversion": timing}
+
+
+def benchmark_generation(model_path: str, window_lengths: List[int], steps: int) -> Dict[str, Any]:
+    """
+    Measures per-step generation latency for several context window lengths.
+    """
+    from generator import Generator
+    generator = Generator(model_path)
+    seed = "60 _ 62 _ 64 _ _ _ 65 _ 67 _ _ _ 64 _"
+
+    # Warm up the model, the first predict call builds the graph.
+    generator.generate_melody(seed=seed, number_of_steps=2, max_sequence_length=SEQUENCE_LENGTH, temperature=0.7)
+
+    results = {}
+    for window_length in window_lengths:
+        timings = []
+        step_start = time.perf_counter()
+        for _ in generator.stream_melody(seed=seed, number_of_steps=steps, max_sequence_length=window_length,
+                                         temperature=0.7):
+            now = time.perf_counter()
+            timings.append(now - step_start)
+            step_start = now
+        results[str(window_length)] = {"steps": len(timings), **_percentiles(timings)}
+    return results
+
+
+PERFORMANCE_MODES = {"float32": {},
+                     "xla": {"jit_compile": True},
+                     "bfloat16": {"mixed_precision": True},
+                     "xla_bfloat16": {"jit_compile": True, "mixed_precision": True}}
+
+
+def benchmark_performance_modes(model_path: str, work_dir: str, generation_steps: int, training_songs: int,
+                                training_epochs: int = 2) -> Dict[str, Any]:
+    """
+    Compares the XLA and bfloat16 performance modes against the float32 baseline, for generation and training.
+    Generation: steps per second, and how far each mode's next symbol probabilities drift from float32's.
+    Training: samples per second, and the final loss & accuracy reached in the same number of epochs.
+    """
+    from generator import Generator
+    from training import cpu_supports_bfloat16
+
+    results = {"cpu_supports_bfloat16": cpu_supports_bfloat16(), "generation": {}, "training": {}}
+    seed = "60 _ 62 _ 64 _ _ _ 65 _ 67 _ _ _ 64 _"
+
+    # Generation.
+    baseline = Generator(model_path)
+    vocabulary_size = len(baseline._mappings)
+    rng = np.random.default_rng(RANDOM_SEED)
+    test_windows = rng.integers(0, vocabulary_size, size=(32, SEQUENCE_LENGTH))
+    baseline_probabilities = baseline.model.predict(np.eye(vocabulary_size)[test_windows], verbose=0)
+
+    for mode, options in PERFORMANCE_MODES.items():
+        generator = baseline if mode == "float32" else Generator(model_path, **options)
+        list(generator.stream_melody(seed=seed, number_of_steps=2, max_sequence_length=SEQUENCE_LENGTH,
+                                     temperature=0.7))  # Warm up, traces & compiles the decode step.
+        timing = _time_call(lambda: list(generator.stream_melody(seed=seed, number_of_steps=generation_steps,
+                                                                 max_sequence_length=SEQUENCE_LENGTH,
+                                                                 temperature=0.7)))
+        if generator._predict_step is None:
+            probabilities = baseline_probabilities
+        else:
+            probabilities = np.array([generator._predict_step(window[np.newaxis].astype(np.int32)).numpy()
+                                      for window in test_windows])
+        results["generation"][mode] = {
+            "steps_per_s": generation_steps / timing["median_s"],
+            "max_probability_error": float(np.abs(probabilities - baseline_probabilities).max()),
+            "argmax_agreement": float(np.mean(probabilities.argmax(axis=1) == baseline_probabilities.argmax(axis=1)))
+        }
+
+    # Training.
+    encoded_path = os.path.join(work_dir, "performance_modes")
+    create_synthetic_encoded_dataset(encoded_path, training_songs)
+    flattened = flatten_dataset_to_single_file(encoded_dataset_path=encoded_path,
+                                               output_path=os.path.join(work_dir, "performance_modes_flattened"),
+                                               sequence_length=SEQUENCE_LENGTH)
+    mappings = create_song_mappings(flattened, os.path.join(work_dir, "performance_modes_mappings.json"))
+    inputs, targets, training_vocabulary_size = generate_training_sequences(sequence_length=SEQUENCE_LENGTH,
+                                                                            songs_dataset_string=flattened,
+                                                                            mappings_dictionary=mappings)
+    for mode, options in PERFORMANCE_MODES.items():
+        keras.utils.set_random_seed(RANDOM_SEED)
+        model = build_model(output_units=training_vocabulary_size, loss_fn=LOSS_FN, num_units=[64],
+                            learning_rate=LEARNING_RATE, **options)
+        model.fit(inputs[:256], targets[:256], epochs=1, batch_size=64, verbose=0)  # Warm up & compile.
+        start = time.perf_counter()
+        history = model.fit(inputs, targets, epochs=training_epochs, batch_size=64, verbose=0)
+        elapsed = time.perf_counter() - start
+        results["training"][mode] = {"samples_per_s": len(targets) * training_epochs / elapsed,
+                                     "final_loss": float(history.history["loss"][-1]),
+                                     "final_accuracy": float(history.history["accuracy"][-1])}
+    return results
+
+
+def benchmark_evaluation(model_path: str, work_dir: str, number_of_songs: int, samples: int,
+                         steps: int) -> Dict[str, Any]:
+    """
+    Measures the evaluation metrics' throughput, and the melody quality metrics of each performance mode,
+    so speed changes which hurt quality show up when comparing results.
+    """
+    from evaluation import evaluate_melodies, evaluate_model, split_songs
+    from preprocess import load_mappings
+
+    encoded_path = os.path.join(work_dir, "evaluation_encoded")
+    create_synthetic_encoded_dataset(encoded_path, number_of_songs)
+    flattened = flatten_dataset_to_single_file(encoded_dataset_path=encoded_path,
+                                               output_path=os.path.join(work_dir, "evaluation_flattened"),
+                                               sequence_length=SEQUENCE_LENGTH)
+    songs = split_songs(flattened)
+    mappings = load_mappings(NOTE_MAPPINGS_PATH)
+
+    timing = _time_call(lambda: evaluate_melodies(songs, songs, mappings), repeats=3)
+    results = {"metrics": {**timing, "songs_per_s": len(songs) / timing["median_s"]}, "quality": {}}
+
+    for mode, options in PERFORMANCE_MODES.items():
+        results["quality"][mode] = evaluate_model(model_path, flattened_dataset=flattened,
+                                                  mappings_path=NOTE_MAPPINGS_PATH, samples=samples,
+                                                  number_of_steps=steps, random_seed=RANDOM_SEED,
+                                                  generator_options=options, verbose=False)
+    return results
+
+
+def benchmark_api(model_path: str, work_dir: str, concurrency_levels: List[int], requests_per_level: int,
+                  extension_length_in_bars: int = 1) -> Dict[str, Any]:
+    """
+    Measures end-to-end /stream_melody request latency under concurrent load, using Flask's test client.
+    """
+    import app as api
+    from generator import Generator
+    api.model_registry.serve_generator("benchmark", Generator(model_path))
+    client = api.app.test_client()
+
+    sequence = [{"start": 0, "pitch": 60, "duration": 2}, {"start": 2, "pitch": 64, "duration": 2},
+                {"start": 4, "pitch": 67, "duration": 4}, {"start": 8, "pitch": 72, "duration": 8}]
+    body = f"{json.dumps(sequence)};;;0.7;;;{extension_length_in_bars};;;120".encode()
+
+    def send_request() -> float:
+        start = time.perf_counter()
+        response = client.post("/stream_melody", data=body)
+        response.get_data()  # Consume the whole streamed response.
+        if response.status_code != 200:
+            raise RuntimeError(f"API request failed with status {response.status_code}")
+        return time.perf_counter() - start
+
+    # The API reads and writes relative to its working directory.
+    original_directory = os.getcwd()
+    os.chdir(work_dir)
+    os.makedirs("uploaded-files", exist_ok=True)
+    os.makedirs("generated-melodies", exist_ok=True)
+    results = {}
+    try:
+        send_request()  # Warm up.
+        for concurrency in concurrency_levels:
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                timings = list(executor.map(lambda _: send_request(), range(requests_per_level)))
+            elapsed = time.perf_counter() - start
+            results[str(concurrency)] = {"requests": requests_per_level,
+                                         "requests_per_s": requests_per_level / elapsed,
+                                         **_percentiles(timings)}
+    finally:
+        os.chdir(original_directory)
+    return results
+
+
+# --- Driver ---
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run_benchmarks(quick: bool = False, skip_api: bool = False, verbose: bool = True) -> Dict[str, Any]:
+    """
+    Runs the whole benchmark suite inside a temporary directory.
+
+    :param quick: Use smaller corpora and fewer steps, for a fast sanity check.
+    :param skip_api: Skip the API load benchmark.
+    :param verbose: Enable additional print statements for debug purposes.
+    :return: The results of every benchmark.
+    """
+    random.seed(RANDOM_SEED)
+    np.random.seed(RANDOM_SEED)
+    # The synthetic model's weights are seeded too, so quality metrics are comparable between runs.
+    keras.utils.set_random_seed(RANDOM_SEED)
+
+    with open(NOTE_MAPPINGS_PATH, "r") as fp:
+        vocabulary_size = len(json.load(fp))
+
+    results = {"commit": _git_commit(), "timestamp": time.time(), "quick": quick, "benchmarks": {}}
+    benchmarks = results["benchmarks"]
+    work_dir = tempfile.mkdtemp(prefix="lstmusic-benchmark-")
+    try:
+        model_path = os.path.join(work_dir, "synthetic_model.h5")
+        build_synthetic_model(model_path, vocabulary_size)
+
+        if verbose:
+            print("Benchmarking preprocessing...")
+        benchmarks["preprocessing"] = benchmark_preprocessing(work_dir, number_of_songs=10 if quick else 100)
+
+        if verbose:
+            print("Benchmarking key estimation...")
+        key_corpus = KERN_DATASET_PATH if os.path.isdir(KERN_DATASET_PATH) else None
+        benchmarks["key_estimation"] = benchmark_key_estimation(work_dir, number_of_songs=20 if quick else 200,
+                                                                dataset_path=key_corpus)
+
+        if verbose:
+            print("Benchmarking dataset flattening...")
+        benchmarks["flattening"] = benchmark_flattening(work_dir, sizes=[100, 400] if quick else [100, 400, 1600, 6400])
+
+        if verbose:
+            print("Benchmarking training sequence creation...")
+        benchmarks["training_sequences"] = benchmark_training_sequences(work_dir,
+                                                                        number_of_songs=50 if quick else 500)
+
+        if verbose:
+            print("Benchmarking event encoding...")
+        benchmarks["event_encoding"] = benchmark_event_encoding(work_dir, number_of_songs=50 if quick else 500)
+
+        if verbose:
+            print("Benchmarking generation...")
+        benchmarks["generation"] = benchmark_generation(model_path,
+                                                        window_lengths=[16, 64] if quick else [16, 32, 64, 128],
+                                                        steps=16 if quick else 128)
+
+        if verbose:
+            print("Benchmarking XLA & mixed precision performance modes...")
+        benchmarks["performance_modes"] = benchmark_performance_modes(model_path, work_dir,
+                                                                      generation_steps=32 if quick else 256,
+                                                                      training_songs=20 if quick else 200)
+
+        if verbose:
+            print("Benchmarking evaluation metrics & melody quality...")
+        benchmarks["evaluation"] = benchmark_evaluation(model_path, work_dir,
+                                                        number_of_songs=200 if quick else 2000,
+                                                        samples=16 if quick else 128, steps=32 if quick else 128)
+
+        if not skip_api:
+            if verbose:
+                print("Benchmarking API under concurrent load...")
+            benchmarks["api"] = benchmark_api(model_path, work_dir,
+                                              concurrency_levels=[1, 2] if quick else [1, 2, 4, 8],
+                                              requests_per_level=4 if quick else 16)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return results
+
+
+def _flatten_results(results: Dict[str, Any], prefix: str = "") -> Dict[str, float]:
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            flat.update(_flatten_results(value, name))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def compare_results(baseline_path: str, candidate_path: str) -> None:
+    """
+    Prints every shared measurement of two result files side by side, with the candidate/baseline ratio.
+    :param baseline_path: The results file of the baseline commit.
+    :param candidate_path: The results file of the candidate commit.
+    """
+    with open(baseline_path, "r") as fp:
+        baseline = json.load(fp)
+    with open(candidate_path, "r") as fp:
+        candidate = json.load(fp)
+
+    baseline_flat = _flatten_results(baseline["benchmarks"])
+    candidate_flat = _flatten_results(candidate["benchmarks"])
+    print(f"{'measurement':<60} {baseline['commit']:>12} {candidate['commit']:>12} {'ratio':>8}")
+    for name in sorted(set(baseline_flat) & set(candidate_flat)):
+        old, new = baseline_flat[name], candidate_flat[name]
+        ratio = new / old if old else float("nan")
+        print(f"{name:<60} {old:>12.4g} {new:>12.4g} {ratio:>8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the LSTMusic benchmark suite.")
+    parser.add_argument("--output", help="Where to write the JSON results. "
+                                         f"Defaults to {BENCHMARK_RESULTS_DIR}/<commit>.json")
+    parser.add_argument("--quick", action="store_true", help="Use small sizes for a fast sanity check.")
+    parser.add_argument("--skip-api", action="store_true", help="Skip the API load benchmark.")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CANDIDATE"),
+                        help="Compare two existing result files instead of running the benchmarks.")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare_results(*args.compare)
+        return
+
+    results = run_benchmarks(quick=args.quick, skip_api=args.skip_api)
+    output_path = args.output or os.path.join(BENCHMARK_RESULTS_DIR, f"{results['commit']}.json")
+    if os.path.dirname(output_path):
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with open(output_path, "w") as fp:
+        json.dump(results, fp, indent=4)
+    print(f"Benchmark results saved to {output_path}")
+
+
+if __name__ == '__main__':
+    main()
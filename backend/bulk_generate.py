@@ -0,0 +1,289 @@
+"""
+Offline generation of continuations for large numbers of seeds, e.g. for dataset augmentation and evaluation.
+
+Seeds are read from a text file of encoded seeds, or a directory of MIDI/KERN files. The seeds are split between
+worker processes, each of which generates them in batches through Generator.generate_batch, writing the previous
+batch's MIDI files on a background thread while the next batch is being generated. Each output is written under a
+temporary name then renamed into place, so an existing output is always complete, and a rerun skips every seed whose
+output already exists.
+
+Usage:
+    python bulk_generate.py --seeds seeds.txt --output-dir "generated-melodies/bulk" --bars 8 --processes 4
+    python bulk_generate.py --seeds "dataset-resources/KERN/erk" --bars 8 --batch-size 256
+    python bulk_generate.py --seeds seeds.txt --bars 64 --long-context --summary-bars 4
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from multiprocessing import get_context
+from typing import List, Dict, Tuple, Any, Optional
+import music21 as m21
+import numpy as np
+from api_tools import quantize_score
+from preprocess import transpose_encoded_song, shift_symbols, SEQUENCE_LENGTH
+from training import MODEL_FILEPATH
+
+BULK_OUTPUT_DIR = "generated-melodies/bulk"
+SEED_FILE_EXTENSIONS = (".mid", ".midi", ".krn")
+BATCH_SIZE = 128
+
+# (seed id, encoded seed, semitones to transpose the output back into the seed's key by)
+SeedItem = Tuple[str, str, int]
+
+
+def read_seed_file(seeds_path: str) -> List[SeedItem]:
+    """
+    Reads encoded seeds from a text file, one per line, optionally preceded by an id and a tab.
+    Blank lines and lines starting with # are ignored. Seeds are used in the key they're written in.
+    :param seeds_path: The path of the seed file.
+    :return: The seeds.
+    """
+    items = []
+    with open(seeds_path, "r") as fp:
+        for line_number, line in enumerate(fp):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if "\t" in line:
+                item_id, seed = line.split("\t", 1)
+            else:
+                item_id, seed = f"seed-{line_number:06d}", line
+            items.append((item_id, seed, 0))
+    return items
+
+
+def _encode_seed(file_path: str, item_id: str) -> Optional[SeedItem]:
+    """
+    Parses, encodes and transposes a single seed file. Runs in a worker process.
+    Seeds are quantized with the same quantizer as the API's seeds, so off-grid notes & chords are encoded the same way.
+    :return: The seed, or None if the file couldn't be parsed or has no notes.
+    """
+    try:
+        song = m21.converter.parse(file_path)
+        encoded_song, reverse_semitones = transpose_encoded_song(" ".join(quantize_score(song).symbols))
+    except Exception as e:
+        print(f"Skipping seed {file_path}: {e}")
+        return None
+    return item_id, encoded_song, reverse_semitones
+
+
+def read_seed_directory(seeds_dir: str, processes: int = 1) -> Tuple[List[SeedItem], List[str]]:
+    """
+    Encodes every MIDI & KERN file in a directory (recursively) into a seed, in parallel.
+    Each seed is transposed into C major/A minor, and transposed back once generated.
+    :param seeds_dir: The directory of seed files.
+    :param processes: The number of processes to parse the files with.
+    :return: tuple, (seeds, unreadable), the seeds, with ids taken from each file's path relative to seeds_dir,
+             and the paths of the files which couldn't be encoded.
+    """
+    files = []
+    for path, _, filenames in os.walk(seeds_dir):
+        for filename in sorted(filenames):
+            if filename.lower().endswith(SEED_FILE_EXTENSIONS):
+                file_path = os.path.join(path, filename)
+                item_id = os.path.splitext(os.path.relpath(file_path, seeds_dir))[0].replace(os.sep, "__")
+                files.append((file_path, item_id))
+
+    if not files:
+        return [], []
+    with ProcessPoolExecutor(max_workers=processes, mp_context=get_context("spawn")) as executor:
+        items = list(executor.map(_encode_seed, [file_path for file_path, _ in files],
+                                  [item_id for _, item_id in files],
+                                  chunksize=max(1, len(files) // (processes * 4))))
+    unreadable = [file_path for (file_path, _), item in zip(files, items) if item is None]
+    return [item for item in items if item is not None], unreadable
+
+
+def output_path_for(output_dir: str, item_id: str) -> str:
+    """
+    :param output_dir: The bulk generation output directory.
+    :param item_id: The seed's id.
+    :return: The path of the seed's generated MIDI file.
+    """
+    return os.path.join(output_dir, f"{item_id}.mid")
+
+
+def pending_items(items: List[SeedItem], output_dir: str) -> List[SeedItem]:
+    """
+    :param items: Every seed.
+    :param output_dir: The bulk generation output directory.
+    :return: The seeds which don't have a generated output yet.
+    """
+    return [item for item in items if not os.path.exists(output_path_for(output_dir, item[0]))]
+
+
+def write_melody(melody: List[str], reverse_semitones: int, tempo: int, output_path: str) -> None:
+    """
+    Transposes a generated melody back into its seed's key and atomically writes it as a MIDI file.
+    :param melody: The melody's symbols, in C major/A minor.
+    :param reverse_semitones: The semitones to transpose the melody back by.
+    :param tempo: The tempo of the melody.
+    :param output_path: The path to write the MIDI file to.
+    """
+    from generator import streamify_melody
+
+    stream = streamify_melody(shift_symbols(melody, reverse_semitones), tempo=tempo)
+    temporary_path = f"{os.path.splitext(output_path)[0]}.tmp.mid"
+    stream.write("midi", temporary_path)
+    os.replace(temporary_path, output_path)
+
+
+def _generation_worker(worker_index: int, items: List[SeedItem], model_path: str, output_dir: str,
+                       batch_size: int, number_of_steps: int, temperature: float, tempo: int, jit_compile: bool,
+                       threads: int, random_seed: Optional[int], long_context: bool = False,
+                       summary_bars: int = 0) -> Dict[str, Any]:
+    """
+    Generates and writes every given seed's continuation in batches. Runs in a worker process.
+    Each melody's symbols are also appended to results-<worker_index>.jsonl for evaluation, in C major/A minor along
+    with the semitones to transpose them back by. If a seed is regenerated, its latest line is the one to use.
+    :return: The number of melodies generated, the number which failed to be written and the time taken.
+    """
+    import tensorflow as tf
+    from generator import Generator
+
+    try:
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+        tf.config.threading.set_inter_op_parallelism_threads(1)
+    except RuntimeError:
+        pass  # Threading can only be configured once per process, when the worker is reused it's already set.
+
+    generator = Generator(model_path, jit_compile=jit_compile)
+    rng = np.random.default_rng(None if random_seed is None else random_seed + worker_index)
+    results_path = os.path.join(output_dir, f"results-{worker_index}.jsonl")
+    start = time.perf_counter()
+
+    # A single seed with a symbol outside the vocabulary would otherwise fail its whole batch.
+    valid_items = [item for item in items if generator.can_encode(item[1])]
+    failed = len(items) - len(valid_items)
+    if failed:
+        print(f"Skipping {failed} seeds containing symbols outside the model's vocabulary.")
+    items = valid_items
+
+    def write_batch(batch: List[SeedItem], melodies: List[List[str]]) -> int:
+        batch_failures = 0
+        with open(results_path, "a") as fp:
+            for (item_id, _, reverse_semitones), melody in zip(batch, melodies):
+                try:
+                    write_melody(melody, reverse_semitones, tempo, output_path_for(output_dir, item_id))
+                except Exception as e:
+                    print(f"Failed to write {item_id}: {e}")
+                    batch_failures += 1
+                    continue
+                fp.write(json.dumps({"id": item_id, "melody": " ".join(melody),
+                                     "reverse_semitones": reverse_semitones}) + "\n")
+        return batch_failures
+
+    # A single writer thread writes each batch's MIDI files while the next batch is generated.
+    with ThreadPoolExecutor(max_workers=1) as writer:
+        writes = []
+        for batch_start in range(0, len(items), batch_size):
+            batch = items[batch_start:batch_start + batch_size]
+            if long_context:
+                melodies = generator.generate_long_batch([seed for _, seed, _ in batch],
+                                                         number_of_steps=number_of_steps, temperature=temperature,
+                                                         summary_bars=summary_bars, rng=rng)
+            else:
+                melodies = generator.generate_batch([seed for _, seed, _ in batch], number_of_steps=number_of_steps,
+                                                    max_sequence_length=SEQUENCE_LENGTH, temperature=temperature,
+                                                    rng=rng)
+            writes.append(writer.submit(write_batch, batch, melodies))
+        write_failures = sum(write.result() for write in writes)
+
+    return {"generated": len(items) - write_failures, "failed": failed + write_failures,
+            "time_s": time.perf_counter() - start}
+
+
+def run_bulk_generation(items: List[SeedItem], output_dir: str = BULK_OUTPUT_DIR, model_path: str = MODEL_FILEPATH,
+                        processes: int = 1, batch_size: int = BATCH_SIZE, number_of_steps: int = 128,
+                        temperature: float = 0.7, tempo: int = 120, jit_compile: bool = False,
+                        random_seed: int = None, long_context: bool = False, summary_bars: int = 0,
+                        unreadable_seeds: int = 0, verbose: bool = True) -> Dict[str, Any]:
+    """
+    Generates a continuation of every seed which doesn't already have one, across several processes.
+
+    :param items: The seeds, from read_seed_file or read_seed_directory.
+    :param output_dir: The directory to write the MIDI files & results to.
+    :param model_path: The path of the model to generate with.
+    :param processes: The number of generation processes.
+    :param batch_size: The number of seeds each process generates at once.
+    :param number_of_steps: The number of steps to generate per seed, in 16th notes.
+    :param temperature: The sampling temperature.
+    :param tempo: The tempo of the written MIDI files.
+    :param jit_compile: Decode with an XLA compiled step.
+    :param random_seed: Seeds sampling for reproducible outputs. Default is None, unseeded.
+    :param long_context: Carry the recurrent state across each whole melody rather than re-reading a window, see
+                         Generator.stream_long_melody. Keeps structure over long continuations.
+    :param summary_bars: With long_context, the number of most repeated earlier bars to rebuild the state from.
+    :param unreadable_seeds: The number of seed files read_seed_directory couldn't encode, reported in the summary.
+    :param verbose: Enable additional print statements for debug purposes.
+
+    :return: A summary of the number of seeds skipped, unreadable, generated and failed, the time taken and melodies
+             per second.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    pending = pending_items(items, output_dir)
+    if verbose:
+        print(f"{len(items) - len(pending)} of {len(items)} seeds already generated, generating {len(pending)}.")
+
+    summary = {"seeds": len(items), "skipped": len(items) - len(pending), "unreadable": unreadable_seeds,
+               "generated": 0, "failed": 0}
+    start = time.perf_counter()
+    processes = max(1, min(processes, len(pending)))
+    threads = max(1, (os.cpu_count() or 1) // processes)
+    if pending:
+        # TensorFlow isn't fork safe, so workers are started fresh.
+        with ProcessPoolExecutor(max_workers=processes, mp_context=get_context("spawn")) as executor:
+            futures = [executor.submit(_generation_worker, worker_index, pending[worker_index::processes],
+                                       model_path, output_dir, batch_size, number_of_steps, temperature, tempo,
+                                       jit_compile, threads, random_seed, long_context, summary_bars)
+                       for worker_index in range(processes)]
+            for future in as_completed(futures):
+                result = future.result()
+                summary["generated"] += result["generated"]
+                summary["failed"] += result["failed"]
+
+    summary["time_s"] = time.perf_counter() - start
+    summary["melodies_per_s"] = summary["generated"] / summary["time_s"] if summary["generated"] else 0.0
+    if verbose:
+        print(f"Generated {summary['generated']} melodies in {summary['time_s']:.1f}s "
+              f"({summary['melodies_per_s']:.1f} per second), {summary['failed']} failed, "
+              f"{summary['unreadable']} seed files couldn't be read.")
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate continuations for a file or directory of seeds.")
+    parser.add_argument("--seeds", required=True,
+                        help="A text file of encoded seeds, or a directory of MIDI/KERN files.")
+    parser.add_argument("--output-dir", default=BULK_OUTPUT_DIR)
+    parser.add_argument("--model-path", default=MODEL_FILEPATH)
+    parser.add_argument("--processes", type=int, default=max(1, (os.cpu_count() or 1) // 4))
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--bars", type=int, default=8, help="The length of each continuation, in bars.")
+    parser.add_argument("--temperature", type=float, default=0.7)
+    parser.add_argument("--tempo", type=int, default=120)
+    parser.add_argument("--jit-compile", action="store_true", help="Decode with an XLA compiled step.")
+    parser.add_argument("--random-seed", type=int, default=None)
+    parser.add_argument("--long-context", action="store_true",
+                        help="Carry the model's state across each whole melody, for long continuations.")
+    parser.add_argument("--summary-bars", type=int, default=0,
+                        help="With --long-context, periodically rebuild the state from this many repeated bars.")
+    args = parser.parse_args()
+
+    unreadable = []
+    if os.path.isdir(args.seeds):
+        items, unreadable = read_seed_directory(args.seeds, processes=args.processes)
+    else:
+        items = read_seed_file(args.seeds)
+
+    run_bulk_generation(items, output_dir=args.output_dir, model_path=args.model_path, processes=args.processes,
+                        batch_size=args.batch_size, number_of_steps=args.bars * 16, temperature=args.temperature,
+                        tempo=args.tempo, jit_compile=args.jit_compile, random_seed=args.random_seed,
+                        long_context=args.long_context, summary_bars=args.summary_bars,
+                        unreadable_seeds=len(unreadable))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,205 @@
+"""
+Resumable training checkpoints.
+
+Every epoch the model's weights and optimizer state are copied in memory and written to disk in a background thread,
+so disk I/O doesn't stall training. Files are written under a temporary name and renamed into place, and a checkpoint
+is only listed in the manifest once it's complete, so a crash mid-write never leaves a half written checkpoint to
+resume from. The last few checkpoints are kept, along with the best one seen so far.
+"""
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import List, Dict, Optional
+import keras
+import numpy as np
+
+CHECKPOINT_DIR = "model-resources/Model Checkpoints"
+MANIFEST_FILENAME = "checkpoints.json"
+
+
+def atomic_write_json(data: Dict, path: str) -> None:
+    """
+    Writes a JSON file by writing to a temporary file then renaming it, so readers never see a partial file.
+    :param data: The data to write.
+    :param path: The path of the JSON file.
+    """
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, "w") as fp:
+        json.dump(data, fp, indent=4)
+        fp.flush()
+        os.fsync(fp.fileno())
+    os.replace(temporary_path, path)
+
+
+def atomic_save_model(model: keras.Model, model_path: str) -> None:
+    """
+    Saves a model under a temporary name then renames it into place, so a crash never corrupts the previous model.
+    :param model: The model to save.
+    :param model_path: The path to save the model to. The extension selects the format, as with model.save.
+    """
+    root, extension = os.path.splitext(model_path)
+    temporary_path = f"{root}.tmp{extension}"
+    model.save(temporary_path)
+    os.replace(temporary_path, model_path)
+
+
+class CheckpointManager(keras.callbacks.Callback):
+    """
+    Saves, prunes and restores training checkpoints, including the optimizer's state and the epoch reached.
+    Used as a callback with model.fit, after calling restore_latest to find the epoch to resume from.
+    """
+
+    def __init__(self, checkpoint_dir: str = CHECKPOINT_DIR, keep_last: int = 3, monitor: str = "loss",
+                 mode: str = "min", verbose: bool = False) -> None:
+        """
+        :param checkpoint_dir: The directory to save checkpoints into.
+        :param keep_last: The number of most recent checkpoints to keep.
+        :param monitor: The metric used to decide the best checkpoint, which is always kept.
+        :param mode: "min" if a lower monitored metric is better, "max" if higher is better.
+        :param verbose: Enable additional print statements for debug purposes. Default is False.
+        """
+        super().__init__()
+        if mode not in ("min", "max"):
+            raise ValueError(f"Invalid checkpoint mode: {mode}, expected 'min' or 'max'.")
+        self.checkpoint_dir = checkpoint_dir
+        self.keep_last = keep_last
+        self.monitor = monitor
+        self.mode = mode
+        self.verbose = verbose
+        self._manifest_path = os.path.join(checkpoint_dir, MANIFEST_FILENAME)
+        self._manifest = self._load_manifest()
+        # A single writer thread keeps checkpoint writes in order.
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="checkpoint-writer")
+        self._pending: List[Future] = []
+
+    # --- Manifest ---
+
+    def _load_manifest(self) -> Dict:
+        if os.path.exists(self._manifest_path):
+            with open(self._manifest_path, "r") as fp:
+                return json.load(fp)
+        return {"checkpoints": [], "best": None}
+
+    @property
+    def checkpoints(self) -> List[Dict]:
+        """The complete checkpoints on disk, oldest first."""
+        return list(self._manifest["checkpoints"])
+
+    @property
+    def best_checkpoint(self) -> Optional[Dict]:
+        """The checkpoint with the best monitored metric, or None."""
+        return self._manifest["best"]
+
+    def _is_improvement(self, value: float) -> bool:
+        best = self._manifest["best"]
+        if best is None or best["metric"] is None:
+            return True
+        return value < best["metric"] if self.mode == "min" else value > best["metric"]
+
+    # --- Saving ---
+
+    def _write_checkpoint(self, epoch: int, metric: Optional[float], weights: List[np.ndarray],
+                          optimizer_state: List[np.ndarray]) -> None:
+        """
+        Writes a checkpoint to disk and updates the manifest. Runs on the writer thread.
+        """
+        filename = f"ckpt-{epoch:04d}.npz"
+        path = os.path.join(self.checkpoint_dir, filename)
+        temporary_path = os.path.join(self.checkpoint_dir, f"ckpt-{epoch:04d}.tmp.npz")
+
+        arrays = {f"weight_{i}": weight for i, weight in enumerate(weights)}
+        arrays.update({f"optimizer_{i}": variable for i, variable in enumerate(optimizer_state)})
+        np.savez(temporary_path, **arrays)
+        os.replace(temporary_path, path)
+
+        entry = {"epoch": epoch, "filename": filename, "metric": metric,
+                 "num_weights": len(weights), "num_optimizer_variables": len(optimizer_state)}
+        manifest = self._manifest
+        manifest["checkpoints"] = [c for c in manifest["checkpoints"] if c["epoch"] != epoch] + [entry]
+        if metric is not None and self._is_improvement(metric):
+            manifest["best"] = entry
+
+        # Prune old checkpoints, never removing the best one.
+        kept = manifest["checkpoints"][-self.keep_last:]
+        best_filename = manifest["best"]["filename"] if manifest["best"] else None
+        removed = [c for c in manifest["checkpoints"][:-self.keep_last] if c["filename"] != best_filename]
+        if manifest["best"] is not None and manifest["best"] not in kept:
+            kept = [manifest["best"]] + kept
+        manifest["checkpoints"] = kept
+
+        # The manifest is updated before old files are removed, so it never points at a missing file.
+        atomic_write_json(manifest, self._manifest_path)
+        for checkpoint in removed:
+            removed_path = os.path.join(self.checkpoint_dir, checkpoint["filename"])
+            if os.path.exists(removed_path):
+                os.remove(removed_path)
+
+        if self.verbose:
+            print(f"\nSaved checkpoint {filename}.")
+
+    def save(self, epoch: int, metric: Optional[float] = None) -> Future:
+        """
+        Snapshots the model & optimizer in memory and writes them to disk in the background.
+        :param epoch: The number of completed epochs.
+        :param metric: The monitored metric's value for this epoch.
+        :return: A future which completes once the checkpoint is on disk.
+        """
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        weights = self.model.get_weights()
+        optimizer_state = [variable.numpy() for variable in self.model.optimizer.variables]
+        future = self._writer.submit(self._write_checkpoint, epoch, metric, weights, optimizer_state)
+        self._pending.append(future)
+        return future
+
+    def wait(self) -> None:
+        """
+        Blocks until every pending checkpoint has been written, re-raising any write errors.
+        """
+        pending, self._pending = self._pending, []
+        for future in pending:
+            future.result()
+
+    # --- Restoring ---
+
+    def restore(self, model: keras.Model, checkpoint: Dict) -> int:
+        """
+        Restores a model's weights and optimizer state from a checkpoint.
+        :param model: The compiled model to restore into.
+        :param checkpoint: The checkpoint's manifest entry.
+        :return: The epoch to resume training from.
+        """
+        with np.load(os.path.join(self.checkpoint_dir, checkpoint["filename"])) as data:
+            model.set_weights([data[f"weight_{i}"] for i in range(checkpoint["num_weights"])])
+            # The optimizer only creates its variables on the first training step, so create them now.
+            model.optimizer.build(model.trainable_variables)
+            optimizer_variables = model.optimizer.variables
+            if len(optimizer_variables) != checkpoint["num_optimizer_variables"]:
+                raise ValueError(f"Checkpoint {checkpoint['filename']} has {checkpoint['num_optimizer_variables']} "
+                                 f"optimizer variables, but the model's optimizer has {len(optimizer_variables)}.")
+            for i, variable in enumerate(optimizer_variables):
+                variable.assign(data[f"optimizer_{i}"])
+        return checkpoint["epoch"]
+
+    def restore_latest(self, model: keras.Model) -> int:
+        """
+        Restores the most recent checkpoint, if there is one.
+        :param model: The compiled model to restore into.
+        :return: The epoch to resume training from, 0 if there are no checkpoints.
+        """
+        if not self._manifest["checkpoints"]:
+            return 0
+        latest = self._manifest["checkpoints"][-1]
+        epoch = self.restore(model, latest)
+        if self.verbose:
+            print(f"Restored checkpoint {latest['filename']}, resuming from epoch {epoch}.")
+        return epoch
+
+    # --- Callback hooks ---
+
+    def on_epoch_end(self, epoch, logs=None):
+        metric = (logs or {}).get(self.monitor)
+        # Keras' epoch argument is zero indexed, checkpoints store the number of completed epochs.
+        self.save(epoch + 1, None if metric is None else float(metric))
+
+    def on_train_end(self, logs=None):
+        self.wait()
@@ -0,0 +1,225 @@
+"""
+Knowledge distillation of the full size model into smaller, lower latency student models for serving.
+
+The student learns from both the real next symbol and the teacher's softened probability distribution over every
+symbol, which carries more information per training window than the single correct answer.
+
+Usage:
+    python distillation.py --num-units 128 --cell-type gru --student-path "model-resources/Model Saves/student.h5"
+"""
+import argparse
+import time
+from typing import List, Dict, Any, Tuple
+import keras
+import numpy as np
+import tensorflow as tf
+from checkpoints import atomic_save_model
+from preprocess import convert_songs_to_int, load, load_mappings, save_vocabulary, vocabulary_path_for_model, \
+    validate_model_vocabulary, song_offset_index, validation_split_offsets, SEQUENCE_LENGTH, SINGLE_FILE_DATASET_PATH, \
+    NOTE_MAPPINGS_PATH
+from training import build_model, make_training_dataset, MODEL_FILEPATH, LOSS_FN, LEARNING_RATE, BATCH_SIZE
+
+STUDENT_FILEPATH = "model-resources/Model Saves/student.h5"
+VALIDATION_FRACTION = 0.1
+
+
+class Distiller(keras.Model):
+    """Trains a student model to match a frozen teacher model's softened predictions, as well as the true targets."""
+
+    def __init__(self, student: keras.Model, teacher: keras.Model, temperature: float = 2.0, alpha: float = 0.5):
+        """
+        :param student: The compiled student model.
+        :param teacher: The trained teacher model, which isn't updated.
+        :param temperature: Softens both models' distributions, higher values share more about unlikely symbols.
+        :param alpha: The weight of the true target loss, the distillation loss is weighted by (1 - alpha).
+        """
+        super().__init__()
+        self.student = student
+        self.teacher = teacher
+        self.teacher.trainable = False
+        self.temperature = temperature
+        self.alpha = alpha
+        self.student_loss_fn = keras.losses.SparseCategoricalCrossentropy()
+        self.distillation_loss_fn = keras.losses.KLDivergence()
+        self.accuracy = keras.metrics.SparseCategoricalAccuracy(name="accuracy")
+        self.loss_tracker = keras.metrics.Mean(name="loss")
+        self.student_loss_tracker = keras.metrics.Mean(name="student_loss")
+        self.distillation_loss_tracker = keras.metrics.Mean(name="distillation_loss")
+
+    @property
+    def metrics(self):
+        return [self.loss_tracker, self.student_loss_tracker, self.distillation_loss_tracker, self.accuracy]
+
+    def _soften(self, probabilities):
+        # Both models end in a softmax, so the log probabilities act as logits.
+        return tf.nn.softmax(tf.math.log(probabilities + 1e-9) / self.temperature)
+
+    def _blended_loss(self, inputs, targets, training: bool):
+        """
+        :return: tuple, (loss, student_loss, distillation_loss, student_probabilities), the blended loss which is
+                 trained on, and its true target and distillation parts.
+        """
+        teacher_probabilities = self.teacher(inputs, training=False)
+        student_probabilities = self.student(inputs, training=training)
+        student_loss = self.student_loss_fn(targets, student_probabilities)
+        distillation_loss = self.distillation_loss_fn(self._soften(teacher_probabilities),
+                                                      self._soften(student_probabilities))
+        # Scaled by temperature squared to keep its gradients comparable to the student loss.
+        loss = self.alpha * student_loss + (1 - self.alpha) * distillation_loss * self.temperature ** 2
+        return loss, student_loss, distillation_loss, student_probabilities
+
+    def _update_metrics(self, targets, loss, student_loss, distillation_loss, student_probabilities):
+        self.loss_tracker.update_state(loss)
+        self.student_loss_tracker.update_state(student_loss)
+        self.distillation_loss_tracker.update_state(distillation_loss)
+        self.accuracy.update_state(targets, student_probabilities)
+        return {metric.name: metric.result() for metric in self.metrics}
+
+    def train_step(self, data):
+        inputs, targets = data
+        with tf.GradientTape() as tape:
+            loss, student_loss, distillation_loss, student_probabilities = self._blended_loss(inputs, targets,
+                                                                                              training=True)
+
+        gradients = tape.gradient(loss, self.student.trainable_variables)
+        self.student.optimizer.apply_gradients(zip(gradients, self.student.trainable_variables))
+        return self._update_metrics(targets, loss, student_loss, distillation_loss, student_probabilities)
+
+    def test_step(self, data):
+        # The same blended loss as training, so val_loss and loss measure the same objective.
+        inputs, targets = data
+        return self._update_metrics(targets, *self._blended_loss(inputs, targets, training=False))
+
+    def call(self, inputs, training=False):
+        return self.student(inputs, training=training)
+
+
+def _load_corpus(flattened_dataset: str = None) -> Tuple[np.ndarray, Dict[str, int]]:
+    if flattened_dataset is None:
+        flattened_dataset = load(SINGLE_FILE_DATASET_PATH)
+    mappings = load_mappings(NOTE_MAPPINGS_PATH)
+    int_songs = np.array(convert_songs_to_int(flattened_songs_string=flattened_dataset, mappings_dictionary=mappings))
+    return int_songs, mappings
+
+
+def _split_offsets(int_songs: np.ndarray, mappings: Dict[str, int],
+                   sequence_length: int) -> Tuple[np.ndarray, np.ndarray]:
+    # Split between songs with a window-length gap, so no window overlaps both training and validation songs.
+    return validation_split_offsets(song_offset_index(int_songs, mappings["/"]), len(int_songs), sequence_length,
+                                    VALIDATION_FRACTION)
+
+
+def distill(num_units: List[int], cell_type: str = "gru", epochs: int = 8, batch_size: int = BATCH_SIZE,
+            temperature: float = 2.0, alpha: float = 0.5, teacher_path: str = MODEL_FILEPATH,
+            student_path: str = STUDENT_FILEPATH, flattened_dataset: str = None,
+            verbose: bool = False) -> keras.Model:
+    """
+    Trains a small student model from the current teacher model.
+
+    :param num_units: The student's hidden layer sizes, e.g. [128] or [64, 64].
+    :param cell_type: The student's recurrent layer type, "lstm" or "gru".
+    :param epochs: The number of epochs to train the student for.
+    :param batch_size: The amount of samples the student sees before running backpropagation.
+    :param temperature: The distillation temperature.
+    :param alpha: The weight of the true target loss, the distillation loss is weighted by (1 - alpha).
+    :param teacher_path: The path of the trained teacher model.
+    :param student_path: The path which the student shall be saved to.
+    :param flattened_dataset: The flattened dataset which the student will train off of.
+    :param verbose: Enable additional print statements for debug purposes. Default is False.
+
+    :return: The trained student model.
+    """
+    int_songs, mappings = _load_corpus(flattened_dataset)
+    vocabulary_size = len(mappings)
+    train_offsets, validation_offsets = _split_offsets(int_songs, mappings, SEQUENCE_LENGTH)
+    train_dataset = make_training_dataset(int_songs, SEQUENCE_LENGTH, vocabulary_size, batch_size,
+                                          window_offsets=train_offsets)
+    validation_dataset = make_training_dataset(int_songs, SEQUENCE_LENGTH, vocabulary_size, batch_size,
+                                               window_offsets=validation_offsets, shuffle=False)
+
+    teacher = keras.models.load_model(teacher_path)
+    validate_model_vocabulary(teacher, mappings)
+
+    student = build_model(output_units=vocabulary_size, loss_fn=LOSS_FN, num_units=num_units,
+                          learning_rate=LEARNING_RATE, cell_type=cell_type, verbose=verbose)
+    distiller = Distiller(student=student, teacher=teacher, temperature=temperature, alpha=alpha)
+    distiller.compile(optimizer=student.optimizer)
+    distiller.fit(train_dataset, validation_data=validation_dataset, epochs=epochs, verbose=1 if verbose else 0)
+
+    atomic_save_model(student, student_path)
+    save_vocabulary(mappings, vocabulary_path_for_model(student_path))
+    if verbose:
+        print(f"Saved distilled student to {student_path}")
+    return student
+
+
+def compare_models(model_paths: Dict[str, str], flattened_dataset: str = None, generation_steps: int = 128,
+                   verbose: bool = True) -> Dict[str, Dict[str, Any]]:
+    """
+    Reports the per-step generation latency and validation next-symbol accuracy of several models side by side.
+
+    :param model_paths: The models to compare, by display name, e.g. {"teacher": ..., "gru-128": ...}.
+    :param flattened_dataset: The flattened dataset to measure accuracy on, the same validation split as distill.
+    :param generation_steps: The number of generation steps to time each model over.
+    :param verbose: Print the comparison table.
+
+    :return: Each model's parameter count, per-step latency in milliseconds and validation accuracy.
+    """
+    from generator import Generator
+
+    int_songs, mappings = _load_corpus(flattened_dataset)
+    vocabulary_size = len(mappings)
+    _, validation_offsets = _split_offsets(int_songs, mappings, SEQUENCE_LENGTH)
+    validation_dataset = make_training_dataset(int_songs, SEQUENCE_LENGTH, vocabulary_size, BATCH_SIZE,
+                                               window_offsets=validation_offsets, shuffle=False)
+    seed = "60 _ 62 _ 64 _ _ _ 65 _ 67 _ _ _ 64 _"
+
+    results = {}
+    for name, model_path in model_paths.items():
+        generator = Generator(model_path, jit_compile=True)
+        list(generator.stream_melody(seed=seed, number_of_steps=2, max_sequence_length=SEQUENCE_LENGTH,
+                                     temperature=0.7))  # Warm up, compiles the decode step.
+        start = time.perf_counter()
+        list(generator.stream_melody(seed=seed, number_of_steps=generation_steps,
+                                     max_sequence_length=SEQUENCE_LENGTH, temperature=0.7))
+        step_latency = (time.perf_counter() - start) / generation_steps
+
+        model = keras.models.load_model(model_path)
+        # Counted directly, as the accuracy metric compiled into a saved model isn't always restored as sparse.
+        correct, total = 0, 0
+        for inputs, targets in validation_dataset:
+            predictions = np.argmax(model(inputs, training=False), axis=-1)
+            correct += int(np.sum(predictions == targets.numpy()))
+            total += len(targets)
+        accuracy = correct / max(total, 1)
+        results[name] = {"parameters": model.count_params(),
+                         "step_latency_ms": step_latency * 1000,
+                         "validation_accuracy": float(accuracy)}
+
+    if verbose:
+        print(f"{'model':<20} {'parameters':>12} {'ms / step':>10} {'accuracy':>10}")
+        for name, result in results.items():
+            print(f"{name:<20} {result['parameters']:>12} {result['step_latency_ms']:>10.2f} "
+                  f"{result['validation_accuracy']:>10.3f}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Distill the trained model into a smaller student model.")
+    parser.add_argument("--num-units", type=int, nargs="+", default=[128], help="The student's hidden layer sizes.")
+    parser.add_argument("--cell-type", choices=["lstm", "gru"], default="gru")
+    parser.add_argument("--epochs", type=int, default=8)
+    parser.add_argument("--temperature", type=float, default=2.0)
+    parser.add_argument("--alpha", type=float, default=0.5)
+    parser.add_argument("--teacher-path", default=MODEL_FILEPATH)
+    parser.add_argument("--student-path", default=STUDENT_FILEPATH)
+    args = parser.parse_args()
+
+    distill(num_units=args.num_units, cell_type=args.cell_type, epochs=args.epochs, temperature=args.temperature,
+            alpha=args.alpha, teacher_path=args.teacher_path, student_path=args.student_path, verbose=True)
+    compare_models({"teacher": args.teacher_path,
+                    f"{args.cell_type}-{'-'.join(map(str, args.num_units))}": args.student_path})
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,457 @@
+"""
+Melody quality metrics, so generation speed changes (quantisation, distillation, stateful decoding...) can be checked
+for quality regressions without listening to the output.
+
+Every metric works on a whole batch of songs at once. Songs are concatenated into one integer array alongside an
+array of each symbol's song number, so per-song statistics are a single bincount rather than a Python loop per song.
+
+Usage:
+    python evaluation.py --model-path "model-resources/Model Saves/model.h5" --samples 256 --bars 8
+    python evaluation.py --model-path "model-resources/Model Saves/model.h5" --long-context --bars 32
+"""
+import argparse
+import json
+import time
+from typing import List, Dict, Tuple, Any
+import numpy as np
+from preprocess import (convert_songs_to_int,
+                        estimate_keys,
+                        events_to_time_series,
+                        is_event_vocabulary,
+                        time_series_to_events,
+                        load,
+                        load_mappings,
+                        parse_event,
+                        song_offset_index,
+                        sort_vocabulary,
+                        validation_split_offsets,
+                        SEQUENCE_LENGTH,
+                        SINGLE_FILE_DATASET_PATH,
+                        NOTE_MAPPINGS_PATH
+                        )
+
+VALIDATION_FRACTION = 0.1
+MAX_DURATION_STEPS = 16  # Durations are counted up to a whole note, longer notes share the last bin.
+REPETITION_NGRAM_LENGTH = 4
+MAJOR_SCALE = [0, 2, 4, 5, 7, 9, 11]
+MINOR_SCALE = [0, 2, 3, 5, 7, 8, 10, 11]  # Natural minor, plus the harmonic minor's raised 7th.
+STEPS_PER_BAR = 16
+LONG_CONTEXT_SUMMARY_BARS = 4
+
+
+class EncodedBatch:
+    """
+    A batch of songs, concatenated into flat arrays of symbols and song numbers.
+    """
+
+    def __init__(self, songs: List[str], mappings: Dict[str, int]) -> None:
+        """
+        :param songs: The songs, in time series string notation. Delimiters ("/") are dropped.
+        :param mappings: The symbol mappings.
+        """
+        if is_event_vocabulary(mappings):
+            # Songs are always in time series notation, an event model's melodies are measured the same way.
+            symbols = {parse_event(symbol)[0] for symbol in mappings if symbol != "/"} | {"/", "_"}
+            mappings = {symbol: i for i, symbol in enumerate(sort_vocabulary(symbols))}
+        self.number_of_songs = len(songs)
+        songs_symbols = [[symbol for symbol in song.split() if symbol != "/"] for song in songs]
+        self.lengths = np.array([len(symbols) for symbols in songs_symbols], dtype=np.int64)
+        self.tokens = np.array([mappings[symbol] for symbols in songs_symbols for symbol in symbols], dtype=np.int64)
+        self.song_ids = np.repeat(np.arange(self.number_of_songs), self.lengths)
+
+        # Lookup tables from token to its meaning, -1 for anything which isn't a note.
+        vocabulary_size = len(mappings)
+        self.token_pitches = np.full(vocabulary_size, -1, dtype=np.int64)
+        for symbol, token in mappings.items():
+            if symbol.isdigit():
+                self.token_pitches[token] = int(symbol)
+        self.prolongation_token = mappings.get("_", -1)
+
+    def events(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Finds every note & rest event, and how long each lasts until the next event or the end of its song.
+        :return: tuple, (tokens, durations, song_ids) of every event, durations being in time steps.
+        """
+        event_positions = np.flatnonzero(self.tokens != self.prolongation_token)
+        # Each event lasts until the next event starts, or its song ends.
+        song_ends = np.cumsum(self.lengths)
+        event_song_ids = self.song_ids[event_positions]
+        next_positions = np.append(event_positions[1:], len(self.tokens))
+        next_positions = np.minimum(next_positions, song_ends[event_song_ids])
+        return self.tokens[event_positions], next_positions - event_positions, event_song_ids
+
+
+def pitch_class_histograms(batch: EncodedBatch) -> np.ndarray:
+    """
+    :param batch: The songs.
+    :return: np.ndarray, Shape: number of songs * 12, the time steps each song spends on each pitch class.
+    """
+    tokens, durations, song_ids = batch.events()
+    pitches = batch.token_pitches[tokens]
+    is_note = pitches >= 0
+    bins = song_ids[is_note] * 12 + pitches[is_note] % 12
+    return np.bincount(bins, weights=durations[is_note], minlength=batch.number_of_songs * 12) \
+        .reshape(batch.number_of_songs, 12)
+
+
+def duration_histograms(batch: EncodedBatch) -> np.ndarray:
+    """
+    :param batch: The songs.
+    :return: np.ndarray, Shape: number of songs * MAX_DURATION_STEPS, the number of notes of each duration (1 time
+             step to MAX_DURATION_STEPS or more) in each song.
+    """
+    tokens, durations, song_ids = batch.events()
+    is_note = batch.token_pitches[tokens] >= 0
+    duration_bins = np.minimum(durations[is_note], MAX_DURATION_STEPS) - 1
+    bins = song_ids[is_note] * MAX_DURATION_STEPS + duration_bins
+    return np.bincount(bins, minlength=batch.number_of_songs * MAX_DURATION_STEPS) \
+        .reshape(batch.number_of_songs, MAX_DURATION_STEPS).astype(np.float64)
+
+
+def histogram_distance(histograms: np.ndarray, reference_histogram: np.ndarray) -> np.ndarray:
+    """
+    The Jensen-Shannon divergence between each histogram and a reference histogram, from 0 (identical
+    distributions) to 1 (nothing in common).
+    :param histograms: np.ndarray, Shape: number of histograms * number of bins.
+    :param reference_histogram: np.ndarray, Shape: number of bins, or number of histograms * number of bins to
+                                compare each histogram against its own reference.
+    :return: np.ndarray, Each histogram's distance.
+    """
+    histograms = np.atleast_2d(histograms).astype(np.float64)
+    p = histograms / np.maximum(histograms.sum(axis=1, keepdims=True), 1e-12)
+    q = reference_histogram / np.maximum(reference_histogram.sum(axis=-1, keepdims=True), 1e-12)
+    m = (p + q) / 2
+
+    def kl_divergence(a, b):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(a > 0, a * np.log2(a / b), 0).sum(axis=1)
+
+    return (kl_divergence(p, m) + kl_divergence(np.broadcast_to(q, p.shape), m)) / 2
+
+
+def repetition_rates(batch: EncodedBatch, ngram_length: int = REPETITION_NGRAM_LENGTH) -> np.ndarray:
+    """
+    The share of each song's n-grams of (symbol, duration) events which repeat an n-gram from earlier in the song.
+    0 for a song which never repeats itself, approaching 1 for a song stuck in a loop.
+    :param batch: The songs.
+    :param ngram_length: The number of events per n-gram.
+    :return: np.ndarray, Each song's repetition rate, NaN for songs with fewer than ngram_length events.
+    """
+    tokens, durations, song_ids = batch.events()
+    events = tokens * (MAX_DURATION_STEPS + 1) + np.minimum(durations, MAX_DURATION_STEPS)
+
+    repetition = np.full(batch.number_of_songs, np.nan)
+    number_of_ngrams = len(events) - ngram_length + 1
+    if number_of_ngrams <= 0:
+        return repetition
+
+    # Hash every n-gram into one integer, overflow wraps around which only makes collisions slightly more likely.
+    hashes = np.zeros(number_of_ngrams, dtype=np.int64)
+    for offset in range(ngram_length):
+        hashes = hashes * np.int64(1_000_003) + events[offset:offset + number_of_ngrams]
+    # Only keep n-grams which start and end in the same song.
+    ngram_song_ids = song_ids[:number_of_ngrams]
+    in_one_song = ngram_song_ids == song_ids[ngram_length - 1:]
+    hashes, ngram_song_ids = hashes[in_one_song], ngram_song_ids[in_one_song]
+
+    total = np.bincount(ngram_song_ids, minlength=batch.number_of_songs)
+    unique_pairs = np.unique(np.stack([ngram_song_ids, hashes], axis=1), axis=0)
+    unique = np.bincount(unique_pairs[:, 0], minlength=batch.number_of_songs)
+    has_ngrams = total > 0
+    repetition[has_ngrams] = 1 - unique[has_ngrams] / total[has_ngrams]
+    return repetition
+
+
+def out_of_key_shares(pitch_histograms: np.ndarray) -> np.ndarray:
+    """
+    The share of each song's note time spent on pitch classes outside the song's estimated key.
+    :param pitch_histograms: np.ndarray, Shape: number of songs * 12, from pitch_class_histograms.
+    :return: np.ndarray, Each song's out of key share, NaN for songs without any notes.
+    """
+    tonics, is_minor = estimate_keys(pitch_histograms)
+    scale_masks = np.zeros((2, 12), dtype=bool)
+    scale_masks[0, MAJOR_SCALE] = True
+    scale_masks[1, MINOR_SCALE] = True
+    # Rotate each song's scale to its tonic: pitch class p is in key if (p - tonic) is in the scale.
+    relative_pitch_classes = (np.arange(12)[np.newaxis, :] - tonics[:, np.newaxis]) % 12
+    in_key = scale_masks[is_minor.astype(int)[:, np.newaxis], relative_pitch_classes]
+
+    totals = pitch_histograms.sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(totals > 0, (pitch_histograms * ~in_key).sum(axis=1) / totals, np.nan)
+
+
+def structure_metrics(batch: EncodedBatch, window_bars: int = SEQUENCE_LENGTH // STEPS_PER_BAR) -> Dict[str, float]:
+    """
+    Measures how much of each song's structure comes from returning to earlier material. Only complete bars with at
+    least one note are counted, so bars of rests or held notes don't count as repeats.
+    :param batch: The songs.
+    :param window_bars: The generation window in bars, repeats from further back than this couldn't have been copied
+                        from a windowed model's context.
+    :return: The share of bars repeating an earlier bar of the same song, the share repeating one from further back
+             than the window, and the mean Jensen-Shannon distance between each song's first & second half pitch
+             class histograms (tonal drift).
+    """
+    # Each symbol's position within its song, and so its bar.
+    song_starts = np.cumsum(batch.lengths) - batch.lengths
+    positions = np.arange(len(batch.tokens)) - song_starts[batch.song_ids]
+    full_bars = batch.lengths // STEPS_PER_BAR
+    in_full_bar = positions // STEPS_PER_BAR < full_bars[batch.song_ids]
+
+    # Hash every bar into one integer, numbering bars across the whole batch.
+    bar_numbers = (np.cumsum(full_bars) - full_bars)[batch.song_ids] + positions // STEPS_PER_BAR
+    powers = np.int64(1_000_003) ** np.arange(STEPS_PER_BAR, dtype=np.int64)
+    bar_hashes = np.zeros(int(full_bars.sum()), dtype=np.int64)
+    np.add.at(bar_hashes, bar_numbers[in_full_bar],
+              batch.tokens[in_full_bar] * powers[positions[in_full_bar] % STEPS_PER_BAR])
+    has_note = np.bincount(bar_numbers[in_full_bar], weights=batch.token_pitches[batch.tokens[in_full_bar]] >= 0,
+                           minlength=len(bar_hashes)) > 0
+    bar_song_ids = np.repeat(np.arange(batch.number_of_songs), full_bars)
+    bar_indices = np.arange(len(bar_hashes)) - np.repeat(np.cumsum(full_bars) - full_bars, full_bars)
+
+    bar_hashes, bar_song_ids, bar_indices = bar_hashes[has_note], bar_song_ids[has_note], bar_indices[has_note]
+    # Sorted so each repeat follows the previous occurrence of the same bar in the same song.
+    order = np.lexsort((bar_indices, bar_hashes, bar_song_ids))
+    bar_hashes, bar_song_ids, bar_indices = bar_hashes[order], bar_song_ids[order], bar_indices[order]
+    is_repeat = np.zeros(len(order), dtype=bool)
+    is_repeat[1:] = (bar_hashes[1:] == bar_hashes[:-1]) & (bar_song_ids[1:] == bar_song_ids[:-1])
+    distances = np.zeros(len(order), dtype=np.int64)
+    distances[1:] = bar_indices[1:] - bar_indices[:-1]
+
+    # Tonal drift, from pitch class histograms of each song's halves, notes belonging to the half they start in.
+    tokens, durations, song_ids = batch.events()
+    event_positions = positions[batch.tokens != batch.prolongation_token]
+    in_second_half = event_positions >= batch.lengths[song_ids] // 2
+    pitches = batch.token_pitches[tokens]
+    is_note = pitches >= 0
+    bins = (song_ids * 2 + in_second_half)[is_note] * 12 + pitches[is_note] % 12
+    half_histograms = np.bincount(bins, weights=durations[is_note], minlength=batch.number_of_songs * 24) \
+        .reshape(batch.number_of_songs, 2, 12)
+    has_notes = (half_histograms.sum(axis=2) > 0).all(axis=1)
+    drift = histogram_distance(half_histograms[has_notes, 0], half_histograms[has_notes, 1])
+
+    number_of_bars = max(len(order), 1)
+    return {"bar_repetition_rate": float(is_repeat.sum() / number_of_bars),
+            "long_range_repetition_rate": float((is_repeat & (distances > window_bars)).sum() / number_of_bars),
+            "tonal_drift": float(np.mean(drift)) if len(drift) else float("nan")}
+
+
+def evaluate_melodies(melodies: List[str], reference_songs: List[str], mappings: Dict[str, int]) -> Dict[str, float]:
+    """
+    Compares generated melodies against reference songs, e.g. the validation split of the dataset.
+
+    :param melodies: The generated melodies, in time series string notation.
+    :param reference_songs: The songs the melodies should resemble.
+    :param mappings: The symbol mappings.
+
+    :return: The mean pitch class & duration histogram distances from the references' overall histograms,
+             and the mean repetition rate & out of key share, of both the melodies and the references.
+    """
+    generated = EncodedBatch(melodies, mappings)
+    reference = EncodedBatch(reference_songs, mappings)
+
+    generated_pitches, reference_pitches = pitch_class_histograms(generated), pitch_class_histograms(reference)
+    generated_durations, reference_durations = duration_histograms(generated), duration_histograms(reference)
+
+    return {
+        "pitch_class_distance": float(histogram_distance(generated_pitches.sum(axis=0),
+                                                         reference_pitches.sum(axis=0))[0]),
+        "duration_distance": float(histogram_distance(generated_durations.sum(axis=0),
+                                                      reference_durations.sum(axis=0))[0]),
+        "repetition_rate": float(np.nanmean(repetition_rates(generated))),
+        "reference_repetition_rate": float(np.nanmean(repetition_rates(reference))),
+        "out_of_key_share": float(np.nanmean(out_of_key_shares(generated_pitches))),
+        "reference_out_of_key_share": float(np.nanmean(out_of_key_shares(reference_pitches))),
+    }
+
+
+def validation_perplexity(model, int_songs: np.ndarray, window_offsets: np.ndarray, vocabulary_size: int,
+                          sequence_length: int = SEQUENCE_LENGTH, batch_size: int = 256) -> float:
+    """
+    The model's perplexity predicting the symbol after each window, exp of the mean negative log likelihood.
+    :param model: The model to evaluate.
+    :param int_songs: The integer representation of the flattened dataset.
+    :param window_offsets: The start offset of each window to evaluate on.
+    :param vocabulary_size: The size of the vocabulary.
+    :param sequence_length: The window length.
+    :param batch_size: The number of windows predicted at once.
+    :return: The perplexity, 1 being perfect and vocabulary_size being no better than a uniform guess.
+    """
+    from training import make_training_dataset
+
+    dataset = make_training_dataset(int_songs, sequence_length, vocabulary_size, batch_size,
+                                    window_offsets=window_offsets, shuffle=False)
+    total_log_likelihood, count = 0.0, 0
+    for inputs, targets in dataset:
+        probabilities = model(inputs, training=False).numpy()
+        target_probabilities = probabilities[np.arange(len(probabilities)), targets.numpy()]
+        total_log_likelihood += float(np.log(np.maximum(target_probabilities, 1e-12)).sum())
+        count += len(target_probabilities)
+    return float(np.exp(-total_log_likelihood / max(count, 1)))
+
+
+def split_songs(flattened_dataset: str) -> List[str]:
+    """
+    :param flattened_dataset: The flattened dataset, songs separated by runs of delimiters.
+    :return: Each song, in time series string notation.
+    """
+    return [song.strip() for song in flattened_dataset.split("/") if song.strip()]
+
+
+def _validation_split(flattened_dataset: str, mappings: Dict[str, int]) -> Tuple[np.ndarray, np.ndarray, List[str]]:
+    """
+    :return: tuple, (int_songs, validation_offsets, validation_songs), the flattened dataset as ints in the mappings'
+             encoding, the start of every validation window, and the validation songs in time series notation.
+    """
+    if flattened_dataset is None:
+        flattened_dataset = load(SINGLE_FILE_DATASET_PATH)
+    is_events = is_event_vocabulary(mappings)
+    if is_events:
+        flattened_dataset = " ".join(time_series_to_events(flattened_dataset.split()))
+    int_songs = np.array(convert_songs_to_int(flattened_songs_string=flattened_dataset, mappings_dictionary=mappings))
+
+    # The last songs, split with a window-length gap so no validation window contains the training songs.
+    _, validation_offsets = validation_split_offsets(song_offset_index(int_songs, mappings["/"]), len(int_songs),
+                                                     SEQUENCE_LENGTH, VALIDATION_FRACTION)
+    validation_songs = split_songs(" ".join(flattened_dataset.split()[validation_offsets[0]:]))
+    if is_events:
+        validation_songs = [" ".join(events_to_time_series(song.split())) for song in validation_songs]
+    return int_songs, validation_offsets, validation_songs
+
+
+def evaluate_model(model_path: str, flattened_dataset: str = None, mappings_path: str = NOTE_MAPPINGS_PATH,
+                   samples: int = 128, number_of_steps: int = 128, seed_length: int = 32, temperature: float = 0.7,
+                   random_seed: int = 0, generator_options: Dict[str, Any] = None,
+                   verbose: bool = True) -> Dict[str, Any]:
+    """
+    Measures a model's validation perplexity, then generates continuations of validation songs and compares them
+    against the validation songs. The validation split is the songs in the last VALIDATION_FRACTION of the
+    flattened dataset.
+
+    :param model_path: The model to evaluate.
+    :param flattened_dataset: The flattened dataset. Default is None, loaded from SINGLE_FILE_DATASET_PATH.
+    :param mappings_path: The symbol mappings the model was trained with.
+    :param samples: The number of continuations to generate.
+    :param number_of_steps: The number of steps to generate per continuation.
+    :param seed_length: The number of time steps of each validation song used as its seed.
+    :param temperature: The sampling temperature.
+    :param random_seed: Seeds the choice of validation songs & sampling.
+    :param generator_options: Extra Generator arguments, e.g. {"mixed_precision": True}, to check a performance
+                              mode's quality.
+    :param verbose: Print the results.
+
+    :return: The validation perplexity and every evaluate_melodies metric.
+    """
+    from generator import Generator
+
+    mappings = load_mappings(mappings_path)
+    int_songs, validation_offsets, validation_songs = _validation_split(flattened_dataset, mappings)
+
+    generator = Generator(model_path, mappings_path=mappings_path, **(generator_options or {}))
+    results = {"perplexity": validation_perplexity(generator.model, int_songs, validation_offsets, len(mappings))}
+
+    rng = np.random.default_rng(random_seed)
+    seed_songs = [validation_songs[i] for i in rng.integers(0, len(validation_songs), size=samples)]
+    seeds = [" ".join(song.split()[:seed_length]) for song in seed_songs]
+    melodies = generator.generate_batch(seeds, number_of_steps=number_of_steps, max_sequence_length=SEQUENCE_LENGTH,
+                                        temperature=temperature, rng=rng)
+    # Only the generated part of each melody is evaluated.
+    continuations = [" ".join(melody[len(seed.split()):]) for seed, melody in zip(seeds, melodies)]
+    results.update(evaluate_melodies(continuations, validation_songs, mappings))
+
+    if verbose:
+        for name, value in results.items():
+            print(f"{name:<28} {value:.4f}")
+    return results
+
+
+def evaluate_long_context(model_path: str, flattened_dataset: str = None, mappings_path: str = NOTE_MAPPINGS_PATH,
+                          samples: int = 64, number_of_steps: int = 32 * STEPS_PER_BAR, seed_length: int = 64,
+                          temperature: float = 0.7, summary_bars: int = LONG_CONTEXT_SUMMARY_BARS,
+                          random_seed: int = 0, verbose: bool = True) -> Dict[str, Dict[str, float]]:
+    """
+    Compares the structure and cost per step of long continuations, 32 bars or more, generated with:
+        window: the last SEQUENCE_LENGTH symbols re-read every step, the default.
+        full_window: the whole melody re-read every step, so the cost per step grows with the melody.
+        stateful: the recurrent state carried across the whole melody, one symbol read per step.
+        stateful_summary: as stateful, periodically rebuilding the state from the melody's most repeated bars.
+
+    :param model_path: The model to evaluate.
+    :param flattened_dataset: The flattened dataset. Default is None, loaded from SINGLE_FILE_DATASET_PATH.
+    :param mappings_path: The symbol mappings the model was trained with.
+    :param samples: The number of continuations to generate per mode.
+    :param number_of_steps: The number of steps to generate per continuation.
+    :param seed_length: The number of time steps of each validation song used as its seed.
+    :param temperature: The sampling temperature.
+    :param summary_bars: The number of bars in the stateful_summary mode's summary.
+    :param random_seed: Seeds the choice of validation songs & sampling.
+    :param verbose: Print the results.
+
+    :return: Each mode's milliseconds per step and structure_metrics, plus the structure_metrics of the seeds' songs.
+    """
+    from generator import Generator
+
+    mappings = load_mappings(mappings_path)
+    _, _, validation_songs = _validation_split(flattened_dataset, mappings)
+    generator = Generator(model_path, mappings_path=mappings_path)
+
+    rng = np.random.default_rng(random_seed)
+    seed_songs = [validation_songs[i] for i in rng.integers(0, len(validation_songs), size=samples)]
+    seeds = [" ".join(song.split()[:seed_length]) for song in seed_songs]
+    modes = {
+        "window": lambda: generator.generate_batch(seeds, number_of_steps, SEQUENCE_LENGTH, temperature, rng=rng),
+        "full_window": lambda: generator.generate_batch(seeds, number_of_steps, seed_length + number_of_steps,
+                                                        temperature, rng=rng),
+        "stateful": lambda: generator.generate_long_batch(seeds, number_of_steps, temperature, rng=rng),
+        "stateful_summary": lambda: generator.generate_long_batch(seeds, number_of_steps, temperature,
+                                                                  summary_bars=summary_bars, rng=rng),
+    }
+
+    if generator.encoding == "events":
+        del modes["stateful_summary"]  # Summaries are made of bars of time steps.
+
+    results = {"reference": structure_metrics(EncodedBatch(seed_songs, mappings))}
+    for mode, generate in modes.items():
+        start = time.perf_counter()
+        melodies = generate()
+        step_time = (time.perf_counter() - start) / number_of_steps
+        # The seed is kept, so repeats of the seed's bars count towards the structure.
+        results[mode] = {"step_ms": step_time * 1000,
+                         **structure_metrics(EncodedBatch([" ".join(melody) for melody in melodies], mappings))}
+
+    if verbose:
+        names = list(results["reference"])
+        print(f"{'mode':<18} {'ms / step':>10} " + " ".join(f"{name:>26}" for name in names))
+        for mode, result in results.items():
+            step_ms = f"{result['step_ms']:>10.2f}" if "step_ms" in result else f"{'':>10}"
+            print(f"{mode:<18} {step_ms} " + " ".join(f"{result[name]:>26.4f}" for name in names))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate a model's melody quality on the validation split.")
+    parser.add_argument("--model-path", required=True)
+    parser.add_argument("--mappings-path", default=NOTE_MAPPINGS_PATH)
+    parser.add_argument("--samples", type=int, default=128)
+    parser.add_argument("--bars", type=int, default=8)
+    parser.add_argument("--temperature", type=float, default=0.7)
+    parser.add_argument("--long-context", action="store_true",
+                        help="Compare the structure of long continuations generated with & without carried state.")
+    parser.add_argument("--summary-bars", type=int, default=LONG_CONTEXT_SUMMARY_BARS)
+    parser.add_argument("--output", help="Optionally write the results to a JSON file.")
+    args = parser.parse_args()
+
+    if args.long_context:
+        results = evaluate_long_context(args.model_path, mappings_path=args.mappings_path, samples=args.samples,
+                                        number_of_steps=args.bars * STEPS_PER_BAR, temperature=args.temperature,
+                                        summary_bars=args.summary_bars)
+    else:
+        results = evaluate_model(args.model_path, mappings_path=args.mappings_path, samples=args.samples,
+                                 number_of_steps=args.bars * STEPS_PER_BAR, temperature=args.temperature)
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump(results, fp, indent=4)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,20 @@
-import json
+import os
 import keras
-from preprocess import SEQUENCE_LENGTH, NOTE_MAPPINGS_PATH
-from training import MODEL_FILEPATH
+import tensorflow as tf
+from preprocess import SEQUENCE_LENGTH, NOTE_MAPPINGS_PATH, load_mappings, vocabulary_path_for_model, \
+    validate_model_vocabulary, is_event_vocabulary, parse_event, time_series_to_events, events_to_time_series, \
+    fit_events_to_vocabulary
+from training import MODEL_FILEPATH, convert_to_mixed_precision
 import numpy as np
+import time
+from metrics import LSTM_STEP_LATENCY
 import music21 as m21
-from typing import List
+from collections import Counter
+from typing import List, Iterator, Tuple
 
 MIDI_OUTPUT_PATH = "generated-melodies/melody.mid"
+STEPS_PER_BAR = 16  # Time steps per 4/4 bar of 16th notes.
+SUMMARY_REFRESH_BARS = 4  # How often long context generation rebuilds its state from the summary, in bars.
 
 
 def streamify_melody(melody: str, step_duration: float = 0.25, tempo: int = 120) -> m21.stream.Stream:
@@ -57,6 +65,19 @@ def streamify_melody(melody: str, step_duration: float = 0.25, tempo: int = 120)
     return stream
 
 
+def streamify_events(melody: List[str], step_duration: float = 0.25, tempo: int = 120) -> m21.stream.Stream:
+    """
+    De-encodes event symbols ("60:4 r:2") into an M21 Stream object, the counterpart of streamify_melody.
+
+    :param melody: The Melody to de-encode.
+    :param step_duration: The Step duration.
+    :param tempo: The tempo of the melody.
+    :return stream: The M21 Stream representation of the melody.
+    """
+    return streamify_melody(events_to_time_series([event for event in melody if event != "/"]),
+                            step_duration=step_duration, tempo=tempo)
+
+
 def sample_with_temperature(probability_distribution: List[float], temperature: float) -> int:
     """
     Picks a sample from a probability distribution, Forcefully increase the entropy of a specified temperature value.
@@ -74,52 +95,163 @@ def sample_with_temperature(probability_distribution: List[float], temperature:
     return index
 
 
+def sample_batch_with_temperature(probability_distributions: np.ndarray, temperature: float,
+                                  rng: np.random.Generator = None) -> np.ndarray:
+    """
+    Picks one sample from each row of a batch of probability distributions at once, see sample_with_temperature.
+    :param probability_distributions: The distributions to pick from, shape: batch size * vocabulary size.
+    :param temperature: The temperature to use. 0 picks the most likely symbol.
+    :param rng: The random number generator to use. Default is None, a new unseeded generator.
+    :return: The index of the sample picked from each distribution.
+    """
+    if temperature == 0:
+        return np.argmax(probability_distributions, axis=1)
+    rng = rng or np.random.default_rng()
+
+    predictions = np.log(np.maximum(probability_distributions, 1e-12)) / temperature
+    predictions -= predictions.max(axis=1, keepdims=True)  # Avoids overflow in exp, doesn't change the softmax.
+    probability_distributions = np.exp(predictions)
+    cumulative = np.cumsum(probability_distributions, axis=1)
+    # Inverse transform sampling, the first index whose cumulative probability exceeds a uniform sample.
+    thresholds = rng.random((len(cumulative), 1)) * cumulative[:, -1:]
+    return np.minimum((cumulative < thresholds).sum(axis=1), cumulative.shape[1] - 1)
+
+
 class Generator:
 
-    def __init__(self, model_path: str) -> None:
+    def __init__(self, model_path: str, jit_compile: bool = False, mixed_precision: bool = False,
+                 mappings_path: str = None) -> None:
         """
         Initialises the Music Generator by loading a trained model.
         :param model_path: str, Path of the saved model.
+        :param jit_compile: bool, optional, Decode each step with an XLA compiled function. Default is False.
+        :param mixed_precision: bool, optional, Decode in bfloat16 where the CPU supports it. Default is False.
+        :param mappings_path: str, optional, Path of the symbol mappings the model was trained with. Default is None,
+                              the vocabulary saved next to the model, or NOTE_MAPPINGS_PATH if there isn't one.
+        :raises: VocabularyMismatchError, if the model's input or output width doesn't match the mappings.
         """
         self.model_path = model_path
+        if mappings_path is None:
+            mappings_path = vocabulary_path_for_model(model_path)
+            if not os.path.exists(mappings_path):
+                mappings_path = NOTE_MAPPINGS_PATH
+        self._mappings = load_mappings(mappings_path)
+
         self.model = keras.models.load_model(model_path)
-        with open(NOTE_MAPPINGS_PATH, "r") as fp:
-            self._mappings = json.load(fp)
+        # Fail before serving anything, rather than sampling the wrong symbols.
+        validate_model_vocabulary(self.model, self._mappings)
+        if mixed_precision:
+            self.model = convert_to_mixed_precision(self.model)
+        self._reverse_mappings = {v: k for k, v in self._mappings.items()}
+
+        # Event models ("60:4") take a step per note, but every method still takes & returns time series symbols.
+        self.encoding = "events" if is_event_vocabulary(self._mappings) else "time_series"
+        # The time steps each symbol covers, delimiters count as a step so generation always finishes.
+        self._symbol_steps = np.ones(len(self._mappings), dtype=np.int64)
+        if self.encoding == "events":
+            for symbol, symbol_int in self._mappings.items():
+                if symbol != "/":
+                    self._symbol_steps[symbol_int] = parse_event(symbol)[1]
 
         self._start_symbols = ["/"] * SEQUENCE_LENGTH
 
-    def generate_melody(self, seed: str, number_of_steps: int, max_sequence_length: int, temperature: float,
-                        verbose: bool = False) -> str:
+        # Performance mode replaces model.predict with a compiled single step decode.
+        self._predict_step = None
+        if jit_compile or mixed_precision:
+            self._predict_step = self._build_predict_step(jit_compile)
+        self._jit_compile = jit_compile
+        self._predict_batch = None  # Built on the first call to generate_batch.
+        self._stateful_functions = None  # Built on the first long context generation.
+
+    def encode_seed(self, seed: str) -> List[int]:
         """
-        Generates a melody.
+        :param seed: The seed, in string time series notation ("64 _ 63 _ _").
+        :return: The seed as the model's symbol ints.
+        :raises: KeyError, if the seed contains a symbol outside the model's vocabulary.
+        """
+        symbols = seed.split()
+        if self.encoding == "events":
+            symbols = fit_events_to_vocabulary(time_series_to_events(symbols), self._mappings)
+        return [self._mappings[symbol] for symbol in symbols]
+
+    def can_encode(self, seed: str) -> bool:
+        try:
+            self.encode_seed(seed)
+        except KeyError:
+            return False
+        return True
+
+    def _decode_symbols(self, symbol_ints, number_of_steps: int) -> List[str]:
+        """
+        Converts generated symbol ints into time series symbols, up to number_of_steps time steps.
+        Delimiters take up a time step, but are left out of the melody.
+        """
+        melody, steps = [], 0
+        for symbol_int in symbol_ints:
+            if steps >= number_of_steps:
+                break
+            symbol_steps = min(int(self._symbol_steps[symbol_int]), number_of_steps - steps)
+            steps += symbol_steps
+            symbol = self._reverse_mappings[int(symbol_int)]
+            if symbol == "/":
+                continue
+            if self.encoding == "events":
+                melody.extend(events_to_time_series([symbol])[:symbol_steps])
+            else:
+                melody.append(symbol)
+        return melody
+
+    def _build_predict_step(self, jit_compile: bool):
+        """
+        Wraps a single decoding step in a tf.function, one-hot encoding inside the compiled graph.
+        Seeds are always trimmed to the same window length, so the function is only traced once per length.
+        :param jit_compile: Whether to compile the step with XLA.
+        :return: A function taking a (1, window length) int32 seed and returning the next symbol's probabilities.
+        """
+        vocabulary_size = len(self._mappings)
+        model = self.model
+
+        @tf.function(jit_compile=jit_compile, reduce_retracing=True)
+        def predict_step(seed):
+            return model(tf.one_hot(seed, vocabulary_size), training=False)[0]
+
+        return predict_step
+
+    def stream_melody(self, seed: str, number_of_steps: int, max_sequence_length: int, temperature: float,
+                      verbose: bool = False) -> Iterator[str]:
+        """
+        Generates a melody one symbol at a time, yielding each symbol as soon as it has been sampled.
+        Allows a caller to start consuming (and playing back) a melody before the whole extension has been generated.
+        The seed itself is not yielded, only the newly generated symbols are.
 
         :param seed: The seed which kick-starts the melody off, in string time series notation ("64 _ 63 _ _")
-        :param number_of_steps: The number of steps to generate before stopping.
+        :param number_of_steps: The number of time steps (16th notes) to generate before stopping. An event model
+                                samples fewer symbols than this, as each covers several time steps.
         :param max_sequence_length: Limits the sequence length which the network uses for 'context'. Use Sequence
                                     length due to training, uses SEQUENCE_LENGTH
         :param temperature: A Value which impacts the randomness of output symbols are sampled from the network.
         :param verbose: Used to show LSTM predictions or not.
-        :return melody: The String Representation of the new song.
+        :return: An iterator over the generated symbols, in string time series notation.
         """
 
         # Create seed with start symbols.
         # The seed here will be provided by the Frontend and is provided by the user.
-        seed = seed.split()
-        melody = seed  # Initiate melody as seed.
-        seed = self._start_symbols + seed
-
         # Map seed to int representation
-        seed = [self._mappings[symbol] for symbol in seed]
-        for _ in range(number_of_steps):
+        seed = [self._mappings[symbol] for symbol in self._start_symbols] + self.encode_seed(seed)
+        generated_steps = 0
+        while generated_steps < number_of_steps:
             # Limit the seed to the max sequence length
             seed = seed[-max_sequence_length:]
-            # One hot encode the Seed.
-            onehot_seed = keras.utils.to_categorical(seed, num_classes=len(self._mappings))
-            onehot_seed = onehot_seed[np.newaxis, ...]
-
-            # Predict the prbabilities of the next note. (gives a probability of each symbol in the vocabulary.)
-            next_note_probability_distribution = self.model.predict(onehot_seed, verbose=verbose)[0]
+            step_start = time.perf_counter()
+            if self._predict_step is not None:
+                next_note_probability_distribution = self._predict_step(np.array([seed], dtype=np.int32)).numpy()
+            else:
+                # One hot encode the Seed.
+                onehot_seed = keras.utils.to_categorical(seed, num_classes=len(self._mappings))
+                onehot_seed = onehot_seed[np.newaxis, ...]
 
+                # Predict the prbabilities of the next note. (gives a probability of each symbol in the vocabulary.)
+                next_note_probability_distribution = self.model.predict(onehot_seed, verbose=verbose)[0]
 
             # Select a note from the distribution. If the temp is 0, pick the most likely note.
             if temperature == 0:
@@ -128,18 +260,240 @@ class Generator:
                 output_int = sample_with_temperature(probability_distribution=next_note_probability_distribution,
                                                      temperature=temperature)
 
+            LSTM_STEP_LATENCY.observe(time.perf_counter() - step_start)
+
             # Update the adding the sampled int.
             seed.append(output_int)
 
-            # Map sampled, encoded int to it's unencoded value.
-            output_symbol = [k for k, v in self._mappings.items() if v == output_int][0]
+            # Map sampled, encoded int to it's unencoded value(s), an event covers several time steps.
+            output_symbols = self._decode_symbols([output_int], number_of_steps - generated_steps)
+            generated_steps += min(int(self._symbol_steps[output_int]), number_of_steps - generated_steps)
 
-            # End the melody if the system decides it's most likely to end.
-            if output_symbol == "/":
+            # Delimiters decode to nothing, the melody carries on.
+            yield from output_symbols
+
+    def generate_batch(self, seeds: List[str], number_of_steps: int, max_sequence_length: int, temperature: float,
+                       rng: np.random.Generator = None) -> List[List[str]]:
+        """
+        Generates a continuation for many seeds at once, predicting the next symbol of every seed in one model call
+        per step. Much faster than generate_melody per seed when generating many melodies offline.
+
+        :param seeds: The seeds which kick-start each melody off, in string time series notation ("64 _ 63 _ _")
+        :param number_of_steps: The number of steps to generate for every seed.
+        :param max_sequence_length: Limits the sequence length which the network uses for 'context'.
+        :param temperature: A Value which impacts the randomness of output symbols are sampled from the network.
+        :param rng: The random number generator used for sampling. Default is None, a new unseeded generator.
+        :return: Each melody, the seed followed by its generated symbols, in the same order as seeds.
+        """
+        if self._predict_batch is None:
+            vocabulary_size = len(self._mappings)
+            model = self.model
+
+            @tf.function(jit_compile=self._jit_compile, reduce_retracing=True)
+            def predict_batch(windows):
+                return model(tf.one_hot(windows, vocabulary_size), training=False)
+
+            self._predict_batch = predict_batch
+
+        # Every seed is prefixed with start symbols, so every window is the same length once trimmed.
+        start_symbols = [self._mappings["/"]] * max_sequence_length
+        windows = np.array([(start_symbols + self.encode_seed(seed))[-max_sequence_length:] for seed in seeds],
+                           dtype=np.int32)
+        generated = np.empty((len(seeds), number_of_steps), dtype=np.int32)
+        generated_steps = np.zeros(len(seeds), dtype=np.int64)
+
+        # Each symbol covers at least one time step, event models finish in fewer steps.
+        for step in range(number_of_steps):
+            probability_distributions = self._predict_batch(windows).numpy().astype(np.float64)
+            generated[:, step] = sample_batch_with_temperature(probability_distributions, temperature, rng)
+            windows = np.concatenate([windows[:, 1:], generated[:, step:step + 1]], axis=1)
+            generated_steps += self._symbol_steps[generated[:, step]]
+            if (generated_steps >= number_of_steps).all():
+                generated = generated[:, :step + 1]
+                break
+
+        # As with stream_melody, delimiters are fed back into the model but left out of the melody.
+        return [seed.split() + self._decode_symbols(symbols, number_of_steps) for seed, symbols in zip(seeds, generated)]
+
+    def _build_stateful_functions(self):
+        """
+        Copies the model's recurrent layers into layers which also return their final states, so decoding can carry
+        the state forward and feed one new symbol per step, instead of re-reading a window every step.
+        :return: tuple, (prime, step, zero_states). prime & step both take (batch * length) int32 symbols and a
+                 tuple of states, returning the last symbol's next symbol probabilities and the new states.
+                 step is only ever called with one symbol, so is XLA compiled when jit_compile is enabled.
+        """
+        vocabulary_size = len(self._mappings)
+        recurrent_layers, state_sizes = [], []
+        for layer in self.model.layers:
+            if not isinstance(layer, keras.layers.RNN):
                 continue
+            config = layer.get_config()
+            config.update(return_sequences=True, return_state=True, stateful=False)
+            stateful_layer = layer.__class__.from_config(config)
+            sizes = layer.cell.state_size if isinstance(layer.cell.state_size, (list, tuple)) \
+                else [layer.cell.state_size]
+            # Built eagerly so the weights can be copied across before any function is traced.
+            stateful_layer(tf.zeros((1, 1, layer.input_shape[-1])))
+            stateful_layer.set_weights(layer.get_weights())
+            recurrent_layers.append(stateful_layer)
+            state_sizes.append((sizes, stateful_layer.compute_dtype))
+        output_layer = [layer for layer in self.model.layers if isinstance(layer, keras.layers.Dense)][-1]
+
+        def run(symbols, states):
+            x = tf.one_hot(symbols, vocabulary_size)
+            new_states, state_index = [], 0
+            for stateful_layer, (sizes, _) in zip(recurrent_layers, state_sizes):
+                initial_state = list(states[state_index:state_index + len(sizes)])
+                x, *layer_states = stateful_layer(x, initial_state=initial_state, training=False)
+                new_states.extend(layer_states)
+                state_index += len(sizes)
+            return output_layer(x[:, -1]), tuple(new_states)
+
+        def zero_states(batch_size: int) -> Tuple[tf.Tensor, ...]:
+            return tuple(tf.zeros((batch_size, size), dtype=dtype) for sizes, dtype in state_sizes for size in sizes)
+
+        prime = tf.function(run, reduce_retracing=True)
+        step = tf.function(run, jit_compile=self._jit_compile, reduce_retracing=True)
+        return prime, step, zero_states
+
+    def _prime_states(self, contexts: List[List[int]]):
+        """
+        Runs the model over each context from an empty state, left padding shorter contexts with delimiters.
+        :param contexts: Each melody's context, as symbol ints.
+        :return: tuple, (probabilities, states), the next symbol probabilities and the states after each context.
+        """
+        prime, _, zero_states = self._stateful_functions
+        length = max(len(context) for context in contexts)
+        delimiter = self._mappings["/"]
+        padded = np.array([[delimiter] * (length - len(context)) + context for context in contexts], dtype=np.int32)
+        return prime(padded, zero_states(len(contexts)))
+
+    @staticmethod
+    def _summarise(symbols: List[int], bar_counts: Counter, max_sequence_length: int, summary_bars: int) -> List[int]:
+        """
+        Compresses a melody's earlier bars into its most repeated bars, e.g. a chorus or recurring motif, kept in the
+        order they first appeared. Bars still inside the recent window are left out, as they're already in context.
+        :param symbols: The melody so far, as symbol ints, starting from the first bar of the seed.
+        :param bar_counts: The number of times each complete bar of the melody has occurred.
+        :param max_sequence_length: The length of the recent window.
+        :param summary_bars: The maximum number of bars in the summary.
+        :return: The summary's symbols.
+        """
+        window_start_bar = -(-max(len(symbols) - max_sequence_length, 0) // STEPS_PER_BAR)
+        first_bars = {}
+        for bar_index in range(window_start_bar):
+            bar = tuple(symbols[bar_index * STEPS_PER_BAR:(bar_index + 1) * STEPS_PER_BAR])
+            first_bars.setdefault(bar, bar_index)
+        most_repeated = sorted(first_bars, key=lambda bar: (-bar_counts[bar], first_bars[bar]))[:summary_bars]
+        return [symbol for bar in sorted(most_repeated, key=first_bars.get) for symbol in bar]
+
+    def _decode_long(self, seeds: List[str], number_of_steps: int, temperature: float, summary_bars: int,
+                     max_sequence_length: int, rng: np.random.Generator = None) -> Iterator[np.ndarray]:
+        """
+        Decodes a batch of melodies carrying the recurrent state across the whole melody, one model step per symbol.
+        With summary_bars, every SUMMARY_REFRESH_BARS bars the state is rebuilt from a summary of the melody's most
+        repeated earlier bars followed by the recent window, so it stays close to the windows the model was trained
+        on while still hearing material from well before the window. The rebuild costs a fixed number of steps
+        however long the melody gets, so the cost per step stays constant.
+        :return: An iterator over each step's sampled symbol ints, one per seed.
+        """
+        if summary_bars and self.encoding == "events":
+            raise ValueError("Summaries are made of bars of time steps, so need a time series model.")
+        if self._stateful_functions is None:
+            self._stateful_functions = self._build_stateful_functions()
+        _, step, _ = self._stateful_functions
+
+        melodies = [self.encode_seed(seed) for seed in seeds]
+        bar_counts = [Counter(tuple(melody[start:start + STEPS_PER_BAR])
+                              for start in range(0, len(melody) - STEPS_PER_BAR + 1, STEPS_PER_BAR))
+                      for melody in melodies]
+        # The whole seed is read, rather than only its last window.
+        delimiter = self._mappings["/"]
+        probabilities, states = self._prime_states([[delimiter] * SEQUENCE_LENGTH + melody for melody in melodies])
+
+        for step_index in range(number_of_steps):
+            sampled = sample_batch_with_temperature(probabilities.numpy().astype(np.float64), temperature, rng)
+            yield sampled
+            for melody, counts, symbol in zip(melodies, bar_counts, sampled):
+                melody.append(int(symbol))
+                if len(melody) % STEPS_PER_BAR == 0:
+                    counts[tuple(melody[-STEPS_PER_BAR:])] += 1
+
+            if summary_bars and (step_index + 1) % (SUMMARY_REFRESH_BARS * STEPS_PER_BAR) == 0:
+                probabilities, states = self._prime_states(
+                    [self._summarise(melody, counts, max_sequence_length, summary_bars)
+                     + melody[-max_sequence_length:] for melody, counts in zip(melodies, bar_counts)])
+            else:
+                probabilities, states = step(sampled[:, np.newaxis].astype(np.int32), states)
+
+    def stream_long_melody(self, seed: str, number_of_steps: int, temperature: float, summary_bars: int = 0,
+                           max_sequence_length: int = SEQUENCE_LENGTH,
+                           rng: np.random.Generator = None) -> Iterator[str]:
+        """
+        Generates a melody one symbol at a time like stream_melody, but carries the model's recurrent state across the
+        whole melody instead of re-reading the last max_sequence_length symbols every step. Context isn't lost after
+        max_sequence_length symbols, and each step costs the same however long the melody gets.
+
+        :param seed: The seed which kick-starts the melody off, in string time series notation ("64 _ 63 _ _")
+        :param number_of_steps: The number of steps to generate before stopping.
+        :param temperature: A Value which impacts the randomness of output symbols are sampled from the network.
+        :param summary_bars: The number of earlier, most repeated bars to periodically rebuild the state from,
+                             alongside the recent window. Default is 0, only carry the state.
+        :param max_sequence_length: The recent window length used when rebuilding the state from a summary.
+        :param rng: The random number generator used for sampling. Default is None, a new unseeded generator.
+        :return: An iterator over the generated symbols, in string time series notation.
+        """
+        generated_steps = 0
+        step_start = time.perf_counter()
+        for sampled in self._decode_long([seed], number_of_steps, temperature, summary_bars, max_sequence_length, rng):
+            LSTM_STEP_LATENCY.observe(time.perf_counter() - step_start)
+            yield from self._decode_symbols(sampled, number_of_steps - generated_steps)
+            generated_steps += int(self._symbol_steps[sampled[0]])
+            if generated_steps >= number_of_steps:
+                return
+            step_start = time.perf_counter()
+
+    def generate_long_batch(self, seeds: List[str], number_of_steps: int, temperature: float, summary_bars: int = 0,
+                            max_sequence_length: int = SEQUENCE_LENGTH,
+                            rng: np.random.Generator = None) -> List[List[str]]:
+        """
+        Generates a continuation for many seeds at once with long context, see stream_long_melody & generate_batch.
+        :return: Each melody, the seed followed by its generated symbols, in the same order as seeds.
+        """
+        if number_of_steps <= 0:
+            return [seed.split() for seed in seeds]
+        generated = []
+        generated_steps = np.zeros(len(seeds), dtype=np.int64)
+        for sampled in self._decode_long(seeds, number_of_steps, temperature, summary_bars, max_sequence_length, rng):
+            generated.append(sampled)
+            generated_steps += self._symbol_steps[sampled]
+            if (generated_steps >= number_of_steps).all():
+                break
+        generated = np.stack(generated, axis=1)
+        return [seed.split() + self._decode_symbols(symbols, number_of_steps)
+                for seed, symbols in zip(seeds, generated)]
+
+    def generate_melody(self, seed: str, number_of_steps: int, max_sequence_length: int, temperature: float,
+                        verbose: bool = False) -> List[str]:
+        """
+        Generates a melody.
+
+        :param seed: The seed which kick-starts the melody off, in string time series notation ("64 _ 63 _ _")
+        :param number_of_steps: The number of steps to generate before stopping.
+        :param max_sequence_length: Limits the sequence length which the network uses for 'context'. Use Sequence
+                                    length due to training, uses SEQUENCE_LENGTH
+        :param temperature: A Value which impacts the randomness of output symbols are sampled from the network.
+        :param verbose: Used to show LSTM predictions or not.
+        :return melody: The String Representation of the new song.
+        """
 
-            # Update the Melody
-            melody.append(output_symbol)
+        melody = seed.split()  # Initiate melody as seed.
+        melody.extend(self.stream_melody(seed=seed,
+                                         number_of_steps=number_of_steps,
+                                         max_sequence_length=max_sequence_length,
+                                         temperature=temperature,
+                                         verbose=verbose))
         if verbose:
             print("Melody Generated")
 
@@ -0,0 +1,195 @@
+"""
+Lightweight, dependency free metrics which are exposed in the Prometheus text format on the API's /metrics route.
+Every update is a dictionary lookup and an addition behind a lock, so the metrics are cheap enough to leave on.
+"""
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Dict, List, Tuple, Iterator
+
+DEFAULT_LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+LSTM_STEP_LATENCY_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.02, 0.035, 0.05, 0.075, 0.1, 0.25, 0.5, 1]
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(label_names: Tuple[str, ...], label_values: LabelValues, extra: str = "") -> str:
+    """
+    Formats a set of labels into the Prometheus text format, e.g. {stage="transpose"}.
+    :param label_names: The names of the labels.
+    :param label_values: The values of the labels, in the same order as label_names.
+    :param extra: An optional extra, pre-formatted label to append (used for histogram buckets).
+    :return: The formatted labels, or an empty string if there are none.
+    """
+    pairs = [f'{name}="{value}"' for name, value in zip(label_names, label_values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric(ABC):
+    """Base class for all metrics, handles labels and locking."""
+
+    metric_type = ""
+
+    def __init__(self, name: str, description: str, label_names: Tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.metric_type}"]
+
+    @abstractmethod
+    def render(self) -> List[str]:
+        """
+        :return: The metric's lines in the Prometheus text format.
+        """
+
+
+class Counter(_Metric):
+    """A value which only ever increases, e.g. the number of cache hits."""
+
+    metric_type = "counter"
+
+    def __init__(self, name: str, description: str, label_names: Tuple[str, ...] = ()) -> None:
+        super().__init__(name, description, label_names)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels: str) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = dict(self._values)
+        lines = self._header()
+        for key, value in values.items():
+            lines.append(f"{self.name}{_format_labels(self.label_names, key)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    """A value which can go up and down, e.g. the number of active jobs."""
+
+    metric_type = "gauge"
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    """Counts observations into cumulative buckets, e.g. per-stage latencies."""
+
+    metric_type = "histogram"
+
+    def __init__(self, name: str, description: str, label_names: Tuple[str, ...] = (),
+                 buckets: List[float] = None) -> None:
+        super().__init__(name, description, label_names)
+        self.buckets = sorted(buckets if buckets is not None else DEFAULT_LATENCY_BUCKETS)
+        # Label values -> [bucket counts..., sum, count]
+        self._values: Dict[LabelValues, List[float]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = [0] * (len(self.buckets) + 2)
+                self._values[key] = state
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = {key: list(state) for key, state in self._values.items()}
+        lines = self._header()
+        for key, state in values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                bucket_label = 'le="' + str(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, bucket_label)} {cumulative}")
+            inf_label = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, inf_label)} {state[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {state[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {state[-1]}")
+        return lines
+
+
+# --- Metric Definitions ---
+
+STAGE_LATENCY = Histogram("lstmusic_stage_latency_seconds",
+                          "Time spent in each stage of a generation request.",
+                          label_names=("stage",))
+LSTM_STEP_LATENCY = Histogram("lstmusic_lstm_step_latency_seconds",
+                              "Time spent predicting and sampling a single LSTM generation step.",
+                              buckets=LSTM_STEP_LATENCY_BUCKETS)
+JOBS_QUEUED = Gauge("lstmusic_jobs_queued", "Generation jobs which have been accepted but not yet started.")
+JOBS_ACTIVE = Gauge("lstmusic_jobs_active", "Generation jobs which are currently being generated.")
+JOBS_TOTAL = Counter("lstmusic_jobs_total", "Finished generation jobs, by outcome.", label_names=("outcome",))
+CACHE_LOOKUPS = Counter("lstmusic_cache_lookups_total", "Cache lookups, by cache and result (hit/miss).",
+                        label_names=("cache", "result"))
+STORAGE_BYTES = Gauge("lstmusic_storage_bytes", "Total size of each artifact store after its last cleanup.",
+                      label_names=("store",))
+STORAGE_EVICTIONS = Counter("lstmusic_storage_evictions_total",
+                            "Artifacts removed, by store and reason (expired/size).", label_names=("store", "reason"))
+SEED_QUANTIZATION_CHANGES = Counter("lstmusic_seed_quantization_changes_total",
+                                    "Seed notes changed while snapping them to the 16th note grid, by change.",
+                                    label_names=("change",))
+
+REGISTRY: List[_Metric] = [STAGE_LATENCY, LSTM_STEP_LATENCY, JOBS_QUEUED, JOBS_ACTIVE, JOBS_TOTAL, CACHE_LOOKUPS,
+                           STORAGE_BYTES, STORAGE_EVICTIONS, SEED_QUANTIZATION_CHANGES]
+
+
+@contextmanager
+def timed(stage: str) -> Iterator[None]:
+    """
+    Times the wrapped block of code, recording it in the stage latency histogram.
+    e.g. with timed("transpose"): ...
+    :param stage: The name of the stage being timed.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_LATENCY.observe(time.perf_counter() - start, stage=stage)
+
+
+def record_cache_lookup(cache: str, hit: bool) -> None:
+    """
+    Records a single cache lookup, used to calculate cache hit rates.
+    :param cache: The name of the cache being looked up.
+    :param hit: Whether the lookup was a hit.
+    """
+    CACHE_LOOKUPS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+def render_metrics() -> str:
+    """
+    Renders every registered metric in the Prometheus text exposition format.
+    :return: The rendered metrics.
+    """
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
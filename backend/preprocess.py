@@ -1,5 +1,7 @@
 # Imports & Drive mounting
 import os
+import functools
+import struct
 import music21 as m21
 import json
 import keras
@@ -14,6 +16,9 @@ KERN_DATASET_PATH = "dataset-resources/KERN"
 SINGLE_FILE_DATASET_PATH = "dataset-resources/single file dataset"
 ENCODED_DATASET_DIR = "dataset-resources/Encoded Dataset"
 NOTE_MAPPINGS_PATH = "dataset-resources/Song Mappings/mappings.json"
+EVENT_MAPPINGS_PATH = "dataset-resources/Song Mappings/event_mappings.json"
+VOCABULARY_EXTENSION = ".vocab"  # Binary mappings saved next to a model, see save_vocabulary.
+VOCABULARY_MAGIC = b"LSTMVOC1"
 
 ACCEPTABLE_DURATIONS = [
     0.25,  # Sixteenth Note
@@ -26,6 +31,45 @@ ACCEPTABLE_DURATIONS = [
     4  # Whole note
 ]
 
+# Event encoding, one symbol per note/rest holding its duration in time steps, e.g. "60:4" for a quarter note.
+# Longer than MAX_EVENT_STEPS carries on with prolongation events ("_:4"), so any time series song can be converted.
+ENCODINGS = ["time_series", "events"]
+EVENT_SEPARATOR = ":"
+MAX_EVENT_STEPS = 16  # A whole note of 16th notes, the longest acceptable duration.
+
+# Krumhansl-style key profiles, the perceived stability of each pitch class in a key with a tonic of C.
+# Krumhansl-Kessler's come from listening experiments, Aarden-Essen's come from the Essen folksong collection, which
+# the training data is taken from. Aarden-Essen is also what music21's song.analyze("key") uses.
+KEY_PROFILES = {
+    "krumhansl": {"major": [6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88],
+                  "minor": [6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17]},
+    "aarden": {"major": [17.7661, 0.145624, 14.9265, 0.160186, 19.8049, 11.3587,
+                         0.291248, 22.062, 0.145624, 8.15494, 0.232998, 4.95122],
+               "minor": [18.2648, 0.737619, 14.0499, 16.8599, 0.702494, 14.4362,
+                         0.702494, 18.6161, 4.56621, 1.93186, 7.37619, 1.75623]}
+}
+DEFAULT_KEY_PROFILE = "aarden"
+
+
+def _rotated_key_profiles(profile: Dict[str, List[float]]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Rotates a key profile to every tonic, major keys first then minor keys, mean centred for correlation.
+    :param profile: The major and minor weights of a key profile.
+    :return: tuple, (profiles, norms), The 24 * 12 matrix of centred profiles and each row's norm.
+    """
+    profiles = np.array([np.roll(profile["major"], tonic) for tonic in range(12)] +
+                        [np.roll(profile["minor"], tonic) for tonic in range(12)])
+    profiles = profiles - profiles.mean(axis=1, keepdims=True)
+    return profiles, np.linalg.norm(profiles, axis=1)
+
+
+_ROTATED_KEY_PROFILES = {name: _rotated_key_profiles(profile) for name, profile in KEY_PROFILES.items()}
+
+PITCH_CLASS_NAMES = ["C", "C#", "D", "E-", "E", "F", "F#", "G", "A-", "A", "B-", "B"]
+
+# The tonic which each mode is transposed to, C Major or A Minor.
+TARGET_TONICS = {"major": "C", "minor": "A"}
+
 
 def file_exists(file_path: str) -> bool:
     """
@@ -102,33 +146,192 @@ def transpose(song: m21.stream.base.Score,
 
     :return: music21.stream.base.Score, The transposed song.
     """
-    # Get key from metadata.
-    parts = song.getElementsByClass(m21.stream.Part)  # Get song's parts (instrument tracks)
-    part0_measures = parts[0].getElementsByClass(m21.stream.Measure)  # Get the measures (bars) of the first part.
-    key = part0_measures[0][4]  # Get the key from the song's first measure at Index 4.
+    # Get key from metadata, searching the whole score rather than relying on its position in the first measure.
+    stored_keys = song.flatten().getElementsByClass(m21.key.Key)
 
     # Estimate key using Music21 if Key isn't stored in metadata.
-    if not isinstance(key, m21.key.Key):
+    if len(stored_keys) > 0:
+        key = stored_keys[0]
+    else:
         key = song.analyze("key")
 
     # Calculate the interval for the transposition required. E.g, Bmaj -> Cmaj
-    if key.mode == "major":
-        interval = m21.interval.Interval(key.tonic, m21.pitch.Pitch("C"))
-    elif key.mode == "minor":
-        interval = m21.interval.Interval(key.tonic, m21.pitch.Pitch("A"))
-    else:
-        raise ValueError(f"Error during Transposition: Invalid Mode Given: {key.mode}.")
+    interval = transposition_interval(key.tonic, key.mode)
     reversed_interval = m21.interval.Interval.reverse(interval)  # Reversed Interval is Used after a song is generated.
 
     # Transpose song using calculated interval
-    to_note = "C" if key.mode == "major" else "A"
     if verbose:
-        print(f"Converting Song from Key {key.tonic} {key.mode} To {to_note} {key.mode}")
+        print(f"Converting Song from Key {key.tonic} {key.mode} To {TARGET_TONICS[key.mode]} {key.mode}")
     transposed_song = song.transpose(interval)
 
     return transposed_song, reversed_interval
 
 
+def pitch_class_histogram(encoded_song: str) -> np.ndarray:
+    """
+    Creates a duration weighted pitch class histogram from a song in time series notation.
+    "60 _ _ _ 62 _ r _" -> C: 4, D: 2.
+
+    :param encoded_song: The song in time series string notation.
+
+    :return: np.ndarray, The total number of time steps spent on each of the 12 pitch classes.
+    """
+    symbols = np.array(encoded_song.split())
+    if len(symbols) == 0:
+        return np.zeros(12)
+
+    # Each event (note/rest) lasts until the next event starts.
+    event_positions = np.flatnonzero(symbols != "_")
+    durations = np.diff(np.append(event_positions, len(symbols)))
+    events = symbols[event_positions]
+
+    is_note = np.char.isdigit(events)
+    pitches = events[is_note].astype(int)
+
+    return np.bincount(pitches % 12, weights=durations[is_note], minlength=12)
+
+
+def estimate_key(encoded_song: str, profile: str = DEFAULT_KEY_PROFILE) -> Tuple[int, str]:
+    """
+    Estimates a song's key by correlating its pitch class histogram with every key's profile.
+    Much cheaper than music21's song.analyze("key") as it works directly on the encoded symbols.
+
+    :param encoded_song: The song in time series string notation.
+    :param profile: The key profile to use, a key of KEY_PROFILES. Default is "aarden".
+
+    :return: tuple, (tonic, mode), The tonic's pitch class (C = 0, C# = 1, ...) and "major" or "minor".
+    """
+    tonics, is_minor = estimate_keys(pitch_class_histogram(encoded_song)[np.newaxis], profile)
+    return int(tonics[0]), "minor" if is_minor[0] else "major"
+
+
+def estimate_keys(histograms: np.ndarray, profile: str = DEFAULT_KEY_PROFILE) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Estimates the keys of many songs at once from their pitch class histograms, see estimate_key.
+
+    :param histograms: np.ndarray, Shape: number of songs * 12, each song's pitch class histogram.
+    :param profile: The key profile to use, a key of KEY_PROFILES. Default is "aarden".
+
+    :return: tuple, (tonics, is_minor), each song's tonic pitch class and whether it's in a minor key.
+    """
+    centred_histograms = histograms - histograms.mean(axis=1, keepdims=True)
+    histogram_norms = np.linalg.norm(centred_histograms, axis=1)
+
+    key_profiles, key_profile_norms = _ROTATED_KEY_PROFILES[profile]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        correlations = (centred_histograms @ key_profiles.T) / (key_profile_norms * histogram_norms[:, np.newaxis])
+    best_keys = np.argmax(correlations, axis=1)
+
+    # A constant histogram, from a song of only rests or one spending equal time on all 12 pitch classes, correlates
+    # equally with every key, so it has no key, leave it where it is.
+    best_keys[histogram_norms == 0] = 0
+
+    return best_keys % 12, best_keys >= 12
+
+
+def transposition_interval(tonic: m21.pitch.Pitch, mode: str) -> m21.interval.Interval:
+    """
+    Calculates the interval which transposes a key into C Major or A Minor.
+
+    :param tonic: The key's tonic.
+    :param mode: The key's mode, "major" or "minor".
+
+    :return: The interval from the tonic to C or A in the same octave, e.g. G Major -> -7, C Minor -> +9.
+    """
+    if mode not in TARGET_TONICS:
+        raise ValueError(f"Error during Transposition: Invalid Mode Given: {mode}.")
+    return m21.interval.Interval(tonic, m21.pitch.Pitch(TARGET_TONICS[mode]))
+
+
+@functools.lru_cache(maxsize=None)
+def transposition_semitones(tonic: int, mode: str) -> int:
+    """
+    Calculates the shift in semitones which moves a key into C Major or A Minor,
+    the same shift which transpose applies to the training corpus.
+
+    :param tonic: The key's tonic as a pitch class (C = 0, C# = 1, ...).
+    :param mode: The key's mode, "major" or "minor".
+
+    :return: The shift in semitones, between -11 and +9.
+    """
+    return int(transposition_interval(m21.pitch.Pitch(PITCH_CLASS_NAMES[tonic]), mode).semitones)
+
+
+def shift_symbols(symbols: List[str], semitones: int) -> List[str]:
+    """
+    Transposes time series symbols by a number of semitones, leaving rests and prolongation symbols untouched.
+
+    :param symbols: The time series symbols to transpose ("64", "_", "r", ...).
+    :param semitones: The number of semitones to transpose by.
+
+    :return: The transposed symbols.
+    """
+    if semitones == 0:
+        return list(symbols)
+    shifted = []
+    for symbol in symbols:
+        # Event symbols ("60:4") keep their duration.
+        name, separator, steps = symbol.partition(EVENT_SEPARATOR)
+        shifted.append(f"{int(name) + semitones}{separator}{steps}" if name.isdigit() else symbol)
+    return shifted
+
+
+def transpose_encoded_song(encoded_song: str, verbose: bool = False) -> Tuple[str, int]:
+    """
+    Transposes a song in time series notation into C Major or A Minor using integer semitone shifts,
+    without needing the song's music21 representation.
+
+    :param encoded_song: The song in time series string notation.
+    :param verbose: Enable additional print statements for debug purposes. Default is False.
+
+    :return: tuple, (transposed_song, reverse_semitones),
+             The transposed song and the semitones needed to return it to its original key.
+    """
+    tonic, mode = estimate_key(encoded_song)
+    semitones = transposition_semitones(tonic, mode)
+
+    if verbose:
+        print(f"Converting Song from Key {PITCH_CLASS_NAMES[tonic]} {mode} To {TARGET_TONICS[mode]} {mode}")
+
+    transposed_song = " ".join(shift_symbols(encoded_song.split(), semitones))
+
+    return transposed_song, -semitones
+
+
+def measure_key_agreement(songs: List[m21.stream.base.Score], verbose: bool = False) -> Dict[str, float]:
+    """
+    Measures how often estimate_key agrees with music21's song.analyze("key").
+
+    :param songs: The songs to measure the agreement on.
+    :param verbose: Enable additional print statements for debug purposes. Default is False.
+
+    :return: A dictionary containing,
+             key_agreement: The fraction of songs where the tonic and mode both match.
+             transposition_agreement: The fraction of songs which would be transposed by the same interval as
+             transpose applies, e.g. relative keys such as C Major & A minor are both left in place.
+    """
+    key_matches = 0
+    transposition_matches = 0
+
+    for song in songs:
+        music21_key = song.analyze("key")
+        music21_tonic = music21_key.tonic.pitchClass
+        tonic, mode = estimate_key(encode_song(song))
+
+        if tonic == music21_tonic and mode == music21_key.mode:
+            key_matches += 1
+        corpus_semitones = transposition_interval(music21_key.tonic, music21_key.mode).semitones
+        if transposition_semitones(tonic, mode) == corpus_semitones:
+            transposition_matches += 1
+
+    agreement = {"key_agreement": key_matches / len(songs),
+                 "transposition_agreement": transposition_matches / len(songs)}
+    if verbose:
+        print(f"Key estimate agrees with music21 on {agreement['key_agreement']:.1%} of {len(songs)} songs, "
+              f"transposition agrees on {agreement['transposition_agreement']:.1%}.")
+    return agreement
+
+
 def encode_song(song: m21.stream.base.Score, time_step: float = 0.25, verbose: bool = False) -> str:
     """
     Encodes a music21 Score into a time series String representation.
@@ -168,6 +371,109 @@ def encode_song(song: m21.stream.base.Score, time_step: float = 0.25, verbose: b
     return encoded_song_string
 
 
+def encode_song_events(song: m21.stream.base.Score, time_step: float = 0.25, verbose: bool = False) -> str:
+    """
+    Encodes a music21 Score into an event String representation, the compact counterpart of encode_song.
+
+    Each note or rest is a single symbol of its pitch and duration in time steps, so the LSTM takes one step per
+    note rather than one per 16th.
+    pitch = 60, duration = 1.0 -> ["60:4"]
+
+    :param song: The song being encoded.
+    :param time_step: The length of each time step.
+    :param verbose: Enable additional print statements for debug purposes. Default is False.
+
+    :return: The encoded song.
+    """
+    return " ".join(time_series_to_events(encode_song(song=song, time_step=time_step, verbose=verbose).split()))
+
+
+def parse_event(event: str) -> Tuple[str, int]:
+    """
+    :param event: An event symbol, e.g. "60:4", "r:8" or "_:4".
+    :return: tuple, (symbol, steps), the event's time series symbol and its duration in time steps.
+    """
+    symbol, _, steps = event.partition(EVENT_SEPARATOR)
+    return symbol, int(steps)
+
+
+def time_series_to_events(symbols: List[str]) -> List[str]:
+    """
+    Converts time series symbols into event symbols, losslessly.
+    ["60", "_", "_", "_", "r", "_", "/"] -> ["60:4", "r:2", "/"]
+
+    :param symbols: The time series symbols.
+    :return: The event symbols. Delimiters are kept as they are.
+    """
+    events = []
+    event_symbol, event_steps = None, 0
+
+    for symbol in symbols + ["/"]:
+        if symbol == "_" and event_symbol is not None and event_steps < MAX_EVENT_STEPS:
+            event_steps += 1
+            continue
+        if event_symbol is not None:
+            events.append(f"{event_symbol}{EVENT_SEPARATOR}{event_steps}")
+        if symbol == "/":
+            events.append(symbol)
+            event_symbol, event_steps = None, 0
+        else:
+            # A prolongation symbol here carries on a held note, past MAX_EVENT_STEPS or from before the symbols.
+            event_symbol, event_steps = symbol, 1
+
+    return events[:-1]  # Without the appended delimiter.
+
+
+def events_to_time_series(events: List[str]) -> List[str]:
+    """
+    Converts event symbols back into time series symbols, the inverse of time_series_to_events.
+    :param events: The event symbols.
+    :return: The time series symbols.
+    """
+    symbols = []
+    for event in events:
+        if event == "/":
+            symbols.append(event)
+            continue
+        symbol, steps = parse_event(event)
+        symbols.append(symbol)
+        symbols.extend(["_"] * (steps - 1))
+    return symbols
+
+
+def fit_events_to_vocabulary(events: List[str], mappings: Dict[str, int]) -> List[str]:
+    """
+    Splits events with durations outside a vocabulary into the longest duration in the vocabulary, followed by
+    prolongation events for the rest. e.g. "60:5" -> ["60:4", "_:1"]. The melody itself is unchanged.
+    :param events: The event symbols.
+    :param mappings: The event mappings.
+    :return: The event symbols, only leaving events whose pitch isn't in the vocabulary at all.
+    """
+    fitted = []
+    for event in events:
+        if event in mappings or event == "/":
+            fitted.append(event)
+            continue
+        symbol, steps = parse_event(event)
+        shorter = [f"{symbol}{EVENT_SEPARATOR}{length}" for length in range(steps - 1, 0, -1)
+                   if f"{symbol}{EVENT_SEPARATOR}{length}" in mappings]
+        if not shorter:
+            fitted.append(event)
+            continue
+        fitted.append(shorter[0])
+        remainder = steps - parse_event(shorter[0])[1]
+        fitted.extend(fit_events_to_vocabulary([f"_{EVENT_SEPARATOR}{remainder}"], mappings))
+    return fitted
+
+
+def is_event_vocabulary(symbols) -> bool:
+    """
+    :param symbols: A vocabulary, or mappings.
+    :return: Whether the vocabulary is of event symbols rather than time series symbols.
+    """
+    return any(EVENT_SEPARATOR in symbol for symbol in symbols)
+
+
 def preprocess(dataset_path: str, output_path: str, verbose: bool = False) -> None:
     """
     Preprocesses all MIDI/KERN files within a provided directory & its subdirectories, writing encoded songs into specified file directory.
@@ -271,9 +577,127 @@ def flatten_dataset_to_single_file(encoded_dataset_path: str, output_path: str,
     return songs
 
 
+class VocabularyMismatchError(ValueError):
+    """Raised when a model's input or output width doesn't match the vocabulary it's used with."""
+    pass
+
+
+def sort_vocabulary(symbols) -> List[str]:
+    """
+    Sorts a vocabulary into a deterministic order, special symbols ("/", "_", "r") first then pitches ascending.
+    Event symbols ("60:4") are sorted the same way by their symbol, then by duration.
+    :param symbols: The vocabulary's symbols, in any order.
+    :return: The sorted symbols, where each symbol's index is its mapping.
+    """
+    def sort_key(symbol):
+        name, _, steps = symbol.partition(EVENT_SEPARATOR)
+        return name.isdigit(), int(name) if name.isdigit() else name, int(steps) if steps else 0
+
+    return sorted(set(symbols), key=sort_key)
+
+
+def save_vocabulary(mappings: Dict[str, int], vocabulary_path: str) -> None:
+    """
+    Saves mappings in a compact binary format: a magic header, the symbol count,
+    then each length prefixed symbol in mapping order.
+    :param mappings: The mappings to save, which must map to every integer from 0 to len(mappings) - 1.
+    :param vocabulary_path: The path to save to.
+    """
+    validate_mappings(mappings)
+    symbols = sorted(mappings, key=mappings.get)
+    data = [VOCABULARY_MAGIC, struct.pack("<I", len(symbols))]
+    for symbol in symbols:
+        encoded_symbol = symbol.encode("utf-8")
+        data.append(struct.pack("<B", len(encoded_symbol)) + encoded_symbol)
+
+    temporary_path = f"{vocabulary_path}.tmp"
+    with open(temporary_path, "wb") as fp:
+        fp.write(b"".join(data))
+    os.replace(temporary_path, vocabulary_path)
+
+
+def load_mappings(mappings_path: str = NOTE_MAPPINGS_PATH) -> Dict[str, int]:
+    """
+    Loads mappings from either a JSON file or a binary vocabulary file.
+    :param mappings_path: The path of the mappings, the .json extension selects the JSON format.
+    :return: The mappings.
+    :raises: VocabularyMismatchError, if the file isn't a vocabulary file or is truncated or corrupt.
+    """
+    if mappings_path.endswith(".json"):
+        with open(mappings_path, "r") as fp:
+            mappings = json.load(fp)
+        validate_mappings(mappings)
+        return mappings
+
+    with open(mappings_path, "rb") as fp:
+        data = fp.read()
+    if not data.startswith(VOCABULARY_MAGIC):
+        raise VocabularyMismatchError(f"{mappings_path} is not a vocabulary file.")
+    position = len(VOCABULARY_MAGIC)
+    if len(data) < position + 4:
+        raise VocabularyMismatchError(f"{mappings_path} is truncated, it has no symbol count.")
+    (count,) = struct.unpack_from("<I", data, position)
+    position += 4
+    mappings = {}
+    for i in range(count):
+        # A truncated file would otherwise decode to fewer or shorter symbols without any error.
+        if position >= len(data) or position + 1 + data[position] > len(data):
+            raise VocabularyMismatchError(f"{mappings_path} is truncated, it holds {i} of its {count} symbols.")
+        length = data[position]
+        try:
+            mappings[data[position + 1:position + 1 + length].decode("utf-8")] = i
+        except UnicodeDecodeError:
+            raise VocabularyMismatchError(f"{mappings_path} is corrupt, symbol {i} isn't valid UTF-8.")
+        position += 1 + length
+
+    if position != len(data):
+        raise VocabularyMismatchError(f"{mappings_path} is corrupt, it has data after its {count} symbols.")
+    if len(mappings) != count:
+        raise VocabularyMismatchError(f"{mappings_path} is corrupt, it has {count - len(mappings)} duplicate symbols.")
+    return mappings
+
+
+def vocabulary_path_for_model(model_path: str) -> str:
+    """
+    :param model_path: The path of a saved model.
+    :return: The path of the binary vocabulary saved alongside it.
+    """
+    return os.path.splitext(model_path)[0] + VOCABULARY_EXTENSION
+
+
+def validate_mappings(mappings: Dict[str, int]) -> None:
+    """
+    Checks that mappings map to every integer from 0 to len(mappings) - 1 exactly once,
+    so they can be used to one-hot encode symbols.
+    :param mappings: The mappings to check.
+    :raises: VocabularyMismatchError
+    """
+    if sorted(mappings.values()) != list(range(len(mappings))):
+        raise VocabularyMismatchError(f"Mappings must map {len(mappings)} symbols to the integers "
+                                      f"0 to {len(mappings) - 1}, each used once.")
+
+
+def validate_model_vocabulary(model: keras.Model, mappings: Dict[str, int]) -> None:
+    """
+    Checks that a model's one-hot input width and softmax output width both match a vocabulary's size.
+    A mismatch would otherwise only show up as errors or silently wrong symbols while generating.
+    :param model: The model to check.
+    :param mappings: The vocabulary the model will be used with.
+    :raises: VocabularyMismatchError
+    """
+    input_width = model.input_shape[-1]
+    output_width = model.output_shape[-1]
+    if input_width != len(mappings) or output_width != len(mappings):
+        raise VocabularyMismatchError(f"The model takes {input_width} and predicts {output_width} symbols, "
+                                      f"but the vocabulary contains {len(mappings)}.")
+
+
 def create_song_mappings(flattened_songs: str, mapping_path: str, verbose: bool = False) -> Dict[str, int]:
     """
     Creates a mapping of a song's symbols of its time series string representation to integers, saving it as a JSON file.
+    The vocabulary is sorted, so the same dataset always produces the same mappings.
+    For an event dataset, every note & rest is mapped with every acceptable duration, and prolongation with every
+    duration up to MAX_EVENT_STEPS, so any seed can be encoded with fit_events_to_vocabulary.
     NOTE: This does not encode the symbol, it only creates a mapping for it.
 
     :param flattened_songs: The string of the flattened data.
@@ -286,8 +710,13 @@ def create_song_mappings(flattened_songs: str, mapping_path: str, verbose: bool
     mappings = {}
 
     # Identify Vocabulary
-    flattened_songs = flattened_songs.split()
-    vocabulary = list(set(flattened_songs))
+    symbols = set(flattened_songs.split())
+    if is_event_vocabulary(symbols):
+        names = {parse_event(symbol)[0] for symbol in symbols if symbol != "/"}
+        symbols |= {f"{name}{EVENT_SEPARATOR}{int(duration / 0.25)}" for name in names
+                    for duration in ACCEPTABLE_DURATIONS}
+        symbols |= {f"_{EVENT_SEPARATOR}{steps}" for steps in range(1, MAX_EVENT_STEPS + 1)}
+    vocabulary = sort_vocabulary(symbols)
 
     # Create mappings
     for i, symbol in enumerate(vocabulary):
@@ -325,8 +754,7 @@ def convert_songs_to_int(flattened_songs_string: str, mappings_dictionary: Dict[
             print("Loading Mappings from JSON file.")
 
         # Load Mappings from JSON file
-        with open(NOTE_MAPPINGS_PATH, "r") as fp:
-            mappings_dictionary = json.load(fp)
+        mappings_dictionary = load_mappings(NOTE_MAPPINGS_PATH)
 
     # Cast songs string into a list
     flattened_songs_string = flattened_songs_string.split()
@@ -340,9 +768,133 @@ def convert_songs_to_int(flattened_songs_string: str, mappings_dictionary: Dict[
     return int_songs
 
 
+def song_offset_index(int_songs: np.ndarray, delimiter_id: int) -> np.ndarray:
+    """
+    Finds where each song starts and ends in an integer encoded flattened dataset, by looking for delimiter runs.
+
+    :param int_songs: The integer representation of the flattened dataset.
+    :param delimiter_id: The integer which the song delimiter "/" is mapped to.
+
+    :return: np.ndarray, Shape: number of songs * 2, each song's (start, end) index, end being exclusive.
+    """
+    is_delimiter = np.asarray(int_songs) == delimiter_id
+    is_song = ~is_delimiter
+    previous_is_song = np.concatenate([[False], is_song[:-1]])
+    next_is_song = np.concatenate([is_song[1:], [False]])
+
+    starts = np.flatnonzero(is_song & ~previous_is_song)
+    ends = np.flatnonzero(is_song & ~next_is_song) + 1
+    return np.stack([starts, ends], axis=1)
+
+
+def validation_split_offsets(songs: np.ndarray, corpus_length: int, sequence_length: int,
+                             validation_fraction: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Splits the window offsets of a flattened dataset into training & validation windows, holding out its last songs.
+    The split is made between songs, leaving a gap of sequence_length offsets, so every training window (inputs and
+    target) ends before the split and every validation window starts after it. No window sees the other side's songs.
+
+    :param songs: Each song's (start, end) index, from song_offset_index.
+    :param corpus_length: The number of symbols in the flattened dataset.
+    :param sequence_length: The sequence length which the LSTM will use to predict its next note.
+    :param validation_fraction: Roughly the fraction of the dataset to hold out, rounded to the next song start.
+
+    :return: tuple, (training_offsets, validation_offsets), the start offset of every window on each side.
+    """
+    offsets = np.arange(corpus_length - sequence_length)
+    fraction_point = int(corpus_length * (1 - validation_fraction))
+
+    # Split at the end of the last training song, validation windows begin in the delimiters before the next song.
+    # A dataset of a single song can't be split between songs, so it's split at the fraction point.
+    first_validation_song = min(int(np.searchsorted(songs[:, 0], fraction_point)), len(songs) - 1)
+    split = songs[first_validation_song - 1, 1] if first_validation_song > 0 else fraction_point
+
+    # A training window's target may be the delimiter which ends the last training song.
+    return offsets[offsets + sequence_length <= split], offsets[offsets >= split]
+
+
+def sample_training_windows(int_songs: np.ndarray, sequence_length: int, delimiter_id: int,
+                            max_padding_fraction: float = 0.75, max_windows_per_song: int = None,
+                            song_weights: np.ndarray = None, seed: int = None, verbose: bool = False) -> np.ndarray:
+    """
+    Picks which training windows to use from the song offset index, instead of using a window at every offset.
+    A window's target must be inside a song, or the single delimiter marking the song's end, so windows which only
+    teach the model to predict "/" after "/" are never used. Windows with too many delimiters are also dropped.
+
+    NOTE: Generation seeds are prefixed with SEQUENCE_LENGTH "/" symbols, so short seeds are mostly padding.
+    A low max_padding_fraction stops the model from learning how to continue them.
+
+    :param int_songs: The integer representation of the flattened dataset.
+    :param sequence_length: The sequence length which the LSTM will use to predict its next note.
+    :param delimiter_id: The integer which the song delimiter "/" is mapped to.
+    :param max_padding_fraction: The largest fraction of a window's inputs which can be delimiters. Default is 0.75.
+    :param max_windows_per_song: Randomly subsample songs to at most this many windows, stops long songs from
+    dominating training. Default is None, no limit.
+    :param song_weights: Optional per-song weights, each song keeps round(weight * its window count) windows.
+    Weights above 1 oversample a song's windows.
+    :param seed: The random seed used for subsampling.
+    :param verbose: Enable additional print statements for debug purposes. Default is False.
+
+    :return: np.ndarray, The start offset of every selected window, the window's target is at offset + sequence_length.
+    """
+    int_songs = np.asarray(int_songs)
+    songs = song_offset_index(int_songs, delimiter_id)
+    offsets = np.arange(len(int_songs) - sequence_length)
+    targets = offsets + sequence_length
+
+    # Count each window's delimiters with a cumulative sum, rather than re-counting every window.
+    delimiter_count = np.concatenate([[0], np.cumsum(int_songs == delimiter_id)])
+    padding = delimiter_count[targets] - delimiter_count[offsets]
+
+    # The song each target belongs to, targets in a delimiter run belong to the song before it.
+    song_numbers = np.searchsorted(songs[:, 0], targets, side="right") - 1
+    in_song = (song_numbers >= 0) & (targets <= songs[np.maximum(song_numbers, 0), 1])
+
+    keep = in_song & (padding <= int(max_padding_fraction * sequence_length))
+    offsets, song_numbers = offsets[keep], song_numbers[keep]
+
+    if max_windows_per_song is not None or song_weights is not None:
+        rng = np.random.default_rng(seed)
+        boundaries = np.searchsorted(song_numbers, np.arange(len(songs) + 1))
+        sampled = []
+        for song_number in range(len(songs)):
+            song_offsets = offsets[boundaries[song_number]:boundaries[song_number + 1]]
+            amount = len(song_offsets)
+            if song_weights is not None:
+                amount = int(round(song_weights[song_number] * amount))
+            if max_windows_per_song is not None:
+                amount = min(amount, max_windows_per_song)
+            if amount > 0 and len(song_offsets) > 0:
+                sampled.append(rng.choice(song_offsets, size=amount, replace=amount > len(song_offsets)))
+        offsets = np.sort(np.concatenate(sampled)) if sampled else np.array([], dtype=offsets.dtype)
+
+    if verbose:
+        all_windows = len(int_songs) - sequence_length
+        print(f"Sampled {len(offsets)} of {all_windows} training windows from {len(songs)} songs "
+              f"({1 - len(offsets) / all_windows:.1%} fewer).")
+
+    return offsets
+
+
+def training_steps_saved(all_windows: int, sampled_windows: int, batch_size: int) -> Dict[str, int]:
+    """
+    Reports how many training steps per epoch a sampler saves compared to using a window at every offset.
+
+    :param all_windows: The number of windows when using every offset, (dataset symbol length - sequence length).
+    :param sampled_windows: The number of windows selected by sample_training_windows.
+    :param batch_size: The training batch size.
+
+    :return: A dictionary of the steps per epoch with every window, with the sampled windows, and the difference.
+    """
+    all_steps = int(np.ceil(all_windows / batch_size))
+    sampled_steps = int(np.ceil(sampled_windows / batch_size))
+    return {"all_windows_steps": all_steps, "sampled_steps": sampled_steps, "steps_saved": all_steps - sampled_steps}
+
+
 def generate_training_sequences(sequence_length: int, songs_dataset_string: str = None,
-                                mappings_dictionary: Dict = None, verbose: bool = False):
-    # cba to add return type properly.
+                                mappings_dictionary: Dict = None, max_padding_fraction: float = None,
+                                max_windows_per_song: int = None, song_weights: np.ndarray = None,
+                                verbose: bool = False) -> Tuple[np.ndarray, np.ndarray, int]:
     """
     Creates (dataset symbol length - sequence length) number of training sequences.
     Inputs (fixed length sequences) and target outputs (item just after this sequence) for the LSTM from an integer
@@ -353,12 +905,18 @@ def generate_training_sequences(sequence_length: int, songs_dataset_string: str
     :param sequence_length: The sequence length which the LSTM will use to predict its next note.
     :param songs_dataset_string: The string object of the flattened dataset.
     :param mappings_dictionary: An optional parameter to allow for a dictionary mapping to be directly provided.
+    :param max_padding_fraction: Use sample_training_windows, dropping windows with more than this fraction of
+    delimiters and windows which only predict delimiters. Default is None, a window at every offset.
+    :param max_windows_per_song: Passed to sample_training_windows. Default is None, no limit.
+    :param song_weights: Per-song window weights, in the dataset's song order, passed to sample_training_windows.
+    Default is None, every song keeps all of its windows.
     :param verbose: Enable additional print statements for debug purposes. Default is False.
 
     :return: tuple, (inputs, targets, vocabulary_size),
              inputs: 3D list of one-hot encoded training sequences,
              targets: the next notes which are expected from each training sequence as a numpy array,
-             vocabulary_size: the size of the vocabulary used (used in LSTM).
+             vocabulary_size: the size of the vocabulary used (used in LSTM), every mapped symbol, even those
+             which don't appear in this dataset.
     """
 
     if songs_dataset_string is None:
@@ -367,21 +925,29 @@ def generate_training_sequences(sequence_length: int, songs_dataset_string: str
             print("Loading String Dataset from File.")
 
         songs_dataset_string = load(SINGLE_FILE_DATASET_PATH)
+    if mappings_dictionary is None:
+        mappings_dictionary = load_mappings(NOTE_MAPPINGS_PATH)
+
     # Map songs to their integer representation.
-    int_songs = convert_songs_to_int(flattened_songs_string=songs_dataset_string,
-                                     mappings_dictionary=mappings_dictionary)
+    int_songs = np.array(convert_songs_to_int(flattened_songs_string=songs_dataset_string,
+                                              mappings_dictionary=mappings_dictionary))
 
     # Generate the training sequences
     if verbose: print("Creating training sequences...")
 
-    inputs = []
-    targets = []
-
-    sequences_amount = len(int_songs) - sequence_length
-
-    for i in range(sequences_amount):
-        inputs.append(int_songs[i:i + sequence_length])
-        targets.append(int_songs[i + sequence_length])
+    if max_padding_fraction is None and max_windows_per_song is None and song_weights is None:
+        offsets = np.arange(len(int_songs) - sequence_length)
+    else:
+        offsets = sample_training_windows(int_songs, sequence_length, delimiter_id=mappings_dictionary["/"],
+                                          max_padding_fraction=1 if max_padding_fraction is None
+                                          else max_padding_fraction,
+                                          max_windows_per_song=max_windows_per_song, song_weights=song_weights,
+                                          verbose=verbose)
+
+    # Slice every window at once, shape: num of sequences * sequence_length.
+    inputs = int_songs[offsets[:, np.newaxis] + np.arange(sequence_length)]
+    targets = int_songs[offsets + sequence_length]
+    sequences_amount = len(offsets)
     if verbose: print(f"Successfully created {sequences_amount} training sequences.")
 
     # One-hot encode sequences
@@ -393,16 +959,48 @@ def generate_training_sequences(sequence_length: int, songs_dataset_string: str
     # The number of units within the LSTM's input layer will be equal to the vocabulary size of the dataset.
     # This is an easy way to deal with discrete Categorical data in Neural Networks.
 
-    vocabulary_size = len(set(int_songs))
+    vocabulary_size = len(mappings_dictionary)
     inputs = keras.utils.to_categorical(inputs,
                                         num_classes=vocabulary_size)  # One-hot encodes Training sequences into a 3D
     # Array representing each note's Class.
 
-    targets = np.array(targets)  # Casting targets list to numpy array for later use.
-
     return inputs, targets, vocabulary_size
 
 
+def load_training_corpus(flattened_dataset: str = None, encoding: str = "time_series",
+                         verbose: bool = False) -> Tuple[str, Dict[str, int]]:
+    """
+    Loads the flattened dataset & mappings to train with, in the given encoding.
+    The event encoding's mappings are created from the dataset the first time, and saved to EVENT_MAPPINGS_PATH.
+    They're rebuilt whenever the saved mappings don't cover every symbol of the dataset being loaded.
+
+    :param flattened_dataset: The flattened time series dataset. Default is None, loaded from SINGLE_FILE_DATASET_PATH.
+    :param encoding: "time_series", a symbol per 16th note, or "events", a symbol per note. See ENCODINGS.
+    :param verbose: Enable additional print statements for debug purposes. Default is False.
+
+    :return: tuple, (flattened_dataset, mappings), the dataset in the given encoding and its mappings.
+    """
+    if encoding not in ENCODINGS:
+        raise ValueError(f"Invalid encoding: {encoding}, expected one of {ENCODINGS}.")
+    if flattened_dataset is None:
+        flattened_dataset = load(SINGLE_FILE_DATASET_PATH)
+    if encoding == "time_series":
+        return flattened_dataset, load_mappings(NOTE_MAPPINGS_PATH)
+
+    # Delimiters are converted one to one, so songs stay separated by a full window of delimiters.
+    flattened_events = " ".join(time_series_to_events(flattened_dataset.split()))
+    if verbose:
+        print(f"Event encoding uses {len(flattened_events.split())} symbols instead of "
+              f"{len(flattened_dataset.split())}.")
+    if file_exists(EVENT_MAPPINGS_PATH):
+        mappings = load_mappings(EVENT_MAPPINGS_PATH)
+        if mappings.keys() >= set(flattened_events.split()):
+            return flattened_events, mappings
+        if verbose:
+            print(f"Saved event mappings don't cover this dataset, rebuilding {EVENT_MAPPINGS_PATH}.")
+    return flattened_events, create_song_mappings(flattened_events, EVENT_MAPPINGS_PATH, verbose=verbose)
+
+
 def main():
     # Preprocess and save the dataset
     preprocess(dataset_path=KERN_DATASET_PATH,
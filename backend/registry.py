@@ -0,0 +1,349 @@
+"""
+A registry of versioned model bundles, allowing the API to switch models without restarting.
+
+Each bundle is a directory holding a trained model, the symbol mappings it was trained with and a bundle.json
+manifest of their checksums, so a partially copied or mismatched bundle is never served. New versions are loaded and
+warmed up in the background, then swapped in with a single assignment. Jobs hold on to the LoadedModel they started
+with, so a job which is running during a swap finishes on its original version.
+
+Usage:
+    python registry.py register "model-resources/Model Saves/model.h5" "dataset-resources/Song Mappings/mappings.json"
+    python registry.py activate <version>
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from typing import Dict, List, Optional, NamedTuple
+from checkpoints import atomic_write_json
+from generator import Generator
+from preprocess import NOTE_MAPPINGS_PATH, SEQUENCE_LENGTH
+from training import MODEL_FILEPATH
+
+REGISTRY_DIR = "model-resources/Model Registry"
+BUNDLE_MANIFEST_FILENAME = "bundle.json"
+ACTIVE_VERSION_FILENAME = "active.json"
+UNVERSIONED = "unversioned"  # The version name of a model loaded from MODEL_FILEPATH, outside the registry.
+WATCH_INTERVAL_SECONDS = 30
+WARMUP_SEED = "60 _ 62 _ 64 _ 65 _"
+
+
+class BundleError(Exception):
+    """Raised when a model bundle is missing, incomplete or fails its checksum."""
+    pass
+
+
+class LoadedModel(NamedTuple):
+    """A warmed up generator, and the version of the bundle it was loaded from."""
+    version: str
+    generator: Generator
+
+    def cache_key(self, *parts) -> str:
+        """
+        Creates a result cache key which includes the model version, so results are never shared between versions.
+        :param parts: The request parameters which determine the result, e.g. the seed, temperature and length.
+        :return: The cache key.
+        """
+        return hashlib.sha256(json.dumps([self.version, *parts]).encode()).hexdigest()
+
+
+def file_checksum(file_path: str) -> str:
+    """
+    Calculates the SHA-256 checksum of a file, reading it in blocks.
+    :param file_path: The file to checksum.
+    :return: The hexadecimal checksum.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as fp:
+        for block in iter(lambda: fp.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _check_version_name(version: str) -> None:
+    # Versions are used as directory names, and can come from the admin endpoint.
+    if not version or os.path.basename(version) != version or version in (".", ".."):
+        raise BundleError(f"Invalid model version name: {version!r}")
+
+
+def register_bundle(model_path: str, mappings_path: str, version: str = None, registry_dir: str = REGISTRY_DIR,
+                    verbose: bool = False) -> str:
+    """
+    Copies a model and its mappings into a new versioned bundle in the registry.
+    The manifest is written last, so a bundle is only considered complete once every file has been copied.
+    :param model_path: The path of the trained model.
+    :param mappings_path: The path of the mappings the model was trained with.
+    :param version: The version name, defaults to a timestamp.
+    :param registry_dir: The registry directory.
+    :param verbose: Enable additional print statements for debug purposes. Default is False.
+    :return: The version name of the new bundle.
+    """
+    if version is None:
+        version = time.strftime("v%Y%m%d-%H%M%S")
+    _check_version_name(version)
+    bundle_dir = os.path.join(registry_dir, version)
+    if os.path.exists(os.path.join(bundle_dir, BUNDLE_MANIFEST_FILENAME)):
+        raise BundleError(f"Model version {version} is already registered.")
+    os.makedirs(bundle_dir, exist_ok=True)
+
+    files = {}
+    for source_path in (model_path, mappings_path):
+        filename = os.path.basename(source_path)
+        shutil.copyfile(source_path, os.path.join(bundle_dir, filename))
+        files[filename] = file_checksum(os.path.join(bundle_dir, filename))
+
+    manifest = {"version": version,
+                "created": time.time(),
+                "model": os.path.basename(model_path),
+                "mappings": os.path.basename(mappings_path),
+                "checksums": files}
+    atomic_write_json(manifest, os.path.join(bundle_dir, BUNDLE_MANIFEST_FILENAME))
+
+    if verbose:
+        print(f"Registered model version {version}.")
+    return version
+
+
+def read_bundle(version: str, registry_dir: str = REGISTRY_DIR, verify: bool = True) -> Dict:
+    """
+    Reads a bundle's manifest, checking every file against its checksum.
+    :param version: The version to read.
+    :param registry_dir: The registry directory.
+    :param verify: Whether to verify the checksums, which reads every file in the bundle.
+    :return: The bundle's manifest, with the absolute model_path and mappings_path added.
+    :raises: BundleError
+    """
+    _check_version_name(version)
+    bundle_dir = os.path.join(registry_dir, version)
+    manifest_path = os.path.join(bundle_dir, BUNDLE_MANIFEST_FILENAME)
+    if not os.path.exists(manifest_path):
+        raise BundleError(f"Model version {version} is not registered, or is incomplete.")
+    with open(manifest_path, "r") as fp:
+        manifest = json.load(fp)
+
+    if verify:
+        for filename, checksum in manifest["checksums"].items():
+            file_path = os.path.join(bundle_dir, filename)
+            if not os.path.exists(file_path):
+                raise BundleError(f"Model version {version} is missing {filename}.")
+            if file_checksum(file_path) != checksum:
+                raise BundleError(f"Model version {version} failed its checksum for {filename}.")
+
+    manifest["model_path"] = os.path.join(bundle_dir, manifest["model"])
+    manifest["mappings_path"] = os.path.join(bundle_dir, manifest["mappings"])
+    return manifest
+
+
+def list_versions(registry_dir: str = REGISTRY_DIR) -> List[str]:
+    """
+    Lists every complete bundle in the registry, oldest first.
+    :param registry_dir: The registry directory.
+    :return: The version names.
+    """
+    if not os.path.isdir(registry_dir):
+        return []
+    manifests = []
+    for version in os.listdir(registry_dir):
+        try:
+            manifests.append(read_bundle(version, registry_dir, verify=False))
+        except BundleError:
+            continue
+    return [manifest["version"] for manifest in sorted(manifests, key=lambda manifest: manifest["created"])]
+
+
+def read_active_version(registry_dir: str = REGISTRY_DIR) -> Optional[str]:
+    """
+    :param registry_dir: The registry directory.
+    :return: The version which should be served, or None if one hasn't been activated.
+    """
+    active_path = os.path.join(registry_dir, ACTIVE_VERSION_FILENAME)
+    if not os.path.exists(active_path):
+        return None
+    with open(active_path, "r") as fp:
+        return json.load(fp)["version"]
+
+
+def set_active_version(version: str, registry_dir: str = REGISTRY_DIR) -> None:
+    """
+    Marks a version as the one to serve. Running servers watching the registry will switch to it.
+    :param version: The version to activate, which must be registered.
+    :param registry_dir: The registry directory.
+    """
+    read_bundle(version, registry_dir, verify=False)
+    atomic_write_json({"version": version}, os.path.join(registry_dir, ACTIVE_VERSION_FILENAME))
+
+
+class ModelRegistry:
+    """
+    Holds the model currently being served, and loads new versions in the background.
+    """
+
+    def __init__(self, registry_dir: str = REGISTRY_DIR, verbose: bool = False) -> None:
+        """
+        :param registry_dir: The registry directory.
+        :param verbose: Enable additional print statements for debug purposes. Default is False.
+        """
+        self.registry_dir = registry_dir
+        self.verbose = verbose
+        self._current: Optional[LoadedModel] = None
+        self._load_lock = threading.Lock()  # Only one version is loaded at a time.
+        self.loading_version: Optional[str] = None
+        self.last_error: Optional[str] = None
+
+    def current(self) -> LoadedModel:
+        """
+        :return: The model currently being served. Jobs should call this once, and use the result throughout.
+        """
+        if self._current is None:
+            raise BundleError("No model has been loaded.")
+        return self._current
+
+    def load_initial(self) -> LoadedModel:
+        """
+        Loads the active version, or the latest registered version if none is active.
+        Falls back to the unversioned MODEL_FILEPATH model if the registry is empty.
+        :return: The loaded model.
+        """
+        version = read_active_version(self.registry_dir)
+        if version is None:
+            versions = list_versions(self.registry_dir)
+            version = versions[-1] if versions else None
+        if version is None:
+            if self.verbose:
+                print(f"Model registry is empty, serving {MODEL_FILEPATH}.")
+            self._current = self._warm_up(UNVERSIONED, Generator(MODEL_FILEPATH))
+            return self._current
+        return self.load(version)
+
+    def _warm_up(self, version: str, generator: Generator) -> LoadedModel:
+        # The first prediction builds the model's graph, which would otherwise slow down the first job.
+        list(generator.stream_melody(seed=WARMUP_SEED, number_of_steps=2, max_sequence_length=SEQUENCE_LENGTH,
+                                     temperature=0))
+        return LoadedModel(version=version, generator=generator)
+
+    def load(self, version: str) -> LoadedModel:
+        """
+        Verifies, loads and warms up a version, then switches to it.
+        If anything fails, the previous model carries on being served.
+        :param version: The version to load.
+        :return: The loaded model.
+        :raises: BundleError
+        """
+        with self._load_lock:
+            # Bundles are immutable, so a version which is already being served never needs reloading.
+            if self._current is not None and self._current.version == version:
+                return self._current
+            self.loading_version = version
+            try:
+                bundle = read_bundle(version, self.registry_dir)
+                loaded = self._warm_up(version, Generator(bundle["model_path"], mappings_path=bundle["mappings_path"]))
+            except Exception as e:
+                self.last_error = f"Failed to load model version {version}: {e}"
+                raise
+            finally:
+                self.loading_version = None
+
+            previous_version = self._current.version if self._current is not None else None
+            self._current = loaded  # A single assignment, so jobs see either the old or the new model.
+            self.last_error = None
+
+        if self.verbose:
+            print(f"Switched model from version {previous_version} to {version}.")
+        return loaded
+
+    def serve_generator(self, version: str, generator: Generator) -> LoadedModel:
+        """
+        Warms up and switches to a generator which was loaded outside the registry, e.g. for benchmarks.
+        :param version: The version name to record in job metadata.
+        :param generator: The generator to serve.
+        :return: The loaded model.
+        """
+        with self._load_lock:
+            self._current = self._warm_up(version, generator)
+        return self._current
+
+    def load_in_background(self, version: str) -> threading.Thread:
+        """
+        Loads a version in a separate thread, so the API carries on serving the current model meanwhile.
+        Errors are recorded in last_error.
+        :param version: The version to load.
+        :return: The loading thread.
+        """
+        def load_quietly():
+            try:
+                self.load(version)
+            except Exception as e:
+                print(e)
+
+        thread = threading.Thread(target=load_quietly, daemon=True)
+        thread.start()
+        return thread
+
+    def watch(self, interval: float = WATCH_INTERVAL_SECONDS) -> threading.Thread:
+        """
+        Polls the registry's active version, loading it in the background whenever it changes.
+        :param interval: The number of seconds between polls.
+        :return: The watching thread.
+        """
+        def poll():
+            failed_version = None
+            while True:
+                time.sleep(interval)
+                try:
+                    version = read_active_version(self.registry_dir)
+                except (OSError, ValueError, KeyError):
+                    continue
+                # Don't retry a broken bundle every poll, wait for a different version to be activated.
+                if version is None or version == failed_version or self._load_lock.locked():
+                    continue
+                if self._current is None or version != self._current.version:
+                    try:
+                        self.load(version)
+                    except Exception as e:
+                        failed_version = version
+                        print(e)
+
+        thread = threading.Thread(target=poll, daemon=True)
+        thread.start()
+        return thread
+
+    def status(self) -> Dict:
+        """
+        :return: The current version, any version being loaded, the last load error and all registered versions.
+        """
+        return {"current_version": self._current.version if self._current is not None else None,
+                "loading_version": self.loading_version,
+                "last_error": self.last_error,
+                "versions": list_versions(self.registry_dir)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the versioned model registry.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    register_parser = subparsers.add_parser("register", help="Add a model & mappings bundle to the registry.")
+    register_parser.add_argument("model_path", nargs="?", default=MODEL_FILEPATH)
+    register_parser.add_argument("mappings_path", nargs="?", default=NOTE_MAPPINGS_PATH)
+    register_parser.add_argument("--version", default=None)
+    register_parser.add_argument("--activate", action="store_true", help="Serve the new version straight away.")
+    activate_parser = subparsers.add_parser("activate", help="Switch running servers to a registered version.")
+    activate_parser.add_argument("version")
+    subparsers.add_parser("list", help="List the registered versions.")
+    args = parser.parse_args()
+
+    if args.command == "register":
+        version = register_bundle(args.model_path, args.mappings_path, version=args.version, verbose=True)
+        if args.activate:
+            set_active_version(version)
+    elif args.command == "activate":
+        set_active_version(args.version)
+    else:
+        active_version = read_active_version()
+        for version in list_versions():
+            print(f"{version}{' (active)' if version == active_version else ''}")
+
+
+if __name__ == '__main__':
+    main()
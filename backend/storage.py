@@ -0,0 +1,319 @@
+"""
+Lifecycle management for the API's job artifacts: uploaded seeds, generated melodies and failed generation ids.
+
+Artifacts are spread across hashed shard subdirectories, so no single directory grows large enough to slow down file
+operations. A background thread evicts artifacts older than a time to live, then the oldest artifacts until each
+store is under its size cap. Recently generated melodies are also kept in memory, so the client's download straight
+after generation completes doesn't touch the disk. Deterministic (temperature 0) results are also indexed by their
+request's cache key, so an identical request reuses the stored melody rather than generating it again.
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+from metrics import record_cache_lookup, STORAGE_BYTES, STORAGE_EVICTIONS
+
+GENERATED_MELODIES_DIR = "generated-melodies"
+UPLOADED_FILES_DIR = "uploaded-files"
+FAILED_GENERATIONS_PATH = "failed_generations.txt"
+
+ARTIFACT_TTL_SECONDS = 24 * 60 * 60
+GENERATED_MAX_BYTES = 512 * 1024 * 1024
+UPLOADED_MAX_BYTES = 128 * 1024 * 1024
+RECENT_RESULTS_MAX_BYTES = 16 * 1024 * 1024  # Generated MIDI files are a few KB, so this holds thousands.
+MAX_FAILED_GENERATIONS = 1000
+MAX_CACHED_RESULTS = 1000  # Number of request cache keys remembered, each only maps to a melody's id.
+CLEANUP_INTERVAL_SECONDS = 60
+SHARD_HEX_DIGITS = 2  # 256 shard subdirectories per store.
+
+
+def generated_melody_name(song_id: str) -> str:
+    return f"extended_melody_{song_id}.mid"
+
+
+def uploaded_melody_name(song_id: str) -> str:
+    return f"unextended_melody_{song_id}.mid"
+
+
+class ArtifactStore:
+    """
+    A directory of artifacts, sharded into subdirectories, with time to live and size based eviction.
+    """
+
+    def __init__(self, name: str, root_dir: str, ttl_seconds: float, max_bytes: int) -> None:
+        """
+        :param name: The store's name, used in metrics.
+        :param root_dir: The directory to store artifacts in.
+        :param ttl_seconds: How long an artifact is kept after it was last written.
+        :param max_bytes: The maximum total size of the store's artifacts.
+        """
+        self.name = name
+        self.root_dir = root_dir
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+
+    def path_for(self, filename: str, create: bool = False) -> str:
+        """
+        :param filename: The artifact's filename.
+        :param create: Create the artifact's shard directory, before writing to the returned path.
+        :return: The path of the artifact within its shard.
+        """
+        shard = hashlib.md5(filename.encode()).hexdigest()[:SHARD_HEX_DIGITS]
+        shard_dir = os.path.join(self.root_dir, shard)
+        if create:
+            os.makedirs(shard_dir, exist_ok=True)
+        return os.path.join(shard_dir, filename)
+
+    def write(self, filename: str, data: bytes) -> str:
+        """
+        Writes an artifact under a temporary name then renames it into place, so readers never see a partial file.
+        :param filename: The artifact's filename.
+        :param data: The artifact's contents.
+        :return: The artifact's path.
+        """
+        path = self.path_for(filename, create=True)
+        temporary_path = f"{path}.tmp"
+        with open(temporary_path, "wb") as fp:
+            fp.write(data)
+        os.replace(temporary_path, path)
+        return path
+
+    def exists(self, filename: str) -> bool:
+        return os.path.exists(self.path_for(filename))
+
+    def _list_artifacts(self) -> List[Tuple[float, int, str]]:
+        """
+        :return: (modified time, size, path) of every artifact, only looking inside shard directories.
+        """
+        artifacts = []
+        if not os.path.isdir(self.root_dir):
+            return artifacts
+        for shard in os.listdir(self.root_dir):
+            shard_dir = os.path.join(self.root_dir, shard)
+            # Only shard directories are managed, so other files & directories in the root are left alone.
+            if len(shard) != SHARD_HEX_DIGITS or not os.path.isdir(shard_dir):
+                continue
+            with os.scandir(shard_dir) as entries:
+                for entry in entries:
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue  # Removed while listing.
+                    artifacts.append((stat.st_mtime, stat.st_size, entry.path))
+        return artifacts
+
+    def cleanup(self, now: float = None) -> Dict[str, int]:
+        """
+        Removes artifacts older than the time to live, then the oldest artifacts until the store fits its size cap.
+        :param now: The current time. Default is None, time.time().
+        :return: The number of artifacts removed for each reason, and the bytes remaining.
+        """
+        now = time.time() if now is None else now
+        artifacts = sorted(self._list_artifacts())
+        removed = {"expired": 0, "size": 0}
+
+        total_bytes = sum(size for _, size, _ in artifacts)
+        for modified_time, size, path in artifacts:
+            if now - modified_time > self.ttl_seconds:
+                reason = "expired"
+            elif total_bytes > self.max_bytes:
+                reason = "size"
+            else:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_bytes -= size
+            removed[reason] += 1
+
+        for reason, count in removed.items():
+            if count:
+                STORAGE_EVICTIONS.inc(count, store=self.name, reason=reason)
+        STORAGE_BYTES.set(total_bytes, store=self.name)
+        return {**removed, "bytes": total_bytes}
+
+
+class StorageManager:
+    """
+    Manages the API's uploaded and generated melodies, failed generation ids and in-memory recent results.
+    """
+
+    def __init__(self, generated_dir: str = GENERATED_MELODIES_DIR, uploaded_dir: str = UPLOADED_FILES_DIR,
+                 failed_generations_path: str = FAILED_GENERATIONS_PATH, ttl_seconds: float = ARTIFACT_TTL_SECONDS,
+                 generated_max_bytes: int = GENERATED_MAX_BYTES, uploaded_max_bytes: int = UPLOADED_MAX_BYTES,
+                 recent_results_max_bytes: int = RECENT_RESULTS_MAX_BYTES,
+                 max_failed_generations: int = MAX_FAILED_GENERATIONS,
+                 max_cached_results: int = MAX_CACHED_RESULTS) -> None:
+        self.generated = ArtifactStore("generated", generated_dir, ttl_seconds, generated_max_bytes)
+        self.uploaded = ArtifactStore("uploaded", uploaded_dir, ttl_seconds, uploaded_max_bytes)
+        self.failed_generations_path = failed_generations_path
+        self.recent_results_max_bytes = recent_results_max_bytes
+        self.max_failed_generations = max_failed_generations
+        self.max_cached_results = max_cached_results
+        self._lock = threading.Lock()
+        self._recent_results: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()  # id -> (saved time, MIDI)
+        self._recent_results_bytes = 0
+        self._cached_results: "OrderedDict[str, str]" = OrderedDict()  # cache key -> id
+        self._failed_generations: "OrderedDict[str, float]" = self._load_failed_generations()
+
+    # --- Generated melodies ---
+
+    def save_result(self, song_id: str, midi_data: bytes) -> str:
+        """
+        Saves a generated melody to disk, and keeps it in memory for its download.
+        :param song_id: The ID of the melody.
+        :param midi_data: The MIDI file's contents.
+        :return: The path of the saved melody.
+        """
+        path = self.generated.write(generated_melody_name(song_id), midi_data)
+        with self._lock:
+            previous_result = self._recent_results.pop(song_id, None)
+            if previous_result is not None:
+                self._recent_results_bytes -= len(previous_result[1])
+            self._recent_results[song_id] = (time.time(), midi_data)
+            self._recent_results_bytes += len(midi_data)
+            while self._recent_results_bytes > self.recent_results_max_bytes and self._recent_results:
+                _, (_, evicted) = self._recent_results.popitem(last=False)
+                self._recent_results_bytes -= len(evicted)
+        return path
+
+    def has_result(self, song_id: str) -> bool:
+        with self._lock:
+            if song_id in self._recent_results:
+                return True
+        return self.generated.exists(generated_melody_name(song_id))
+
+    def load_result(self, song_id: str) -> Optional[bytes]:
+        """
+        :param song_id: The ID of the melody.
+        :return: The generated MIDI file's contents, from memory if it was recently generated, or None if
+                 it doesn't exist or has been evicted.
+        """
+        with self._lock:
+            recent_result = self._recent_results.get(song_id)
+            midi_data = recent_result[1] if recent_result is not None else None
+        record_cache_lookup("recent_results", midi_data is not None)
+        if midi_data is not None:
+            return midi_data
+
+        try:
+            with open(self.generated.path_for(generated_melody_name(song_id)), "rb") as fp:
+                return fp.read()
+        except FileNotFoundError:
+            return None
+
+    # --- Result cache ---
+
+    def cache_result(self, cache_key: str, song_id: str) -> None:
+        """
+        Remembers which melody was generated for a request, so identical requests can reuse it.
+        :param cache_key: The request's cache key, see LoadedModel.cache_key.
+        :param song_id: The ID of the generated melody, which must already have been saved.
+        """
+        with self._lock:
+            self._cached_results[cache_key] = song_id
+            self._cached_results.move_to_end(cache_key)
+            while len(self._cached_results) > self.max_cached_results:
+                self._cached_results.popitem(last=False)
+
+    def find_cached_result(self, cache_key: str) -> Optional[bytes]:
+        """
+        :param cache_key: The request's cache key, see LoadedModel.cache_key.
+        :return: The MIDI file generated for an identical earlier request, or None if there wasn't one or
+                 it has been evicted.
+        """
+        with self._lock:
+            song_id = self._cached_results.get(cache_key)
+        midi_data = self.load_result(song_id) if song_id is not None else None
+        if song_id is not None and midi_data is None:
+            with self._lock:
+                self._cached_results.pop(cache_key, None)
+        record_cache_lookup("results", midi_data is not None)
+        return midi_data
+
+    # --- Failed generations ---
+
+    def _load_failed_generations(self) -> "OrderedDict[str, float]":
+        failed_generations = OrderedDict()
+        if os.path.exists(self.failed_generations_path):
+            with open(self.failed_generations_path, "r") as fp:
+                for line in fp.readlines()[-self.max_failed_generations:]:
+                    parts = line.split()
+                    if parts:
+                        # Older files only contain ids, treat those failures as having just happened.
+                        failed_generations[parts[0]] = float(parts[1]) if len(parts) > 1 else time.time()
+        return failed_generations
+
+    def add_failed_generation(self, song_id: str) -> None:
+        """
+        Records a failed generation, in memory and appended to the failed generations file.
+        :param song_id: The ID of the melody.
+        """
+        failed_time = time.time()
+        with self._lock:
+            self._failed_generations[song_id] = failed_time
+            while len(self._failed_generations) > self.max_failed_generations:
+                self._failed_generations.popitem(last=False)
+            with open(self.failed_generations_path, "a") as fp:
+                fp.write(f"{song_id} {failed_time}\n")
+
+    def check_failed_generation(self, song_id: str) -> bool:
+        with self._lock:
+            return song_id in self._failed_generations
+
+    def _compact_failed_generations(self, now: float) -> None:
+        # Drops expired failures, and rewrites the file so it only holds the failures still being tracked.
+        with self._lock:
+            for song_id, failed_time in list(self._failed_generations.items()):
+                if now - failed_time > self.generated.ttl_seconds:
+                    del self._failed_generations[song_id]
+            lines = [f"{song_id} {failed_time}\n" for song_id, failed_time in self._failed_generations.items()]
+            temporary_path = f"{self.failed_generations_path}.tmp"
+            with open(temporary_path, "w") as fp:
+                fp.writelines(lines)
+            os.replace(temporary_path, self.failed_generations_path)
+
+    # --- Cleanup ---
+
+    def cleanup(self, now: float = None) -> Dict[str, Dict[str, int]]:
+        """
+        Evicts expired & excess artifacts from every store, and compacts the failed generations file.
+        :param now: The current time. Default is None, time.time().
+        :return: The cleanup results of each store.
+        """
+        now = time.time() if now is None else now
+        results = {"generated": self.generated.cleanup(now), "uploaded": self.uploaded.cleanup(now)}
+        with self._lock:
+            # Results are saved in order, so the expired results are at the front.
+            while self._recent_results:
+                song_id, (saved_time, midi_data) = next(iter(self._recent_results.items()))
+                if now - saved_time <= self.generated.ttl_seconds:
+                    break
+                del self._recent_results[song_id]
+                self._recent_results_bytes -= len(midi_data)
+        self._compact_failed_generations(now)
+        return results
+
+    def start_cleanup(self, interval: float = CLEANUP_INTERVAL_SECONDS) -> threading.Thread:
+        """
+        Runs cleanup in a background thread every interval seconds.
+        :param interval: The number of seconds between cleanups.
+        :return: The cleanup thread.
+        """
+        def run():
+            while True:
+                try:
+                    self.cleanup()
+                except OSError as e:
+                    print(f"Storage cleanup failed: {e}")
+                time.sleep(interval)
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+
+artifact_storage = StorageManager()
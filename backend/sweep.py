@@ -0,0 +1,279 @@
+"""
+Hyperparameter sweeps over model depth/width, sequence length, learning rate and batch size.
+
+Trials run in parallel worker processes, all reading the same integer encoded corpus through a memory-mapped .npy
+file rather than each re-encoding the dataset. Each trial stops early once its validation loss stops improving, and
+is pruned if it is doing worse than the median of the other trials at the same epoch. Results, including the time
+taken to reach a target validation accuracy, are written to a CSV table.
+
+Usage:
+    python sweep.py --parallel 4 --max-trials 16 --epochs 10 --target-accuracy 0.7
+"""
+import argparse
+import csv
+import itertools
+import json
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+from typing import List, Dict, Any, Optional
+import numpy as np
+from checkpoints import atomic_write_json
+from preprocess import convert_songs_to_int, load, load_mappings, song_offset_index, validation_split_offsets, \
+    SINGLE_FILE_DATASET_PATH, NOTE_MAPPINGS_PATH
+
+SWEEP_DIR = "model-resources/Sweeps"
+CORPUS_FILENAME = "corpus.npy"
+SONGS_FILENAME = "songs.npy"  # Each song's (start, end) index in the corpus, used to split validation between songs.
+VALIDATION_FRACTION = 0.1
+
+SEARCH_SPACE = {
+    "num_units": [[128], [256], [128, 128], [256, 256]],
+    "sequence_length": [32, 64],
+    "learning_rate": [0.0003, 0.001, 0.003],
+    "batch_size": [64, 128],
+}
+
+
+def prepare_corpus(sweep_dir: str, flattened_dataset: str = None, mappings: Dict[str, int] = None) -> int:
+    """
+    Encodes the flattened dataset into integers once, saving it as a .npy file for every trial to memory-map,
+    along with the index of where each song starts and ends.
+
+    :param sweep_dir: The sweep's directory.
+    :param flattened_dataset: The flattened dataset. Default is None, loaded from SINGLE_FILE_DATASET_PATH.
+    :param mappings: The symbol mappings. Default is None, loaded from NOTE_MAPPINGS_PATH.
+
+    :return: The vocabulary size.
+    """
+    if flattened_dataset is None:
+        flattened_dataset = load(SINGLE_FILE_DATASET_PATH)
+    if mappings is None:
+        mappings = load_mappings(NOTE_MAPPINGS_PATH)
+
+    os.makedirs(sweep_dir, exist_ok=True)
+    int_songs = np.array(convert_songs_to_int(flattened_songs_string=flattened_dataset, mappings_dictionary=mappings),
+                         dtype=np.int32)
+    np.save(os.path.join(sweep_dir, CORPUS_FILENAME), int_songs)
+    np.save(os.path.join(sweep_dir, SONGS_FILENAME), song_offset_index(int_songs, mappings["/"]))
+    return len(mappings)
+
+
+def create_trials(search_space: Dict[str, List[Any]] = None, max_trials: int = None,
+                  seed: int = 0) -> List[Dict[str, Any]]:
+    """
+    Creates trial configurations from the grid of every search space combination.
+
+    :param search_space: The values to try for each hyperparameter. Default is SEARCH_SPACE.
+    :param max_trials: Randomly sample this many configurations from the grid. Default is None, the whole grid.
+    :param seed: The random seed used for sampling.
+
+    :return: The trial configurations, each with a unique trial_id.
+    """
+    search_space = search_space or SEARCH_SPACE
+    names = list(search_space)
+    grid = [dict(zip(names, values)) for values in itertools.product(*(search_space[name] for name in names))]
+    if max_trials is not None and max_trials < len(grid):
+        grid = random.Random(seed).sample(grid, max_trials)
+    for trial_number, trial in enumerate(grid):
+        trial["trial_id"] = f"trial-{trial_number:03d}"
+    return grid
+
+
+def _trial_path(sweep_dir: str, trial_id: str) -> str:
+    return os.path.join(sweep_dir, "trials", f"{trial_id}.json")
+
+
+def _load_trial_histories(sweep_dir: str, exclude: str) -> List[Dict[str, Any]]:
+    trials_dir = os.path.join(sweep_dir, "trials")
+    histories = []
+    for filename in os.listdir(trials_dir):
+        if filename.endswith(".json") and filename != f"{exclude}.json":
+            try:
+                with open(os.path.join(trials_dir, filename), "r") as fp:
+                    histories.append(json.load(fp))
+            except (OSError, json.JSONDecodeError):
+                continue  # Trial files are written atomically, but may be replaced while listing.
+    return histories
+
+
+def _make_trial_callback(sweep_dir: str, trial: Dict[str, Any], target_accuracy: float,
+                         min_epochs_before_pruning: int):
+    """
+    Creates the keras callback which records a trial's progress, time to accuracy, and prunes it if it's doing badly.
+    """
+    import keras
+
+    class TrialCallback(keras.callbacks.Callback):
+
+        def __init__(self):
+            super().__init__()
+            self.start = time.perf_counter()
+            self.record = {**trial, "status": "running", "history": [], "time_to_accuracy_s": None}
+
+        def on_epoch_end(self, epoch, logs=None):
+            logs = logs or {}
+            elapsed = time.perf_counter() - self.start
+            val_loss = float(logs.get("val_loss", np.nan))
+            val_accuracy = float(logs.get("val_accuracy", np.nan))
+            self.record["history"].append({"epoch": epoch + 1, "elapsed_s": elapsed,
+                                           "val_loss": val_loss, "val_accuracy": val_accuracy})
+            if self.record["time_to_accuracy_s"] is None and val_accuracy >= target_accuracy:
+                self.record["time_to_accuracy_s"] = elapsed
+
+            # Median pruning, stop if worse than the median of the other trials at the same epoch.
+            if epoch + 1 >= min_epochs_before_pruning:
+                other_trials = _load_trial_histories(sweep_dir, exclude=trial["trial_id"])
+                others = [other["history"][epoch]["val_loss"] for other in other_trials
+                          if len(other["history"]) > epoch]
+                if len(others) >= 2 and val_loss > float(np.median(others)):
+                    self.record["status"] = "pruned"
+                    self.model.stop_training = True
+
+            atomic_write_json(self.record, _trial_path(sweep_dir, trial["trial_id"]))
+
+    return TrialCallback()
+
+
+def run_trial(trial: Dict[str, Any], sweep_dir: str, vocabulary_size: int, epochs: int, target_accuracy: float,
+              threads_per_trial: int, patience: int = 2, min_epochs_before_pruning: int = 2) -> Dict[str, Any]:
+    """
+    Trains a single trial's configuration. Runs in a worker process.
+
+    :param trial: The trial's configuration, from create_trials.
+    :param sweep_dir: The sweep's directory, containing the prepared corpus.
+    :param vocabulary_size: The vocabulary size of the corpus.
+    :param epochs: The maximum number of epochs to train for.
+    :param target_accuracy: The validation accuracy used to measure time to accuracy.
+    :param threads_per_trial: The number of CPU threads each trial's TensorFlow may use.
+    :param patience: Early stopping patience, in epochs without validation loss improving.
+    :param min_epochs_before_pruning: The number of epochs a trial always gets before it can be pruned.
+
+    :return: The trial's final record.
+    """
+    import tensorflow as tf
+    import keras
+    from training import build_model, make_training_dataset, LOSS_FN
+
+    try:
+        tf.config.threading.set_intra_op_parallelism_threads(threads_per_trial)
+        tf.config.threading.set_inter_op_parallelism_threads(1)
+    except RuntimeError:
+        pass  # Threading can only be configured once per process, when the worker is reused it's already set.
+
+    # Every trial reads the same memory-mapped corpus file, rather than re-encoding the dataset.
+    int_songs = np.load(os.path.join(sweep_dir, CORPUS_FILENAME), mmap_mode="r")
+    sequence_length = trial["sequence_length"]
+
+    # Hold out the last songs for validation, split between songs so no window overlaps both sides.
+    train_offsets, validation_offsets = validation_split_offsets(np.load(os.path.join(sweep_dir, SONGS_FILENAME)),
+                                                                 len(int_songs), sequence_length, VALIDATION_FRACTION)
+    train_dataset = make_training_dataset(int_songs, sequence_length, vocabulary_size, trial["batch_size"],
+                                          window_offsets=train_offsets)
+    validation_dataset = make_training_dataset(int_songs, sequence_length, vocabulary_size, trial["batch_size"],
+                                               window_offsets=validation_offsets, shuffle=False)
+
+    model = build_model(output_units=vocabulary_size, loss_fn=LOSS_FN, num_units=trial["num_units"],
+                        learning_rate=trial["learning_rate"])
+    trial_callback = _make_trial_callback(sweep_dir, trial, target_accuracy, min_epochs_before_pruning)
+    early_stopping = keras.callbacks.EarlyStopping(monitor="val_loss", patience=patience)
+
+    model.fit(train_dataset, validation_data=validation_dataset, epochs=epochs, verbose=0,
+              callbacks=[trial_callback, early_stopping])
+
+    record = trial_callback.record
+    if record["status"] == "running":
+        record["status"] = "early_stopped" if len(record["history"]) < epochs else "complete"
+    atomic_write_json(record, _trial_path(sweep_dir, trial["trial_id"]))
+    return record
+
+
+def write_results_table(records: List[Dict[str, Any]], output_path: str) -> None:
+    """
+    Writes a CSV table of every trial's configuration and results, best validation accuracy first.
+    :param records: The trial records returned by run_trial.
+    :param output_path: The path of the CSV file.
+    """
+    rows = []
+    for record in records:
+        history = record["history"]
+        rows.append({"trial_id": record["trial_id"],
+                     "num_units": "-".join(map(str, record["num_units"])),
+                     "sequence_length": record["sequence_length"],
+                     "learning_rate": record["learning_rate"],
+                     "batch_size": record["batch_size"],
+                     "status": record["status"],
+                     "epochs": len(history),
+                     "best_val_loss": min((h["val_loss"] for h in history), default=None),
+                     "best_val_accuracy": max((h["val_accuracy"] for h in history), default=None),
+                     "time_to_accuracy_s": record["time_to_accuracy_s"],
+                     "total_time_s": history[-1]["elapsed_s"] if history else None})
+    rows.sort(key=lambda row: -(row["best_val_accuracy"] or 0))
+
+    with open(output_path, "w", newline="") as fp:
+        writer = csv.DictWriter(fp, fieldnames=list(rows[0]) if rows else ["trial_id"])
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def run_sweep(sweep_dir: str, trials: List[Dict[str, Any]], parallel: int, epochs: int, target_accuracy: float,
+              flattened_dataset: str = None, mappings: Dict[str, int] = None,
+              threads_per_trial: Optional[int] = None, verbose: bool = True) -> List[Dict[str, Any]]:
+    """
+    Runs every trial across a pool of worker processes and writes the results table.
+
+    :param sweep_dir: The directory to write the corpus, trial records and results table to.
+    :param trials: The trial configurations, from create_trials.
+    :param parallel: The number of trials to run at the same time.
+    :param epochs: The maximum number of epochs per trial.
+    :param target_accuracy: The validation accuracy used to measure time to accuracy.
+    :param flattened_dataset: The flattened dataset. Default is None, loaded from SINGLE_FILE_DATASET_PATH.
+    :param mappings: The symbol mappings. Default is None, loaded from NOTE_MAPPINGS_PATH.
+    :param threads_per_trial: CPU threads per trial. Default is None, the CPU count divided between the trials.
+    :param verbose: Enable additional print statements for debug purposes.
+
+    :return: Every trial's record.
+    """
+    vocabulary_size = prepare_corpus(sweep_dir, flattened_dataset, mappings)
+    os.makedirs(os.path.join(sweep_dir, "trials"), exist_ok=True)
+    threads_per_trial = threads_per_trial or max(1, (os.cpu_count() or 1) // parallel)
+
+    records = []
+    # TensorFlow isn't fork safe, so workers are started fresh.
+    with ProcessPoolExecutor(max_workers=parallel, mp_context=get_context("spawn")) as executor:
+        futures = {executor.submit(run_trial, trial, sweep_dir, vocabulary_size, epochs, target_accuracy,
+                                   threads_per_trial): trial for trial in trials}
+        for future in as_completed(futures):
+            record = future.result()
+            records.append(record)
+            if verbose:
+                best_accuracy = max((h["val_accuracy"] for h in record["history"]), default=float("nan"))
+                print(f"{record['trial_id']} {record['status']} after {len(record['history'])} epochs, "
+                      f"best validation accuracy {best_accuracy:.3f}. ({len(records)}/{len(trials)})")
+
+    results_path = os.path.join(sweep_dir, "results.csv")
+    write_results_table(records, results_path)
+    if verbose:
+        print(f"Sweep results saved to {results_path}")
+    return records
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a hyperparameter sweep over the encoded corpus.")
+    parser.add_argument("--sweep-dir", default=os.path.join(SWEEP_DIR, time.strftime("%Y%m%d-%H%M%S")))
+    parser.add_argument("--parallel", type=int, default=max(1, (os.cpu_count() or 1) // 2),
+                        help="The number of trials to run at the same time.")
+    parser.add_argument("--max-trials", type=int, help="Randomly sample this many trials from the grid.")
+    parser.add_argument("--epochs", type=int, default=16)
+    parser.add_argument("--target-accuracy", type=float, default=0.7)
+    args = parser.parse_args()
+
+    trials = create_trials(max_trials=args.max_trials)
+    run_sweep(args.sweep_dir, trials, parallel=args.parallel, epochs=args.epochs,
+              target_accuracy=args.target_accuracy)
+
+
+if __name__ == '__main__':
+    main()
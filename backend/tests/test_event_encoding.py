@@ -0,0 +1,23 @@
+import pytest
+from preprocess import time_series_to_events, events_to_time_series, MAX_EVENT_STEPS
+
+
+@pytest.mark.parametrize("song", [
+    "60 _ _ _ 62 _ r _ 64",
+    "/ / 60 _ _ _ / / 67 _ r / /",
+    "_ _ 60 _",  # Starts part way through a held note.
+    " ".join(["60"] + ["_"] * (2 * MAX_EVENT_STEPS + 3) + ["r"]),  # Held longer than the longest event.
+    "",
+])
+def test_events_round_trip(song):
+    symbols = song.split()
+    assert events_to_time_series(time_series_to_events(symbols)) == symbols
+
+
+def test_events_take_a_symbol_per_note():
+    assert time_series_to_events("60 _ _ _ r _ /".split()) == ["60:4", "r:2", "/"]
+
+
+def test_long_notes_are_split_into_prolongation_events():
+    events = time_series_to_events(["60"] + ["_"] * MAX_EVENT_STEPS)
+    assert events == [f"60:{MAX_EVENT_STEPS}", "_:1"]
@@ -0,0 +1,80 @@
+import math
+import pytest
+from api_tools import quantize_notes, InvalidNoteDurationError, InvalidNotePitchError
+
+
+def test_on_grid_melody_is_unchanged():
+    seed = quantize_notes(starts=[0, 1, 1.5], pitches=[60, 62, 64], durations=[1, 0.5, 1])
+    assert seed.symbols == ["60", "_", "_", "_", "62", "_", "64", "_", "_", "_"]
+    assert seed.length == 10
+    assert seed.changes == {"notes": 3, "moved_starts": 0, "changed_durations": 0, "dropped_notes": 0,
+                            "max_start_shift_hundredths": 0}
+
+
+def test_gaps_become_rests():
+    seed = quantize_notes(starts=[0, 2], pitches=[60, 62], durations=[1, 1])
+    assert seed.symbols == ["60", "_", "_", "_", "r", "_", "_", "_", "62", "_", "_", "_"]
+
+
+def test_off_grid_starts_and_ends_snap_to_nearest_step():
+    seed = quantize_notes(starts=[0.1, 1.05], pitches=[60, 62], durations=[0.9, 1])
+    assert seed.symbols == ["60", "_", "_", "_", "62", "_", "_", "_"]
+    assert seed.changes["moved_starts"] == 2
+    assert seed.changes["max_start_shift_hundredths"] == 40
+
+
+def test_notes_on_the_same_step_keep_the_first():
+    seed = quantize_notes(starts=[0, 0.05, 1], pitches=[60, 67, 64], durations=[1, 1, 1])
+    assert seed.symbols == ["60", "_", "_", "_", "64", "_", "_", "_"]
+    assert seed.changes["dropped_notes"] == 1
+
+
+def test_overlapping_notes_are_cut_at_the_next_onset():
+    seed = quantize_notes(starts=[0, 0.5], pitches=[60, 62], durations=[2, 1])
+    assert seed.symbols == ["60", "_", "62", "_", "_", "_"]
+    assert seed.changes["changed_durations"] == 1
+
+
+def test_notes_last_at_least_one_step():
+    seed = quantize_notes(starts=[0, 1], pitches=[60, 62], durations=[0.01, 0.25])
+    assert seed.symbols[0] == "60"
+    assert seed.durations.tolist() == [1, 1]
+
+
+def test_unsorted_notes_are_sorted_by_start():
+    seed = quantize_notes(starts=[1, 0], pitches=[62, 60], durations=[1, 1])
+    assert seed.symbols == ["60", "_", "_", "_", "62", "_", "_", "_"]
+
+
+def test_negative_starts_are_clamped_to_the_start():
+    seed = quantize_notes(starts=[-0.5, 1], pitches=[60, 62], durations=[1, 1])
+    assert seed.starts.tolist() == [0, 4]
+    assert seed.symbols == ["60", "_", "r", "_", "62", "_", "_", "_"]
+
+
+def test_api_units_are_eighth_notes():
+    seed = quantize_notes(starts=[0, 2], pitches=[60, 62], durations=[2, 1], steps_per_unit=2)
+    assert seed.symbols == ["60", "_", "_", "_", "62", "_"]
+
+
+def test_empty_melody_is_rejected():
+    with pytest.raises(InvalidNoteDurationError):
+        quantize_notes(starts=[], pitches=[], durations=[])
+
+
+@pytest.mark.parametrize("starts, durations", [([math.nan], [1]), ([0], [math.nan]), ([math.inf], [1]),
+                                               ([0], [-math.inf]), ([None], [1]), (["a"], [1])])
+def test_non_finite_timings_are_rejected(starts, durations):
+    with pytest.raises(InvalidNoteDurationError):
+        quantize_notes(starts=starts, pitches=[60], durations=durations)
+
+
+def test_negative_durations_are_rejected():
+    with pytest.raises(InvalidNoteDurationError):
+        quantize_notes(starts=[0, 1], pitches=[60, 62], durations=[1, -1])
+
+
+@pytest.mark.parametrize("pitch", [math.nan, None, "C4", -1, 128, 60.5])
+def test_invalid_pitches_are_rejected(pitch):
+    with pytest.raises(InvalidNotePitchError):
+        quantize_notes(starts=[0], pitches=[pitch], durations=[1])
@@ -2,15 +2,31 @@ from preprocess import (preprocess,
                         generate_training_sequences,
                         flatten_dataset_to_single_file,
                         create_song_mappings,
+                        convert_songs_to_int,
+                        training_steps_saved,
+                        load,
+                        load_mappings,
+                        load_training_corpus,
+                        save_vocabulary,
+                        vocabulary_path_for_model,
+                        ENCODINGS,
                         SEQUENCE_LENGTH,
                         SINGLE_FILE_DATASET_PATH,
                         ENCODED_DATASET_DIR,
                         NOTE_MAPPINGS_PATH
                         )
+from checkpoints import CheckpointManager, atomic_save_model, CHECKPOINT_DIR
 import keras
 import tensorflow as tf
+import numpy as np
+import argparse
+import json
 import os
-from typing import List
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List, Dict, Tuple
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'  # Disables Tensorflow's Debugging Information
 
 LOSS_FN = "sparse_categorical_crossentropy"
@@ -20,9 +36,42 @@ BATCH_SIZE = 64
 MODEL_FILEPATH = "model-resources/Model Saves/model.h5"
 ERK_DATASET_PATH = "dataset-resources/KERN/erk"
 KERN_DATASET_PATH = "dataset-resources/KERN"
+MIXED_PRECISION_POLICY = "mixed_bfloat16"
+RECURRENT_LAYERS = {"lstm": keras.layers.LSTM, "gru": keras.layers.GRU}
+DISTRIBUTED_BACKUP_DIR = "model-resources/Distributed Backup"
+FIRST_WORKER_PORT = 12345
+
+
+def cpu_supports_bfloat16() -> bool:
+    """
+    Checks if the CPU has native bfloat16 instructions (AVX512-BF16 or AMX-BF16).
+    Without them, bfloat16 is emulated and slower than float32.
+    :return: If bfloat16 mixed precision is worth using on this CPU.
+    """
+    try:
+        with open("/proc/cpuinfo", "r") as fp:
+            cpu_flags = fp.read()
+    except OSError:
+        return False
+    return "avx512_bf16" in cpu_flags or "amx_bf16" in cpu_flags
+
+
+def mixed_precision_policy(mixed_precision: bool, verbose: bool = False) -> str:
+    """
+    Picks the dtype policy for the model's layers.
+    :param mixed_precision: Whether mixed precision has been requested.
+    :param verbose: Enable additional print statements for debug purposes. Default is False.
+    :return: "mixed_bfloat16" if requested and supported by the CPU, otherwise "float32".
+    """
+    if mixed_precision and not cpu_supports_bfloat16():
+        if verbose:
+            print("This CPU doesn't support bfloat16, falling back to float32.")
+        return "float32"
+    return MIXED_PRECISION_POLICY if mixed_precision else "float32"
 
 
 def build_model(output_units: int, loss_fn: str, num_units: List[int], learning_rate: float,
+                jit_compile: bool = False, mixed_precision: bool = False, cell_type: str = "lstm",
                 verbose: bool = False) -> keras.Model:
     """
     Builds the LSTM.
@@ -31,15 +80,27 @@ def build_model(output_units: int, loss_fn: str, num_units: List[int], learning_
     Represents the number of keys in our training data.
     :param loss_fn: callable, The loss function being used for training.
     :param num_units: list of int, The number of hidden layers in the network,
-    in a list format where each element represents a hidden layer.
+    in a list format where each element represents a hidden layer, e.g. [256, 128] stacks two LSTM layers.
     :param learning_rate: float, The LSTM's learning rate.
+    :param jit_compile: bool, optional, Compile the training step with XLA. Default is False.
+    On CPU this has measured slower than TensorFlow's fused LSTM kernel, check benchmark.py before enabling it.
+    :param mixed_precision: bool, optional, Compute in bfloat16 where the CPU supports it, keeping weights and the
+    softmax output in float32. Default is False.
+    :param cell_type: str, optional, The recurrent layer type, "lstm" or "gru". GRUs have fewer weights per unit,
+    so are cheaper per generation step. Default is "lstm".
     :param verbose: bool, optional, Enable additional print statements for debug purposes. Default is False.
 
     :return: list of int, The converted songs as a list of integers.
     """
 
     if verbose:
-        print("Creating LSTM Model")
+        print(f"Creating {cell_type.upper()} Model")
+
+    if cell_type not in RECURRENT_LAYERS:
+        raise ValueError(f"Invalid cell type: {cell_type}, expected one of {list(RECURRENT_LAYERS)}.")
+    recurrent_layer = RECURRENT_LAYERS[cell_type]
+
+    policy = mixed_precision_policy(mixed_precision, verbose)
 
     # Create model's architecture.
     # Using None here allows us to use as many timestaps as needed. Allows Generation of Melodies of any length.
@@ -47,9 +108,14 @@ def build_model(output_units: int, loss_fn: str, num_units: List[int], learning_
 
 
     # Output units represents the vocabulary size that can be generated.
-    x = keras.layers.LSTM(num_units[0])(input_layer)  # Pass input into LSTM layer using Functional API
-    x = keras.layers.Dropout(.2)(x)  # Add dropout layer to model. (Avoids over-fitting)
-    output_layer = keras.layers.Dense(output_units, activation="softmax")(x)
+    # Stack a recurrent layer per entry of num_units, every layer but the last passes its whole sequence on.
+    x = input_layer
+    for layer_index, units in enumerate(num_units):
+        return_sequences = layer_index < len(num_units) - 1
+        x = recurrent_layer(units, return_sequences=return_sequences, dtype=policy)(x)  # Using Functional API
+    x = keras.layers.Dropout(.2, dtype=policy)(x)  # Add dropout layer to model. (Avoids over-fitting)
+    # The softmax is kept in float32, bfloat16 probabilities are too coarse for sampling & the loss.
+    output_layer = keras.layers.Dense(output_units, activation="softmax", dtype="float32")(x)
 
     # Create Model.
     model = keras.Model(input_layer, output_layer)
@@ -57,7 +123,8 @@ def build_model(output_units: int, loss_fn: str, num_units: List[int], learning_
     # Compile model.
     model.compile(loss=loss_fn,
                   optimizer=keras.optimizers.Adam(learning_rate=learning_rate),
-                  metrics=["accuracy"]
+                  metrics=["accuracy"],
+                  jit_compile=jit_compile
                   )
 
     if verbose:
@@ -66,12 +133,41 @@ def build_model(output_units: int, loss_fn: str, num_units: List[int], learning_
     return model
 
 
+def convert_to_mixed_precision(model: keras.Model, verbose: bool = False) -> keras.Model:
+    """
+    Creates a bfloat16 mixed precision copy of a trained float32 model, for faster inference.
+    The output layer stays in float32. Returns the model unchanged if the CPU doesn't support bfloat16.
+
+    :param model: The trained float32 model.
+    :param verbose: Enable additional print statements for debug purposes. Default is False.
+
+    :return: The mixed precision model, sharing the same weights.
+    """
+    policy = mixed_precision_policy(True, verbose)
+    if policy == "float32":
+        return model
+
+    config = model.get_config()
+    output_layer_names = {layer[0] for layer in config["output_layers"]}
+    for layer in config["layers"]:
+        if layer["class_name"] != "InputLayer" and layer["config"]["name"] not in output_layer_names:
+            layer["config"]["dtype"] = policy
+
+    mixed_precision_model = keras.Model.from_config(config)
+    mixed_precision_model.set_weights(model.get_weights())
+    return mixed_precision_model
+
+
 def train(loss_fn: str, num_units: List[int], learning_rate: float, epochs: int, batch_size: int,
-          model_path: str = MODEL_FILEPATH, flattened_dataset: str = None, verbose: bool = False) -> None:
+          model_path: str = MODEL_FILEPATH, flattened_dataset: str = None, checkpoint_dir: str = CHECKPOINT_DIR,
+          keep_checkpoints: int = 3, jit_compile: bool = False, mixed_precision: bool = False,
+          max_padding_fraction: float = None, max_windows_per_song: int = None, song_weights: np.ndarray = None,
+          encoding: str = "time_series", verbose: bool = False) -> None:
     """
     A high-level function which performs all the network's training steps.
-    Saves the model's weights and biases to a specified file path when all epochs are completed.
-    Saves checkpoints after each epoch.
+    Saves the model's weights and biases to a specified file path when all epochs are completed,
+    along with the vocabulary it was trained on (see vocabulary_path_for_model).
+    Saves checkpoints after each epoch, and resumes from the latest checkpoint's epoch if training was interrupted.
 
     :param loss_fn: The loss function being used for training.
     :param num_units: The number of hidden layers in the network, in a list format where each element
@@ -81,43 +177,281 @@ def train(loss_fn: str, num_units: List[int], learning_rate: float, epochs: int,
     :param batch_size: The amount of samples the network sees before running backpropagation.
     :param model_path: The path which the model shall be saved to.
     :param flattened_dataset: The flattened dataset which the model will train off of.
+    :param checkpoint_dir: The directory to save checkpoints into.
+    :param keep_checkpoints: The number of most recent checkpoints to keep, the best checkpoint is always kept too.
+    :param jit_compile: Compile the training step with XLA. Default is False.
+    :param mixed_precision: Train in bfloat16 mixed precision where the CPU supports it. Default is False.
+    :param max_padding_fraction: Sample song-aware training windows with at most this fraction of delimiter padding,
+    see sample_training_windows. Default is None, a window at every offset.
+    :param max_windows_per_song: Subsample each song to at most this many windows. Default is None, no limit.
+    :param song_weights: Per-song window weights in the dataset's song order, e.g. 2 doubles a song's windows and
+    0.5 halves them, see sample_training_windows. Default is None, every song is weighted equally.
+    :param encoding: The symbol encoding to train on, "time_series" or "events", see load_training_corpus.
+    The events encoding takes a step per note rather than per 16th, so a window covers several times as many bars.
     :param verbose: Enable additional print statements for debug purposes. Default is False.
 
     :return: None.
     """
 
+    flattened_dataset, mappings = load_training_corpus(flattened_dataset, encoding=encoding, verbose=verbose)
+
     # Generate Training Sequences
     inputs, targets, vocabulary_size = generate_training_sequences(sequence_length=SEQUENCE_LENGTH,
                                                                    songs_dataset_string=flattened_dataset,
+                                                                   mappings_dictionary=mappings,
+                                                                   max_padding_fraction=max_padding_fraction,
+                                                                   max_windows_per_song=max_windows_per_song,
+                                                                   song_weights=song_weights,
                                                                    verbose=True)
+    if verbose and (max_padding_fraction is not None or max_windows_per_song is not None or song_weights is not None):
+        steps = training_steps_saved(all_windows=len(flattened_dataset.split()) - SEQUENCE_LENGTH,
+                                     sampled_windows=len(targets), batch_size=batch_size)
+        print(f"Song-aware sampling uses {steps['sampled_steps']} training steps per epoch instead of "
+              f"{steps['all_windows_steps']}, saving {steps['steps_saved']}.")
 
-    # Build network (Checking if a checkpoint exists)
-    checkpoint_path = "model-resources/Model Checkpoints/cp-{epoch:04d}.ckpt"
-    latest_checkpoint = tf.train.latest_checkpoint("model-resources/Model Checkpoints")
-    if latest_checkpoint:
+    # Build network
+    model = build_model(output_units=vocabulary_size, loss_fn=loss_fn, num_units=num_units,
+                        learning_rate=learning_rate, jit_compile=jit_compile, mixed_precision=mixed_precision,
+                        verbose=verbose)
+
+    # Resume from the latest checkpoint (weights, optimizer state & epoch) if one exists.
+    checkpoint_manager = CheckpointManager(checkpoint_dir=checkpoint_dir, keep_last=keep_checkpoints,
+                                           monitor="loss", verbose=verbose)
+    initial_epoch = checkpoint_manager.restore_latest(model)
+    if initial_epoch >= epochs:
         if verbose:
-            print(f"Loading weights from {latest_checkpoint}")
-        model = build_model(output_units=vocabulary_size, loss_fn=loss_fn, num_units=num_units,
-                            learning_rate=learning_rate, verbose=verbose)
-        model.load_weights(latest_checkpoint)
+            print(f"Checkpoint has already completed all {epochs} epochs.")
+    elif verbose and initial_epoch == 0:
+        print("Starting training from scratch...")
+
+    # Train model
+    model.fit(inputs, targets, epochs=epochs, initial_epoch=initial_epoch, batch_size=batch_size,
+              callbacks=[checkpoint_manager])
+
+    # Save Model
+    atomic_save_model(model, model_path)
+    save_vocabulary(mappings, vocabulary_path_for_model(model_path))
+
+
+class EpochTimer(keras.callbacks.Callback):
+    """Records the wall time of every training epoch, used to compare training modes."""
+
+    def __init__(self):
+        super().__init__()
+        self.epoch_times = []
+        self._epoch_start = None
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self._epoch_start = time.perf_counter()
+
+    def on_epoch_end(self, epoch, logs=None):
+        self.epoch_times.append(time.perf_counter() - self._epoch_start)
+
+
+def make_training_dataset(int_songs: np.ndarray, sequence_length: int, vocabulary_size: int, batch_size: int,
+                          num_shards: int = 1, shard_index: int = 0, shuffle: bool = True,
+                          window_offsets: np.ndarray = None) -> tf.data.Dataset:
+    """
+    Creates a tf.data pipeline of one-hot encoded training sequences and targets from an integer encoded corpus.
+    Unlike generate_training_sequences, windows are sliced and one-hot encoded lazily per batch,
+    so the whole one-hot encoded dataset never needs to fit in memory.
+    The window offsets are sharded before shuffling, so each worker trains on a distinct part of the corpus.
+    When sharded, the offsets are trimmed to a multiple of num_shards * batch_size and every batch is full, so every
+    worker runs the same number of steps, a worker with an extra step would block the others' gradient all-reduce.
+    A memory-mapped corpus (np.load(..., mmap_mode="r")) is sliced in place rather than copied into a tensor,
+    so processes sharing the file only ever read the windows they train on.
+
+    :param int_songs: The integer representation of the flattened dataset, in memory or memory-mapped.
+    :param sequence_length: The sequence length which the LSTM will use to predict its next note.
+    :param vocabulary_size: The size of the vocabulary, used for one-hot encoding.
+    :param batch_size: The batch size of the returned dataset.
+    :param num_shards: The number of shards (workers) the dataset is split between. Default is 1.
+    :param shard_index: The index of this worker's shard. Default is 0.
+    :param shuffle: Whether to shuffle the sequences every epoch. Default is True.
+    :param window_offsets: Only use windows starting at these offsets, e.g. from sample_training_windows or a
+    train/validation split. Default is None, a window at every offset.
+
+    :return: The batched dataset of (inputs, targets).
+    """
+    if window_offsets is None:
+        windows_amount = len(int_songs) - sequence_length
+        window_offsets = tf.data.Dataset.range(windows_amount)
     else:
-        if verbose:
-            print("Starting training from scratch...")
+        windows_amount = len(window_offsets)
+        window_offsets = tf.data.Dataset.from_tensor_slices(np.asarray(window_offsets, dtype=np.int64))
+    if num_shards > 1:
+        window_offsets = window_offsets.take(windows_amount - windows_amount % (num_shards * batch_size))
+    window_offsets = window_offsets.shard(num_shards, shard_index)
+    if shuffle:
+        window_offsets = window_offsets.shuffle(buffer_size=100_000, reshuffle_each_iteration=True)
+
+    if isinstance(int_songs, np.memmap):
+        window_range = np.arange(sequence_length + 1)
+
+        def slice_windows(offsets):
+            # Fancy indexing a memmap only reads the pages these windows sit on.
+            return np.asarray(int_songs[offsets[:, np.newaxis] + window_range], dtype=np.int32)
+
+        def gather_windows(offsets):
+            windows = tf.numpy_function(slice_windows, [offsets], tf.int32)
+            windows.set_shape([None, sequence_length + 1])
+            return windows
+    else:
+        corpus = tf.constant(int_songs, dtype=tf.int32)
+
+        def gather_windows(offsets):
+            indices = offsets[:, tf.newaxis] + tf.range(sequence_length + 1, dtype=tf.int64)[tf.newaxis, :]
+            return tf.gather(corpus, indices)
+
+    def to_training_pair(offsets):
+        # offsets has shape (batch,), gather (batch, sequence_length + 1) symbols at once.
+        windows = gather_windows(offsets)
+        return tf.one_hot(windows[:, :-1], vocabulary_size), windows[:, -1]
+
+    dataset = window_offsets.batch(batch_size, drop_remainder=num_shards > 1)
+    dataset = dataset.map(to_training_pair, num_parallel_calls=tf.data.AUTOTUNE)
+
+    # Sharding has already been done by hand, stop tf.distribute from sharding again.
+    options = tf.data.Options()
+    options.experimental_distribute.auto_shard_policy = tf.data.experimental.AutoShardPolicy.OFF
+    return dataset.with_options(options).prefetch(tf.data.AUTOTUNE)
+
+
+def make_tf_config(worker_addresses: List[str], worker_index: int) -> str:
+    """
+    Creates the TF_CONFIG environment variable used by MultiWorkerMirroredStrategy.
+    :param worker_addresses: The host:port address of every worker, the first worker is the chief.
+    :param worker_index: The index of this worker in worker_addresses.
+    :return: The TF_CONFIG JSON string.
+    """
+    return json.dumps({"cluster": {"worker": worker_addresses},
+                       "task": {"type": "worker", "index": worker_index}})
+
+
+def train_distributed(loss_fn: str, num_units: List[int], learning_rate: float, epochs: int, batch_size: int,
+                      worker_addresses: List[str], worker_index: int, model_path: str = MODEL_FILEPATH,
+                      flattened_dataset: str = None, backup_dir: str = DISTRIBUTED_BACKUP_DIR,
+                      encoding: str = "time_series", verbose: bool = False) -> Dict[str, float]:
+    """
+    Data-parallel training across processes (on one machine or several) using MultiWorkerMirroredStrategy.
+    Every worker runs this function with the same arguments apart from worker_index.
+    Each worker trains on its own shard of the corpus, and gradients are all-reduced between workers every step.
+    Training state is backed up every epoch, so restarting the workers resumes from the last completed epoch.
+    Only the chief (worker 0) saves the final model to model_path.
+
+    :param loss_fn: The loss function being used for training.
+    :param num_units: The number of hidden layers in the network, in a list format where each element
+    represents a hidden layer.
+    :param learning_rate: The learning rate the model uses.
+    :param epochs: The number of epochs used to train the model.
+    :param batch_size: The per-worker batch size, the global batch size is batch_size * number of workers.
+    :param worker_addresses: The host:port address of every worker, the first worker is the chief.
+    :param worker_index: The index of this worker in worker_addresses.
+    :param model_path: The path which the model shall be saved to.
+    :param flattened_dataset: The flattened dataset which the model will train off of.
+    :param backup_dir: The directory used to back up and restore training state.
+    :param encoding: The symbol encoding to train on, "time_series" or "events", see load_training_corpus.
+    :param verbose: Enable additional print statements for debug purposes. Default is False.
+
+    :return: A dictionary of the total training time and the mean epoch time in seconds.
+    """
+
+    # The cluster must be configured before the strategy is created.
+    os.environ["TF_CONFIG"] = make_tf_config(worker_addresses, worker_index)
+    strategy = tf.distribute.MultiWorkerMirroredStrategy()
+    num_workers = strategy.num_replicas_in_sync
+    is_chief = worker_index == 0
+
+    flattened_dataset, mappings = load_training_corpus(flattened_dataset, encoding=encoding,
+                                                       verbose=verbose and is_chief)
+    int_songs = np.array(convert_songs_to_int(flattened_songs_string=flattened_dataset, mappings_dictionary=mappings))
+    vocabulary_size = len(mappings)
+
+    dataset = make_training_dataset(int_songs, sequence_length=SEQUENCE_LENGTH, vocabulary_size=vocabulary_size,
+                                    batch_size=batch_size, num_shards=len(worker_addresses), shard_index=worker_index)
+
+    with strategy.scope():
         model = build_model(output_units=vocabulary_size, loss_fn=loss_fn, num_units=num_units,
-                            learning_rate=learning_rate, verbose=verbose)
+                            learning_rate=learning_rate, verbose=verbose and is_chief)
 
-    # Checkpoints
-    checkpoint_callback = keras.callbacks.ModelCheckpoint(
-        filepath=checkpoint_path,
-        save_weights_only=False,
-        verbose=1
-    )
+    # Every worker is given the same directory, Keras restores all workers from the chief's backup and sends the other
+    # workers' writes to temporary directories, so every worker resumes from the same epoch.
+    timer = EpochTimer()
+    callbacks = [keras.callbacks.BackupAndRestore(backup_dir=backup_dir), timer]
 
-    # Train model
-    model.fit(inputs, targets, epochs=epochs, batch_size=batch_size, callbacks=[checkpoint_callback])
+    start = time.perf_counter()
+    model.fit(dataset, epochs=epochs, callbacks=callbacks, verbose=1 if verbose and is_chief else 0)
+    total_time = time.perf_counter() - start
 
-    # Save Model
-    model.save(model_path)
+    # Every worker must take part in saving, but only the chief's copy is kept.
+    if is_chief:
+        atomic_save_model(model, model_path)
+        save_vocabulary(mappings, vocabulary_path_for_model(model_path))
+    else:
+        with tempfile.TemporaryDirectory() as temporary_dir:
+            model.save(os.path.join(temporary_dir, os.path.basename(model_path)))
+
+    if verbose and is_chief:
+        print(f"Distributed training across {num_workers} workers complete in {total_time:.1f}s.")
+
+    return {"workers": num_workers, "total_time_s": total_time,
+            "mean_epoch_time_s": float(np.mean(timer.epoch_times)) if timer.epoch_times else 0.0}
+
+
+def launch_local_workers(num_workers: int, epochs: int, batch_size: int, model_path: str = MODEL_FILEPATH,
+                         first_port: int = FIRST_WORKER_PORT, backup_dir: str = DISTRIBUTED_BACKUP_DIR,
+                         encoding: str = "time_series") -> Dict[str, float]:
+    """
+    Runs distributed training on this machine by starting one worker process per CPU core (or as requested).
+    To train across several machines instead, run training.py --worker-index i --workers host:port,... on each one.
+
+    :param num_workers: The number of worker processes to start.
+    :param epochs: The number of epochs used to train the model.
+    :param batch_size: The per-worker batch size.
+    :param model_path: The path which the model shall be saved to.
+    :param first_port: The port of the first worker, each worker uses the next port along.
+    :param backup_dir: The directory used to back up and restore training state.
+    :param encoding: The symbol encoding to train on, "time_series" or "events".
+
+    :return: The chief's training results.
+    """
+    worker_addresses = [f"localhost:{first_port + i}" for i in range(num_workers)]
+
+    with tempfile.TemporaryDirectory() as results_dir:
+        results_path = os.path.join(results_dir, "results.json")
+        workers = []
+        for worker_index in range(num_workers):
+            command = [sys.executable, os.path.abspath(__file__),
+                       "--workers", ",".join(worker_addresses),
+                       "--worker-index", str(worker_index),
+                       "--epochs", str(epochs),
+                       "--batch-size", str(batch_size),
+                       "--model-path", model_path,
+                       "--results-path", results_path,
+                       "--backup-dir", backup_dir,
+                       "--encoding", encoding]
+            workers.append(subprocess.Popen(command))
+
+        return_codes = [worker.wait() for worker in workers]
+        if any(return_codes):
+            raise RuntimeError(f"Distributed training failed, worker return codes: {return_codes}")
+
+        with open(results_path, "r") as fp:
+            return json.load(fp)
+
+
+def report_speedup(single_process_results: Dict[str, float], distributed_results: Dict[str, float]) -> float:
+    """
+    Prints and returns the speedup of distributed training over single-process training, based on epoch times.
+    :param single_process_results: The results of training with a single worker.
+    :param distributed_results: The results of training with multiple workers.
+    :return: The speedup, e.g. 3.2 means distributed epochs were 3.2 times faster.
+    """
+    speedup = single_process_results["mean_epoch_time_s"] / distributed_results["mean_epoch_time_s"]
+    print(f"Single process: {single_process_results['mean_epoch_time_s']:.1f}s per epoch, "
+          f"{distributed_results['workers']} workers: {distributed_results['mean_epoch_time_s']:.1f}s per epoch. "
+          f"Speedup: {speedup:.2f}x ({speedup / distributed_results['workers']:.0%} scaling efficiency).")
+    return speedup
 
 
 def main():
@@ -155,5 +489,55 @@ def main():
           )
 
 
+def distributed_main():
+    """
+    Command line entry point for distributed training, expects the dataset to have already been preprocessed.
+    """
+    parser = argparse.ArgumentParser(description="Data-parallel LSTM training.")
+    parser.add_argument("--num-workers", type=int, help="Start this many local worker processes.")
+    parser.add_argument("--workers", help="Comma separated host:port of every worker, when running a single worker.")
+    parser.add_argument("--worker-index", type=int, default=0, help="This worker's index in --workers.")
+    parser.add_argument("--epochs", type=int, default=16)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Per-worker batch size.")
+    parser.add_argument("--model-path", default=MODEL_FILEPATH)
+    parser.add_argument("--results-path", help="Where the chief writes its timing results.")
+    parser.add_argument("--backup-dir", default=DISTRIBUTED_BACKUP_DIR,
+                        help="Where training state is backed up, shared by every worker.")
+    parser.add_argument("--encoding", choices=ENCODINGS, default="time_series",
+                        help="Train on a symbol per 16th note, or a symbol per note.")
+    parser.add_argument("--compare-single", action="store_true",
+                        help="Also train with a single worker and report the speedup.")
+    args = parser.parse_args()
+    if not args.num_workers and not args.workers:
+        parser.error("either --num-workers or --workers is required.")
+
+    if args.num_workers:
+        distributed_results = launch_local_workers(args.num_workers, args.epochs, args.batch_size, args.model_path,
+                                                   backup_dir=args.backup_dir, encoding=args.encoding)
+        if args.compare_single:
+            # Its own ports & backup, so it neither collides with the workers above nor resumes from their state.
+            with tempfile.TemporaryDirectory() as comparison_dir:
+                single_process_results = launch_local_workers(1, args.epochs, args.batch_size,
+                                                              os.path.join(comparison_dir, "single_model.h5"),
+                                                              first_port=FIRST_WORKER_PORT + args.num_workers,
+                                                              backup_dir=os.path.join(comparison_dir, "backup"),
+                                                              encoding=args.encoding)
+            report_speedup(single_process_results, distributed_results)
+        return
+
+    results = train_distributed(loss_fn=LOSS_FN, num_units=NUM_UNITS, learning_rate=LEARNING_RATE,
+                                epochs=args.epochs, batch_size=args.batch_size,
+                                worker_addresses=args.workers.split(","), worker_index=args.worker_index,
+                                model_path=args.model_path, backup_dir=args.backup_dir, encoding=args.encoding,
+                                verbose=True)
+    if args.results_path and args.worker_index == 0:
+        with open(args.results_path, "w") as fp:
+            json.dump(results, fp)
+
+
 if __name__ == "__main__":
-    main()
+    # Any arguments select distributed training, otherwise run the full preprocessing & training pipeline.
+    if len(sys.argv) > 1:
+        distributed_main()
+    else:
+        main()